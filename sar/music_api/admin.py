@@ -1,10 +1,11 @@
 from django.contrib import admin
-from .models import Song, Album, Comment, Updates, Track
+from .models import Song, Album, Comment, Updates, Track, IngestionJob
 
 admin.site.register(Song)
 admin.site.register(Album)
 admin.site.register(Comment)
 admin.site.register(Updates)
 admin.site.register(Track)
+admin.site.register(IngestionJob)
 
 # Register your models here.
@@ -0,0 +1,399 @@
+import asyncio
+import base64
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.db.models import DateField, ExpressionWrapper, F, IntegerField, Max
+from django.db.models.functions import Cast
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from sar.schema import schema
+from sar.views import AsyncSarGraphQLView, SarGraphQLView
+
+from .models import Album, Comment, Song, Track, Updates
+from .versions import rebuild_version_groups
+from .views import AddSongView
+
+WORDS = (
+    'night', 'ocean', 'city', 'light', 'summer', 'heart', 'road', 'fire', 'rain', 'dream',
+    'river', 'echo', 'shadow', 'golden', 'silent', 'wild', 'neon', 'winter', 'home', 'stars',
+)
+
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def make_synthetic_catalog(albums, songs_per_album, comments_per_song=0, updates=0, alternatives=0, seed=0, batch_size=1000):
+    """
+    Bulk inserts a reproducible catalog of ``albums`` albums with
+    ``songs_per_album`` songs each, their tracks, comments and updates.
+    About ``alternatives`` of the songs and albums get an alternative, and
+    updates reference a few of them. Returns the number of rows created by
+    model name.
+    """
+    rng = random.Random(seed)
+    first_release = date(2000, 1, 1)
+
+    def release_date():
+        # Some unreleased songs and albums, whose null dates sort first
+        if rng.random() < 0.02:
+            return None
+        return first_release + timedelta(days=rng.randrange(9000))
+
+    created_albums = Album.objects.bulk_create([
+        Album(
+            title=words(rng, 2).title(), artwork='https://example.com/album.png', release_date=release_date(),
+            ep=rng.random() < 0.2, note=words(rng, 12),
+        )
+        for _ in range(albums)
+    ], batch_size=batch_size)
+
+    created_songs = Song.objects.bulk_create([
+        Song(
+            title=words(rng, 3).title(), artwork='https://example.com/song.png', release_date=release_date(),
+            duration=rng.randrange(90, 420), lyrics=words(rng, 80), features=words(rng, 1), note=words(rng, 6),
+            mp3='https://example.com/song.mp3', wav='https://example.com/song.wav', flac='https://example.com/song.flac',
+        )
+        for _ in range(albums * songs_per_album)
+    ], batch_size=batch_size)
+
+    links = []
+    tracks = []
+    for index, song in enumerate(created_songs):
+        album = created_albums[index // songs_per_album]
+        links.append(Song.albums.through(song_id=song.id, album_id=album.id))
+        tracks.append(Track(song_id=song.id, album_id=album.id, track_number=index % songs_per_album + 1))
+    Song.albums.through.objects.bulk_create(links, batch_size=batch_size)
+    Track.objects.bulk_create(tracks, batch_size=batch_size)
+
+    comments = Comment.objects.bulk_create([
+        Comment(text=words(rng, 15), nickname=words(rng, 1), song_id=song.id)
+        for song in created_songs for _ in range(comments_per_song)
+    ], batch_size=batch_size)
+    # auto_now would give every comment the same day
+    Comment.objects.filter(pk__in=[comment.pk for comment in comments]).update(
+        date=ExpressionWrapper(F('date') - Cast(F('id') % 365, IntegerField()), output_field=DateField()),
+    )
+
+    song_links = link_alternatives(rng, Song, created_songs, alternatives, batch_size)
+    album_links = link_alternatives(rng, Album, created_albums, alternatives, batch_size)
+
+    created_updates = Updates.objects.bulk_create([
+        Updates(title=words(rng, 3).title(), content=words(rng, 40)) for _ in range(updates)
+    ], batch_size=batch_size)
+    Updates.references_songs.through.objects.bulk_create([
+        Updates.references_songs.through(updates_id=update.id, song_id=song.id)
+        for update in created_updates for song in rng.sample(created_songs, min(3, len(created_songs)))
+    ], batch_size=batch_size)
+
+    return {
+        'album': len(created_albums),
+        'song': len(created_songs),
+        'track': len(tracks),
+        'alternative': song_links + album_links,
+        'comment': len(comments),
+        'updates': len(created_updates),
+    }
+
+
+def link_alternatives(rng, model, objects, share, batch_size):
+    # The symmetrical relation stores both directions of each link
+    through = model.alternatives.through
+    pairs = set()
+    if len(objects) > 1:
+        for obj in rng.sample(objects, int(len(objects) * share)):
+            other = rng.choice(objects)
+            if other is not obj:
+                pairs |= {(obj.id, other.id), (other.id, obj.id)}
+
+    prefix = model._meta.model_name
+    through.objects.bulk_create([
+        through(**{f'from_{prefix}_id': from_id, f'to_{prefix}_id': to_id}) for from_id, to_id in pairs
+    ], batch_size=batch_size)
+    rebuild_version_groups(model, batch_size)
+    return len(pairs) // 2
+
+
+def hot_queries():
+    """
+    Returns the querysets behind the catalog's most frequent reads and
+    writes, as sar.schema and music_api.signals run them, by name.
+    """
+    song = Song.objects.order_by('?').first()
+    album = Album.objects.order_by('?').first()
+    album_ids = list(Album.objects.order_by('?').values_list('pk', flat=True)[:20])
+
+    def newest(queryset, column):
+        return queryset.order_by(F(column).desc(nulls_first=True), F('id').desc())[:101]
+
+    return {
+        'all_songs_page': newest(Song.objects.only('id', 'title', 'release_date'), 'release_date'),
+        'all_albums_page': newest(Album.objects.only('id', 'title', 'release_date'), 'release_date'),
+        'updates_page': newest(Updates.objects.all(), 'date'),
+        'album_tracks': Track.objects.filter(album_id__in=album_ids).select_related('song').order_by('track_number'),
+        'track_by_pair': Track.objects.filter(album_id=album.pk, song_id=song.pk),
+        'last_track_numbers': (
+            Track.objects.filter(album_id__in=album_ids).order_by().values('album_id').annotate(last=Max('track_number'))
+        ),
+        'song_albums': Song.albums.through.objects.filter(song_id=song.pk),
+        'song_comments': Comment.objects.filter(song_id=song.pk).order_by('-date', '-id')[:20],
+    }
+
+
+def explain(queryset):
+    return queryset.explain(analyze=True)
+
+
+def time_query(queryset, repeat):
+    """
+    Returns the latencies in milliseconds of evaluating ``queryset`` ``repeat`` times.
+    """
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back(keep=False):
+    """
+    Runs the block in a transaction that is rolled back unless ``keep`` is
+    set, so benchmarks leave the database as they found it.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            if not keep:
+                raise Rollback
+    except Rollback:
+        pass
+
+
+# A 1x1 PNG for the artwork of uploaded songs
+PNG = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+def graphql_operation(query, variables=None, user=None):
+    def run():
+        request = RequestFactory().post('/graphql/')
+        request.user = user or AnonymousUser()
+        result = schema.execute(query, variable_values=variables, context_value=request)
+        if result.errors:
+            raise result.errors[0]
+    return run
+
+
+def upload_song_operation(user):
+    view = AddSongView.as_view()
+
+    def run():
+        request = APIRequestFactory().post('/api/add-song/', {
+            'title': 'Benchmark',
+            'artwork': SimpleUploadedFile('cover.png', PNG, content_type='image/png'),
+            'mp3': SimpleUploadedFile('song.mp3', b'\xff\xfb\x90\x00' + bytes(64 * 1024)),
+        }, format='multipart')
+        force_authenticate(request, user)
+        response = view(request)
+        if response.status_code != 202:
+            raise Exception(f'Uploading a song failed: {response.data}')
+    return run
+
+
+def read_queries():
+    """
+    Returns the query and variables of representative GraphQL reads by name,
+    for the catalog in the database.
+    """
+    song = Song.objects.order_by('?').first()
+    return {
+        'all_albums': (
+            '{ allAlbums(first: 20) { edges { node { id title duration numberOfSongs songs { title trackNumber } } } } }', None,
+        ),
+        'all_songs': (
+            '{ allSongs(first: 50) { edges { node { id title releaseDate albums { title } alternatives { title } } } } }', None,
+        ),
+        'song': (
+            'query Song($id: Int) { song(id: $id) { title lyrics albums { title } alternatives { title } commentSet { nickname text } } }',
+            {'id': song.id if song else None},
+        ),
+        'search': (
+            '{ search(query: "ocean night", first: 20) { edges { node { rank snippet song { title } album { title } } } } }', None,
+        ),
+        'updates': (
+            '{ updates(first: 20) { edges { node { title content referencesSongs { title } } } } }', None,
+        ),
+    }
+
+
+def api_operations(user):
+    """
+    Returns the representative GraphQL operations and REST uploads by name,
+    for the catalog in the database.
+    """
+    album = Album.objects.order_by('?').first()
+    tracklist = list(Track.objects.filter(album=album).order_by('-track_number').values_list('song_id', flat=True))
+
+    operations = {name: graphql_operation(query, variables) for name, (query, variables) in read_queries().items()}
+    operations.update({
+        'set_album_tracklist': graphql_operation(
+            'mutation Tracklist($album: ID!, $songs: [ID!]!) { setAlbumTracklist(albumId: $album, songIds: $songs) { album { id } } }',
+            {'album': album.id, 'songs': tracklist}, user,
+        ),
+        'upload_song': upload_song_operation(user),
+    })
+    return operations
+
+
+def measure(run, repeat):
+    """
+    Returns the p50 and p95 latency in milliseconds of ``repeat`` runs after
+    a warm up run, the most SQL queries a run made, and the peak memory in
+    KiB allocated by a run.
+    """
+    run()
+    latencies = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            run()
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, len(captured))
+
+    # Measured apart, as tracing allocations slows every run down
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'queries': queries,
+        'memory_kib': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a description of every regression of ``results`` against
+    ``baseline``: any operation missing from the baseline, any extra query,
+    or latency and memory over the baseline by more than ``tolerance``.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            regressions.append(f'{name} is missing from the baseline')
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(f'{name} made {result["queries"]} queries, {expected["queries"]} in the baseline')
+        for metric in ('p95_ms', 'memory_kib'):
+            if result[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(f'{name} {metric} is {result[metric]}, {expected[metric]} in the baseline')
+    return regressions
+
+
+def load_summary(latencies, elapsed):
+    return {
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+    }
+
+
+def check_response(response):
+    if response.status_code != 200 or b'"errors"' in response.content:
+        raise Exception(f'GraphQL request failed: {response.content.decode()}')
+
+
+def wsgi_load(bodies, concurrency):
+    """
+    Posts ``bodies`` to SarGraphQLView from ``concurrency`` threads, as a
+    threaded WSGI server would, with the response cache off. Returns the
+    throughput and latencies.
+    """
+    view = csrf_exempt(SarGraphQLView.as_view(cache_timeout=0))
+    latencies = []
+    errors = []
+
+    def worker(share):
+        try:
+            for body in share:
+                request = RequestFactory().post('/graphql/', body, content_type='application/json')
+                request.user = AnonymousUser()
+                started = time.perf_counter()
+                check_response(view(request))
+                latencies.append((time.perf_counter() - started) * 1000)
+        except Exception as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(bodies[index::concurrency],)) for index in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return load_summary(latencies, elapsed)
+
+
+def asgi_load(bodies, concurrency):
+    """
+    Posts ``bodies`` to AsyncSarGraphQLView from ``concurrency`` tasks on one
+    event loop, as an ASGI server would, with the response cache off.
+    Returns the throughput and latencies.
+    """
+    view = csrf_exempt(AsyncSarGraphQLView.as_view(cache_timeout=0))
+    latencies = []
+
+    async def worker(share):
+        for body in share:
+            request = AsyncRequestFactory().post('/graphql/', body, content_type='application/json')
+            request.user = AnonymousUser()
+            # Like the ASGI handler, each request runs its synchronous code in a thread of its own
+            async with ThreadSensitiveContext():
+                started = time.perf_counter()
+                try:
+                    check_response(await view(request))
+                finally:
+                    await sync_to_async(connections.close_all)()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    async def run():
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(bodies[index::concurrency]) for index in range(concurrency)])
+        return time.perf_counter() - started
+
+    return load_summary(latencies, asyncio.run(run()))
@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.db import transaction
+
+TAG_KEY = 'graphql:tag:{}'
+STATS_KEY = 'graphql:stats:{}'
+COMMENTS_KEY = 'comments:{}:{}:{}'
+# Comment threads are invalidated on every write, the timeout only clears
+# out the entries of past versions
+COMMENTS_TIMEOUT = 60 * 60 * 24
+
+# Writes to a model also change what is served for the models listed here
+DEPENDENT_TAGS = {
+    'song': ('song', 'album', 'track'),
+    'album': ('album', 'song', 'track'),
+    'track': ('track', 'song', 'album'),
+    'comment': ('comment',),
+    'updates': ('updates',),
+}
+
+def get_tag_versions(tags):
+    keys = {tag: TAG_KEY.format(tag) for tag in tags}
+    versions = cache.get_many(keys.values())
+    return {tag: versions.get(key, 0) for tag, key in keys.items()}
+
+def invalidate(*tags):
+    # Cached responses embed the versions of their tags in the key, so bumping
+    # a version orphans every response that depended on it. Bumped once the
+    # writes commit, a request reading the old rows in between would cache
+    # them under the new version
+    transaction.on_commit(lambda: bump(tags))
+
+def bump(tags):
+    for tag in tags:
+        increment(TAG_KEY.format(tag))
+
+def invalidate_model(model_name):
+    invalidate(*DEPENDENT_TAGS.get(model_name, (model_name,)))
+
+def increment(key):
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+def record(event):
+    increment(STATS_KEY.format(event))
+
+def get_stats():
+    stats = cache.get_many([STATS_KEY.format('hits'), STATS_KEY.format('misses')])
+    hits = stats.get(STATS_KEY.format('hits'), 0)
+    misses = stats.get(STATS_KEY.format('misses'), 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0,
+    }
+
+def comments_tag(song_id):
+    return f'comments-{song_id}'
+
+def comments_key(song_id):
+    """
+    Returns a format string for the cache keys of the current comments of a song.
+    """
+    tag = comments_tag(song_id)
+    return COMMENTS_KEY.format(song_id, get_tag_versions([tag])[tag], '{}')
+
+def get_or_compute(key, compute, timeout):
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, timeout)
+    return value
@@ -0,0 +1,197 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .cache import invalidate_model
+from .models import Album, Song, Track
+from .signals import add_tracks, lock_albums, remove_tracks
+from .versions import regroup
+
+SONG_FIELDS = ('title', 'note', 'lyrics', 'features', 'youtube')
+
+
+def check_ids(model, ids, found):
+    missing = sorted(set(ids) - set(found))
+    if missing:
+        raise Exception(f'{model._meta.verbose_name_plural.capitalize()} do not exist: {", ".join(map(str, missing))}')
+
+
+def check_unique(ids, name):
+    if len(set(ids)) != len(ids):
+        raise Exception(f'Each {name} can only be given once')
+
+
+def adjust_albums(deltas):
+    """
+    Adds the (duration, count) delta of each album to its aggregates in one query.
+    """
+    deltas = {album_id: delta for album_id, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return
+
+    def change(index):
+        return Case(
+            *[When(pk=album_id, then=Value(delta[index])) for album_id, delta in deltas.items()],
+            default=Value(0), output_field=IntegerField(),
+        )
+
+    Album.objects.filter(pk__in=deltas).update(
+        total_duration=F('total_duration') + change(0),
+        track_count=F('track_count') + change(1),
+    )
+
+
+def change_album_links(added, removed, durations):
+    """
+    Links and unlinks (song id, album id) pairs with bulk queries, keeping
+    tracks and album aggregates up to date like the m2m_changed receivers.
+    ``durations`` holds the duration of every song involved.
+    """
+    if not added and not removed:
+        return
+
+    through = Song.albums.through
+    lock_albums({album_id for _, album_id in added | removed})
+
+    deltas = defaultdict(lambda: (0, 0))
+    if removed:
+        remove_tracks(removed)
+        query = Q()
+        for song_id, album_id in removed:
+            query |= Q(song_id=song_id, album_id=album_id)
+        through.objects.filter(query).delete()
+        for song_id, album_id in removed:
+            duration, count = deltas[album_id]
+            deltas[album_id] = (duration - durations[song_id], count - 1)
+
+    if added:
+        through.objects.bulk_create([through(song_id=song_id, album_id=album_id) for song_id, album_id in added])
+        add_tracks(added)
+        for song_id, album_id in added:
+            duration, count = deltas[album_id]
+            deltas[album_id] = (duration + durations[song_id], count + 1)
+
+    adjust_albums(deltas)
+
+
+def alternative_rows(edges):
+    # The symmetrical alternatives relation stores both directions of a link
+    rows = set()
+    for edge in edges:
+        first, *rest = edge
+        second = rest[0] if rest else first
+        rows |= {(first, second), (second, first)}
+    return rows
+
+
+def set_song_alternatives(wanted):
+    """
+    Replaces the alternatives of the songs in ``wanted``, in order, so the
+    last change wins when two songs disagree about their link.
+    """
+    through = Song.alternatives.through
+    existing = set(
+        through.objects.filter(Q(from_song_id__in=wanted) | Q(to_song_id__in=wanted))
+        .values_list('from_song_id', 'to_song_id')
+    )
+
+    edges = {frozenset(row) for row in existing}
+    for song_id, alternative_ids in wanted.items():
+        edges = {edge for edge in edges if song_id not in edge} | {frozenset((song_id, pk)) for pk in alternative_ids}
+
+    rows = alternative_rows(edges)
+    removed = existing - rows
+    if removed:
+        query = Q()
+        for from_song_id, to_song_id in removed:
+            query |= Q(from_song_id=from_song_id, to_song_id=to_song_id)
+        through.objects.filter(query).delete()
+    through.objects.bulk_create([
+        through(from_song_id=from_song_id, to_song_id=to_song_id) for from_song_id, to_song_id in rows - existing
+    ])
+    regroup(Song, {pk for row in rows ^ existing for pk in row})
+
+
+@transaction.atomic
+def modify_songs(changes):
+    """
+    Applies ``changes``, dicts of a song ``id`` and the fields to change, with
+    a query per model to check ids and bulk queries for the changes.
+    ``albums`` and ``alternatives`` replace the song's links, None leaves a
+    field unchanged. Returns the modified songs in order.
+    """
+    song_ids = [int(change['id']) for change in changes]
+    check_unique(song_ids, 'song')
+    album_ids = {int(pk) for change in changes for pk in change.get('albums') or ()}
+    alternative_ids = {int(pk) for change in changes for pk in change.get('alternatives') or ()}
+
+    songs = Song.objects.select_for_update().in_bulk(set(song_ids) | alternative_ids)
+    check_ids(Song, set(song_ids) | alternative_ids, songs)
+    if album_ids:
+        check_ids(Album, album_ids, Album.objects.filter(pk__in=album_ids).values_list('pk', flat=True))
+
+    fields = set()
+    wanted_albums = {}
+    wanted_alternatives = {}
+    for song_id, change in zip(song_ids, changes):
+        song = songs[song_id]
+        for field in SONG_FIELDS:
+            if change.get(field) is not None:
+                setattr(song, field, change[field])
+                fields.add(field)
+        if change.get('albums') is not None:
+            wanted_albums[song_id] = {int(pk) for pk in change['albums']}
+        if change.get('alternatives') is not None:
+            wanted_alternatives[song_id] = {int(pk) for pk in change['alternatives']}
+
+    modified = [songs[song_id] for song_id in song_ids]
+    if fields:
+        Song.objects.bulk_update(modified, sorted(fields))
+
+    if wanted_albums:
+        existing = set(Song.albums.through.objects.filter(song_id__in=wanted_albums).values_list('song_id', 'album_id'))
+        wanted = {(song_id, album_id) for song_id, album_ids in wanted_albums.items() for album_id in album_ids}
+        change_album_links(wanted - existing, existing - wanted, {song_id: songs[song_id].duration for song_id in songs})
+
+    if wanted_alternatives:
+        set_song_alternatives(wanted_alternatives)
+
+    # Bulk queries do not send the signals that invalidate cached responses
+    invalidate_model('song')
+    return modified
+
+
+@transaction.atomic
+def set_album_tracklist(album_id, song_ids):
+    """
+    Makes ``song_ids`` the songs of the album, numbered in that order.
+    Returns the album with its ``tracks`` and their songs attached.
+    """
+    song_ids = [int(pk) for pk in song_ids]
+    check_unique(song_ids, 'song')
+
+    # Locked first, so that the links read below stay current
+    album = Album.objects.select_for_update().get(pk=album_id)
+    songs = Song.objects.in_bulk(song_ids)
+    check_ids(Song, song_ids, songs)
+
+    durations = dict(Song.albums.through.objects.filter(album=album).values_list('song_id', 'song__duration'))
+    existing = {(song_id, album.pk) for song_id in durations}
+    wanted = {(song_id, album.pk) for song_id in song_ids}
+    durations.update((song_id, song.duration) for song_id, song in songs.items())
+    change_album_links(wanted - existing, existing - wanted, durations)
+
+    numbers = {song_id: number for number, song_id in enumerate(song_ids, 1)}
+    tracks = list(Track.objects.filter(album=album))
+    moved = [track for track in tracks if track.track_number != numbers[track.song_id]]
+    for track in tracks:
+        track.track_number = numbers[track.song_id]
+        track.song = songs[track.song_id]
+    Track.objects.bulk_update(moved, ['track_number'])
+
+    album.total_duration = sum(song.duration for song in songs.values())
+    album.track_count = len(songs)
+    album.tracks = sorted(tracks, key=lambda track: track.track_number)
+    invalidate_model('track')
+    return album
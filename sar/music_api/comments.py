@@ -0,0 +1,74 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .cache import comments_tag, invalidate, invalidate_model
+from .models import Comment, Song
+
+logger = logging.getLogger(__name__)
+
+
+@transaction.atomic
+def save_comments(comments):
+    """
+    Inserts ``comments`` with one query and invalidates what they change,
+    dropping the ones whose song no longer exists. Returns the saved comments.
+    """
+    song_ids = set(Song.objects.filter(pk__in={comment.song_id for comment in comments}).values_list('pk', flat=True))
+    comments = Comment.objects.bulk_create([comment for comment in comments if comment.song_id in song_ids])
+
+    # bulk_create does not send the signals that invalidate cached responses
+    invalidate_model('comment')
+    invalidate(*{comments_tag(comment.song_id) for comment in comments})
+    return comments
+
+
+class CommentBuffer:
+    """
+    Collects new comments and saves them together, FLUSH_INTERVAL seconds
+    after the first one or once MAX_SIZE are waiting (see COMMENT_BUFFER).
+
+    Waiting comments live in the memory of the process, the ones a crash
+    interrupts are lost.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.comments = []
+        self.timer = None
+
+    def add(self, comment):
+        options = settings.COMMENT_BUFFER
+        with self.lock:
+            self.comments.append(comment)
+            full = len(self.comments) >= options['MAX_SIZE']
+            if not full and self.timer is None:
+                self.timer = threading.Timer(options['FLUSH_INTERVAL'], self.flush_in_background)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            comments, self.comments = self.comments, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        return save_comments(comments) if comments else []
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Saving buffered comments failed')
+        finally:
+            # The timer thread has a database connection of its own
+            connection.close()
+
+
+comment_buffer = CommentBuffer()
+atexit.register(comment_buffer.flush)
@@ -0,0 +1,254 @@
+import logging
+import shutil
+import time
+import uuid
+from contextlib import ExitStack
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django_redis import get_redis_connection
+
+from .cache import invalidate_model
+from .models import IngestionJob, Song
+from .storage import get_backend, upload_files
+from .utils import get_audio_file_duration
+from .waveform import analyze_wav
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'ingestion:queue'
+DELAYED_KEY = 'ingestion:delayed'
+# Seconds between two looks for the jobs of stopped workers
+SWEEP_INTERVAL = 60
+# Jobs taken by a worker stay here until it is done with them
+PROCESSING_KEY = 'ingestion:processing'
+
+MEDIA_FIELDS = ('artwork', 'mp3', 'wav', 'flac')
+
+
+def stage_files(validated_data, staging):
+    """
+    Copies the uploaded media files to the staging directory, returning a
+    mapping of name to (staged path, storage path).
+    """
+    staging.mkdir(parents=True)
+
+    files = {}
+    for name in MEDIA_FIELDS:
+        file = validated_data.get(name)
+        if not file:
+            continue
+
+        staged = staging / f'{name}_{Path(file.name).name}'
+        with open(staged, 'wb') as output:
+            for chunk in file.chunks():
+                output.write(chunk)
+
+        if name == 'artwork':
+            path = f'artwork/song/{uuid.uuid4()}_{file.name}'
+        else:
+            path = f'{name}/{file.name}'
+        files[name] = [str(staged), path]
+    return files
+
+
+def create_job(validated_data, idempotency_key=None):
+    payload = {
+        key: value for key, value in validated_data.items()
+        if key not in MEDIA_FIELDS and key not in ('albums', 'alternatives')
+    }
+    if payload.get('release_date'):
+        payload['release_date'] = payload['release_date'].isoformat()
+    payload['albums'] = [album.pk for album in validated_data.get('albums', [])]
+    payload['alternatives'] = [song.pk for song in validated_data.get('alternatives', [])]
+
+    staging = Path(settings.INGESTION['STAGING_ROOT']) / uuid.uuid4().hex
+    try:
+        job = IngestionJob.objects.create(
+            idempotency_key=idempotency_key,
+            payload=payload,
+            files=stage_files(validated_data, staging),
+        )
+    except Exception:
+        # No job would ever remove them, as when the idempotency key is taken
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    transaction.on_commit(lambda: enqueue(job.pk))
+    return job
+
+
+def enqueue(job_id, delay=0):
+    redis = get_redis_connection('default')
+    if delay:
+        redis.zadd(DELAYED_KEY, {job_id: time.time() + delay})
+    else:
+        redis.lpush(QUEUE_KEY, job_id)
+
+
+def promote_delayed_jobs(redis):
+    now = time.time()
+    for job_id in redis.zrangebyscore(DELAYED_KEY, 0, now):
+        # Only the worker that removes the entry gets to requeue it
+        if redis.zrem(DELAYED_KEY, job_id):
+            redis.lpush(QUEUE_KEY, job_id)
+
+
+def next_job_id(timeout=5):
+    """
+    Takes the next queued job id, which stays in the processing list until
+    ``finish_job`` so that the job is not lost if the worker dies.
+    """
+    redis = get_redis_connection('default')
+    promote_delayed_jobs(redis)
+    job_id = redis.blmove(QUEUE_KEY, PROCESSING_KEY, timeout, 'RIGHT', 'LEFT')
+    return int(job_id) if job_id is not None else None
+
+
+def finish_job(job_id):
+    get_redis_connection('default').lrem(PROCESSING_KEY, 1, job_id)
+
+
+def requeue_stale_jobs():
+    """
+    Puts back on the queue the jobs taken by workers that stopped: jobs in
+    the processing list that did not change for STALE_AFTER seconds and are
+    not finished. Returns their ids.
+    """
+    redis = get_redis_connection('default')
+    job_ids = {int(job_id) for job_id in redis.lrange(PROCESSING_KEY, 0, -1)}
+    if not job_ids:
+        return []
+
+    cutoff = timezone.now() - timedelta(seconds=settings.INGESTION['STALE_AFTER'])
+    jobs = IngestionJob.objects.in_bulk(job_ids)
+    unfinished = (IngestionJob.PENDING, IngestionJob.RUNNING)
+    requeued = []
+    for job_id in sorted(job_ids):
+        job = jobs.get(job_id)
+        if job is not None and job.status in unfinished and job.updated > cutoff:
+            continue
+        # Only the worker that removes the entry requeues the job, finished
+        # jobs are left by workers that stopped before removing them
+        if not redis.lrem(PROCESSING_KEY, 1, job_id) or job is None or job.status not in unfinished:
+            continue
+        IngestionJob.objects.filter(pk=job_id, status=IngestionJob.RUNNING).update(status=IngestionJob.PENDING, updated=timezone.now())
+        redis.lpush(QUEUE_KEY, job_id)
+        requeued.append(job_id)
+    if requeued:
+        # Updated rows send no post_save
+        invalidate_model('ingestionjob')
+    return requeued
+
+
+def retry_delay(attempts):
+    return settings.INGESTION['RETRY_BACKOFF'] * 2 ** (attempts - 1)
+
+
+def analyze(file):
+    if file is None:
+        return None, None
+    try:
+        return analyze_wav(file)
+    except ValueError:
+        logger.warning('Could not analyze the WAV file', exc_info=True)
+        return None, None
+
+
+def create_song(job, urls, duration, waveform, loudness):
+    payload = job.payload
+    song = Song(
+        title=payload['title'],
+        note=payload.get('note'),
+        lyrics=payload.get('lyrics'),
+        features=payload.get('features'),
+        youtube=payload.get('youtube'),
+        original=payload.get('original', True),
+        artwork=urls['artwork'],
+        mp3=urls['mp3'],
+        wav=urls.get('wav', ''),
+        flac=urls.get('flac', ''),
+        duration=duration,
+        waveform=waveform,
+        loudness=loudness,
+    )
+    if payload.get('release_date'):
+        song.release_date = parse_date(payload['release_date'])
+    song.save()
+
+    if payload['albums']:
+        song.albums.set(payload['albums'])
+    if payload['alternatives']:
+        song.alternatives.set(payload['alternatives'])
+    return song
+
+
+def remove_staged_files(job):
+    for staged, _ in job.files.values():
+        shutil.rmtree(Path(staged).parent, ignore_errors=True)
+
+
+def finished_elsewhere(job_id):
+    """
+    Locks the job and tells whether another worker created its song, which
+    happens when the job was requeued as stale while this worker still ran it.
+    """
+    return IngestionJob.objects.select_for_update().filter(pk=job_id, song__isnull=False).exists()
+
+
+def retry_or_fail(job, error):
+    with transaction.atomic():
+        if finished_elsewhere(job.pk):
+            return IngestionJob.objects.get(pk=job.pk)
+        job.error = str(error)
+        if job.attempts < settings.INGESTION['MAX_ATTEMPTS']:
+            job.status = IngestionJob.PENDING
+        else:
+            job.status = IngestionJob.FAILED
+        job.save(update_fields=['status', 'error', 'updated'])
+
+    if job.status == IngestionJob.PENDING:
+        enqueue(job.pk, delay=retry_delay(job.attempts))
+    else:
+        remove_staged_files(job)
+    return job
+
+
+def process_job(job_id):
+    with transaction.atomic():
+        job = IngestionJob.objects.select_for_update().filter(pk=job_id).first()
+        # A job requeued twice or already finished is not run again
+        if job is None or job.status != IngestionJob.PENDING:
+            return job
+        job.status = IngestionJob.RUNNING
+        job.attempts += 1
+        job.save(update_fields=['status', 'attempts', 'updated'])
+
+    with ExitStack() as stack:
+        try:
+            opened = {name: stack.enter_context(open(staged, 'rb')) for name, (staged, _) in job.files.items()}
+            urls = upload_files(get_backend(), {name: (path, opened[name]) for name, (_, path) in job.files.items()})
+        except Exception as e:
+            logger.exception('Uploading files of ingestion job %s failed', job.pk)
+            return retry_or_fail(job, e)
+
+        try:
+            duration = get_audio_file_duration(wav=opened.get('wav'), flac=opened.get('flac'), mp3=opened['mp3'])
+            waveform, loudness = analyze(opened.get('wav'))
+            with transaction.atomic():
+                if finished_elsewhere(job.pk):
+                    return IngestionJob.objects.get(pk=job.pk)
+                job.song = create_song(job, urls, duration, waveform, loudness)
+                job.status = IngestionJob.SUCCEEDED
+                job.error = None
+                job.save(update_fields=['song', 'status', 'error', 'updated'])
+        except Exception as e:
+            logger.exception('Creating the song of ingestion job %s failed', job.pk)
+            job.song = None
+            return retry_or_fail(job, e)
+
+    remove_staged_files(job)
+    return job
@@ -0,0 +1,75 @@
+import json
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from music_api.benchmark import api_operations, compare, make_synthetic_catalog, measure, rolled_back
+
+
+class Command(BaseCommand):
+    help = 'Replays representative GraphQL operations and uploads against a synthetic catalog and reports ' \
+           'their latency, SQL queries and memory, optionally failing on regressions against a baseline. ' \
+           'Latencies depend on the hardware, so baselines are saved and compared on the same machine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--albums', type=int, default=200)
+        parser.add_argument('--songs-per-album', type=int, default=10)
+        parser.add_argument('--comments-per-song', type=int, default=3)
+        parser.add_argument('--alternatives', type=float, default=0.2, help='Share of songs and albums with an alternative')
+        parser.add_argument('--updates', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs of each operation')
+        parser.add_argument('--operations', nargs='*', help='Only run these operations')
+        parser.add_argument(
+            '--baseline',
+            help='JSON results saved with --save-baseline on the same machine to compare against, regressions fail the command',
+        )
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed latency and memory growth over the baseline')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        # Uploads are staged and stored in a directory removed afterwards
+        with tempfile.TemporaryDirectory() as root:
+            storage = {'BACKEND': 'music_api.storage.LocalBackend', 'OPTIONS': {'root': f'{root}/media', 'base_url': 'http://media.test/'}}
+            ingestion = {**settings.INGESTION, 'STAGING_ROOT': f'{root}/staging'}
+            with rolled_back(), override_settings(MEDIA_STORAGE=storage, INGESTION=ingestion):
+                results = self.benchmark(options)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                regressions = compare(results, json.load(file), options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+
+    def benchmark(self, options):
+        counts = make_synthetic_catalog(
+            options['albums'], options['songs_per_album'], options['comments_per_song'], options['updates'],
+            options['alternatives'],
+        )
+        call_command('rebuild_album_aggregates', stdout=self.stdout)
+        self.stdout.write('Created ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+
+        user = User(username='benchmark', is_superuser=True, is_staff=True)
+        user.save()
+
+        operations = api_operations(user)
+        names = options['operations'] or list(operations)
+        unknown = set(names) - set(operations)
+        if unknown:
+            raise CommandError(f'Unknown operations: {", ".join(sorted(unknown))}')
+
+        results = {}
+        for name in names:
+            results[name] = result = measure(operations[name], options['repeat'])
+            self.stdout.write(
+                f'{name:<20} p50 {result["p50_ms"]:8.2f} ms   p95 {result["p95_ms"]:8.2f} ms   '
+                f'{result["queries"]:3d} queries   {result["memory_kib"]:8.1f} KiB'
+            )
+        return results
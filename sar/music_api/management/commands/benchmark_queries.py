@@ -0,0 +1,41 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from music_api.benchmark import explain, hot_queries, make_synthetic_catalog, percentile, rolled_back, time_query
+
+
+class Command(BaseCommand):
+    help = 'Times the hot catalog queries against a synthetic catalog and prints their query plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--albums', type=int, default=2000)
+        parser.add_argument('--songs-per-album', type=int, default=12)
+        parser.add_argument('--comments-per-song', type=int, default=3)
+        parser.add_argument('--updates', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of each query to time')
+        parser.add_argument('--explain', action='store_true', help='Print the EXPLAIN ANALYZE plan of each query')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic catalog instead of rolling it back')
+
+    def handle(self, *args, **options):
+        with rolled_back(options['keep']):
+            self.benchmark(options)
+
+    def benchmark(self, options):
+        counts = make_synthetic_catalog(
+            options['albums'], options['songs_per_album'], options['comments_per_song'], options['updates'],
+        )
+        call_command('rebuild_album_aggregates', stdout=self.stdout)
+        self.stdout.write('Created ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+
+        # Plans depend on the table statistics, which are stale after a bulk load
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        for name, queryset in hot_queries().items():
+            latencies = time_query(queryset, options['repeat'])
+            self.stdout.write(
+                f'{name:<20} p50 {percentile(latencies, 50):8.2f} ms   p95 {percentile(latencies, 95):8.2f} ms'
+            )
+            if options['explain']:
+                self.stdout.write(explain(queryset) + '\n')
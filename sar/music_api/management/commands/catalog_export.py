@@ -0,0 +1,34 @@
+import gzip
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from music_api.transfer import export_catalog
+
+
+class Command(BaseCommand):
+    help = 'Writes albums, songs, tracks, comments and updates as JSON Lines, for catalog_import'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', nargs='?', default='-', help='File to write, gzipped when it ends with .gz. Standard output by default')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows read per query')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        # One snapshot, so that no row refers to one added during the export
+        in_transaction = connection.in_atomic_block
+        with transaction.atomic():
+            if not in_transaction:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            if output == '-':
+                counts = export_catalog(self.stdout, options['batch_size'])
+            else:
+                with (gzip.open if output.endswith('.gz') else open)(output, 'wt', encoding='utf-8') as stream:
+                    counts = export_catalog(stream, options['batch_size'])
+
+        summary = 'Exported ' + ', '.join(f'{count} {label}' for label, count in counts.items())
+        if output == '-':
+            self.stderr.write(summary)
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,23 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music_api.transfer import import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Adds the rows written by catalog_export to the catalog, with new ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File written by catalog_export, gzipped when it ends with .gz')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows inserted per query')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        try:
+            with (gzip.open if path.endswith('.gz') else open)(path, 'rt', encoding='utf-8') as stream:
+                counts = import_catalog(stream, options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not import {path}: {e}')
+
+        self.stdout.write(self.style.SUCCESS('Imported ' + ', '.join(f'{count} {label}' for label, count in counts.items())))
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from music_api.benchmark import asgi_load, make_synthetic_catalog, read_queries, wsgi_load
+
+MODES = {'wsgi': wsgi_load, 'asgi': asgi_load}
+
+
+class Command(BaseCommand):
+    help = 'Sends concurrent GraphQL reads to the synchronous and the async view and compares their throughput. ' \
+           'The requests run against the catalog in the database, as the views read it from other threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20, help='Threads of the WSGI path, tasks of the ASGI path')
+        parser.add_argument('--operations', nargs='*', help='Only send these queries')
+        parser.add_argument('--modes', nargs='*', choices=sorted(MODES), default=list(MODES))
+        parser.add_argument('--albums', type=int, default=0, help='First add a synthetic catalog of this many albums, which is kept')
+
+    def handle(self, *args, **options):
+        if options['albums']:
+            counts = make_synthetic_catalog(options['albums'], 10, comments_per_song=3, updates=50, alternatives=0.2)
+            call_command('rebuild_album_aggregates', stdout=self.stdout)
+            self.stdout.write('Created ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+
+        queries = read_queries()
+        names = options['operations'] or list(queries)
+        unknown = set(names) - set(queries)
+        if unknown:
+            raise CommandError(f'Unknown operations: {", ".join(sorted(unknown))}')
+
+        bodies = [
+            json.dumps({'query': queries[name][0], 'variables': queries[name][1]})
+            for name in (names * (options['requests'] // len(names) + 1))[:options['requests']]
+        ]
+        for mode in options['modes']:
+            result = MODES[mode](bodies, options['concurrency'])
+            self.stdout.write(
+                f'{mode:<6} {result["requests_per_second"]:8.1f} req/s   '
+                f'p50 {result["p50_ms"]:8.2f} ms   p95 {result["p95_ms"]:8.2f} ms'
+            )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from music_api.cache import invalidate_model
+from music_api.models import Album, Song
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the stored total_duration and track_count of every album'
+
+    def handle(self, *args, **options):
+        links = Song.albums.through.objects.filter(album_id=OuterRef('pk')).order_by().values('album_id')
+        durations = links.annotate(total=Sum('song__duration')).values('total')
+        counts = links.annotate(total=Count('id')).values('total')
+
+        updated = Album.objects.update(
+            total_duration=Coalesce(Subquery(durations, output_field=IntegerField()), 0),
+            track_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0),
+        )
+        # Updated rows send no post_save
+        invalidate_model('album')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt aggregates for {updated} albums'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from music_api.cache import invalidate_model
+from music_api.models import Album, Song
+from music_api.versions import rebuild_version_groups
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the stored version_group of every song and album from their alternatives'
+
+    def handle(self, *args, **options):
+        for model in (Song, Album):
+            grouped = rebuild_version_groups(model)
+            invalidate_model(model._meta.model_name)
+            self.stdout.write(self.style.SUCCESS(f'Grouped {grouped} {model._meta.verbose_name_plural} with alternatives'))
@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql import GraphQLError, parse, validate
+
+from sar.documents import persist_query
+from sar.schema import schema
+from sar.views import SarGraphQLView
+
+
+class Command(BaseCommand):
+    help = 'Validates GraphQL documents and adds them to the persisted queries, which is the allow list when ' \
+           'GRAPHQL_PERSISTED_QUERIES["ALLOW_LIST"] is set'
+    stealth_options = ('stdin',)
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='.graphql files holding one document each, read from stdin if omitted')
+
+    def handle(self, *args, **options):
+        if options['files']:
+            sources = {}
+            for name in options['files']:
+                with open(name) as file:
+                    sources[name] = file.read()
+        else:
+            sources = {'<stdin>': options.get('stdin', sys.stdin).read()}
+
+        for name, query in sources.items():
+            try:
+                errors = validate(schema.graphql_schema, parse(query), SarGraphQLView.validation_rules)
+            except GraphQLError as e:
+                errors = [e]
+            if errors:
+                raise CommandError(f'{name} is not a valid document: {errors[0].message}')
+
+            self.stdout.write(f'{persist_query(query, timeout=None)} {name}')
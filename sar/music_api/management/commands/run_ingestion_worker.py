@@ -0,0 +1,42 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from music_api.ingestion import SWEEP_INTERVAL, finish_job, next_job_id, process_job, requeue_stale_jobs
+
+logger = logging.getLogger('music_api.ingestion')
+
+
+class Command(BaseCommand):
+    help = 'Processes queued song ingestion jobs until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        swept = None
+        while True:
+            if swept is None or time.monotonic() - swept > SWEEP_INTERVAL:
+                close_old_connections()
+                for job_id in requeue_stale_jobs():
+                    self.stdout.write(f'Ingestion job {job_id}: requeued')
+                swept = time.monotonic()
+
+            job_id = next_job_id()
+            if job_id is None:
+                if options['once']:
+                    return
+                continue
+
+            close_old_connections()
+            try:
+                job = process_job(job_id)
+            except Exception:
+                # Left in the processing list, to be requeued once stale
+                logger.exception('Ingestion job %s failed', job_id)
+                continue
+            finish_job(job_id)
+            if job is not None:
+                self.stdout.write(f'Ingestion job {job.pk}: {job.status}')
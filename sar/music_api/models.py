@@ -1,6 +1,10 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.utils import timezone
 from django.db import models
 
+SEARCH_CONFIG = 'english'
+
 class SA(models.Model):
     title = models.CharField(max_length=100)
     artwork = models.URLField()
@@ -8,6 +12,9 @@ class SA(models.Model):
     original = models.BooleanField(default=True)
     youtube = models.URLField(null=True)
     note = models.TextField(null=True)
+    # Smallest id of the rows linked by alternatives, directly or through
+    # other rows, null without alternatives. Kept up to date by music_api.signals
+    version_group = models.BigIntegerField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.title
@@ -28,14 +35,33 @@ class SA(models.Model):
         
     class Meta:
         abstract = True
+        indexes = [
+            # Keyset pagination order of allSongs and allAlbums
+            models.Index(fields=['-release_date', '-id'], name='%(app_label)s_%(class)s_release'),
+            # Every version of a song or album
+            models.Index(fields=['version_group'], name='%(app_label)s_%(class)s_versions'),
+        ]
 
 class Album(SA):
     ep = models.BooleanField(default=False)
     alternatives = models.ManyToManyField('self', blank=True)
+    # Kept up to date by the signals in music_api.signals
+    total_duration = models.IntegerField(default=0)
+    track_count = models.IntegerField(default=0)
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', weight='A', config=SEARCH_CONFIG) + SearchVector('note', weight='C', config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta(SA.Meta):
+        indexes = SA.Meta.indexes + [
+            GinIndex(fields=['search_vector'], name='music_api_album_search'),
+        ]
 
     @property
     def duration(self):
-        return sum([song.duration for song in self.song_set.all()])
+        return self.total_duration
 
     @property
     def released(self):
@@ -51,12 +77,38 @@ class Song(SA):
     albums = models.ManyToManyField(Album, blank=True)
     alternatives = models.ManyToManyField('self', blank=True)
     features = models.TextField(null=True, blank=True)
+    # Interleaved int8 min/max pairs and gated RMS level in dBFS, computed
+    # from the WAV at ingest (see music_api.waveform)
+    waveform = models.BinaryField(null=True, blank=True)
+    loudness = models.FloatField(null=True, blank=True, help_text='Gated RMS level in dBFS, not K-weighted')
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('features', weight='B', config=SEARCH_CONFIG)
+            + SearchVector('lyrics', weight='C', config=SEARCH_CONFIG)
+            + SearchVector('note', weight='D', config=SEARCH_CONFIG)
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta(SA.Meta):
+        indexes = SA.Meta.indexes + [
+            GinIndex(fields=['search_vector'], name='music_api_song_search'),
+        ]
 
 class Comment(models.Model):
     text = models.TextField()
     date = models.DateField(auto_now=True)
     nickname = models.CharField(max_length=100)
-    song = models.ForeignKey(Song, on_delete=models.CASCADE)
+    # Covered by the song_date index
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        indexes = [
+            # Comments of a song, newest first
+            models.Index(fields=['song', '-date', '-id'], name='%(app_label)s_%(class)s_song_date'),
+        ]
 
 class Updates(models.Model):
     title = models.CharField(max_length=100)
@@ -64,8 +116,50 @@ class Updates(models.Model):
     content = models.TextField()
     references_songs = models.ManyToManyField(Song, blank=True)
     references_albums = models.ManyToManyField(Album, blank=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination order of updates
+            models.Index(fields=['-date', '-id'], name='%(app_label)s_%(class)s_date'),
+        ]
     
 class Track(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE)
-    album = models.ForeignKey(Album, on_delete=models.CASCADE)
-    track_number = models.IntegerField()
\ No newline at end of file
+    # Covered by the constraints below, which both start with the album
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, db_index=False)
+    track_number = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['album', 'song'], name='%(app_label)s_%(class)s_album_song'),
+            # Deferred, as renumbering an album swaps numbers between its tracks
+            # in statements that are only consistent once they all ran
+            models.UniqueConstraint(
+                fields=['album', 'track_number'], name='%(app_label)s_%(class)s_album_number',
+                deferrable=models.Deferrable.DEFERRED,
+            ),
+        ]
+
+
+class IngestionJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING)
+    # Song fields from SongSerializer, and the staged media files to upload
+    payload = models.JSONField()
+    files = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    song = models.ForeignKey(Song, null=True, blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
@@ -0,0 +1,109 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+BUCKET_KEY = 'ratelimit:{}:{}'
+
+# Refills the buckets for the time since they were last used and takes a token
+# from each if they all have one. Returns the seconds until they do, 0 when
+# the tokens were taken, as a string since Lua numbers are truncated to
+# integers. Redis' clock is shared by every process
+TOKEN_BUCKET_SCRIPT = '''
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local updated = tonumber(bucket[2]) or now
+    tokens[i] = math.min(capacity, (tonumber(bucket[1]) or capacity) + math.max(0, now - updated) * rate)
+    if tokens[i] < 1 then
+        wait = math.max(wait, (1 - tokens[i]) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    if wait == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'updated', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate))
+end
+return tostring(wait)
+'''
+
+
+def get_redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+class TokenBucket:
+    """
+    Buckets of ``capacity`` tokens refilled at ``rate`` tokens a second, one
+    for each key, kept in the cache under ``name``.
+
+    With Redis a script takes tokens atomically. Other caches, used in
+    development, read and write the bucket in two steps.
+    """
+
+    def __init__(self, name, capacity, rate):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+
+    def take(self, *keys):
+        """
+        Takes a token for each of ``keys`` if they all have one. Returns 0 if
+        they did, otherwise the seconds until they do.
+        """
+        cache_keys = [BUCKET_KEY.format(self.name, key) for key in keys]
+        redis = get_redis()
+        if redis is None:
+            return self.take_from_cache(cache_keys)
+        keys = [cache.make_key(cache_key) for cache_key in cache_keys]
+        return float(redis.eval(TOKEN_BUCKET_SCRIPT, len(keys), *keys, self.capacity, self.rate))
+
+    def take_from_cache(self, cache_keys):
+        now = time.time()
+        buckets = cache.get_many(cache_keys)
+        tokens = {}
+        wait = 0
+        for cache_key in cache_keys:
+            available, updated = buckets.get(cache_key, (self.capacity, now))
+            tokens[cache_key] = min(self.capacity, available + max(0, now - updated) * self.rate)
+            if tokens[cache_key] < 1:
+                wait = max(wait, (1 - tokens[cache_key]) / self.rate)
+        if not wait:
+            tokens = {cache_key: available - 1 for cache_key, available in tokens.items()}
+        cache.set_many({cache_key: (available, now) for cache_key, available in tokens.items()}, math.ceil(self.capacity / self.rate))
+        return wait
+
+
+def get_client_ip(request):
+    # Each trusted proxy appends the address it got the request from
+    proxies = settings.COMMENT_RATE_LIMIT['PROXIES']
+    if proxies:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def check_comment_rate(request, nickname):
+    """
+    Raises an exception when the client or the nickname of a new comment
+    have used up their comments for now.
+    """
+    limit = settings.COMMENT_RATE_LIMIT
+    bucket = TokenBucket('comment', limit['BURST'], limit['PER_MINUTE'] / 60)
+    # A comment refused for one of them does not use up the other
+    wait = bucket.take(f'ip:{get_client_ip(request)}', f'nickname:{nickname.strip().lower()}')
+    if wait:
+        raise Exception(f'Too many comments, try again in {math.ceil(wait)} seconds')
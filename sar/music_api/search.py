@@ -0,0 +1,61 @@
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F, TextField, Value
+from django.db.models.functions import Coalesce, Concat
+
+from .models import SEARCH_CONFIG, Album, Song
+
+SEARCHED_FIELDS = {
+    Song: ('title', 'features', 'lyrics', 'note'),
+    Album: ('title', 'note'),
+}
+
+
+def searched_text(model):
+    parts = []
+    for field in SEARCHED_FIELDS[model]:
+        parts += [Coalesce(field, Value('')), Value(' ')]
+    return Concat(*parts[:-1], output_field=TextField())
+
+
+def search_catalog(text, limit, offset=0):
+    """
+    Returns up to ``limit`` songs and albums matching ``text`` after skipping
+    ``offset``, best match first, each annotated with ``rank`` and ``snippet``.
+
+    Matching and ranking only read the indexed search vectors, headlines are
+    then built for the returned page alone.
+    """
+    query = SearchQuery(text, search_type='websearch', config=SEARCH_CONFIG)
+
+    ranked = []
+    for model in (Song, Album):
+        matches = (
+            model.objects.filter(search_vector=query)
+            .annotate(rank=SearchRank(F('search_vector'), query))
+            .order_by('-rank', '-id')
+            .values_list('rank', 'id')[:offset + limit]
+        )
+        ranked += [(rank, model, pk) for rank, pk in matches]
+
+    ranked.sort(key=lambda match: (-match[0], match[1].__name__, -match[2]))
+    page = ranked[offset:offset + limit]
+
+    objects = {}
+    for model in (Song, Album):
+        ids = [pk for _, match_model, pk in page if match_model is model]
+        if not ids:
+            continue
+        rows = model.objects.filter(pk__in=ids).annotate(
+            snippet=SearchHeadline(
+                searched_text(model), query, config=SEARCH_CONFIG,
+                start_sel='<mark>', stop_sel='</mark>', max_words=30, min_words=10, max_fragments=2,
+            ),
+        )
+        objects.update({(model, row.pk): row for row in rows})
+
+    results = []
+    for rank, model, pk in page:
+        row = objects[(model, pk)]
+        row.rank = rank
+        results.append(row)
+    return results
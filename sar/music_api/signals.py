@@ -1,35 +1,169 @@
-from django.db.models.signals import m2m_changed
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Max, Sum, Value, When
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import Album, Song, Track
+from .cache import comments_tag, invalidate, invalidate_model
+from .models import Album, Comment, IngestionJob, Song, Track, Updates
+from .versions import regroup
+
+def adjust_album_aggregates(album_ids, duration, count):
+    Album.objects.filter(pk__in=album_ids).update(
+        total_duration=F('total_duration') + duration,
+        track_count=F('track_count') + count,
+    )
+
+def adjust_for_links(instance, reverse, pairs, sign):
+    # Forward changes touch one song in many albums, reverse ones many songs in one album
+    if not pairs:
+        return
+    if reverse:
+        song_ids = [song_id for song_id, _ in pairs]
+        duration = Song.objects.filter(pk__in=song_ids).aggregate(total=Sum('duration'))['total'] or 0
+        adjust_album_aggregates([instance.pk], sign * duration, sign * len(song_ids))
+    else:
+        adjust_album_aggregates([album_id for _, album_id in pairs], sign * instance.duration, sign)
+
+def existing_links(instance, reverse, pk_set):
+    links = Song.albums.through.objects.filter(**{'album_id' if reverse else 'song_id': instance.pk})
+    if pk_set is not None:
+        links = links.filter(**{'song_id__in' if reverse else 'album_id__in': pk_set})
+    return links
+
+def lock_albums(album_ids):
+    # Serializes concurrent track list edits of the same album
+    list(Album.objects.select_for_update().filter(pk__in=album_ids).order_by('pk').values_list('pk', flat=True))
+
+def add_tracks(pairs):
+    album_ids = {album_id for _, album_id in pairs}
+    last_numbers = dict(
+        Track.objects.filter(album_id__in=album_ids).order_by().values('album_id')
+        .annotate(last=Max('track_number')).values_list('album_id', 'last')
+    )
+
+    tracks = []
+    for song_id, album_id in sorted(pairs, key=lambda pair: pair[0]):
+        last_numbers[album_id] = last_numbers.get(album_id, 0) + 1
+        tracks.append(Track(song_id=song_id, album_id=album_id, track_number=last_numbers[album_id]))
+    Track.objects.bulk_create(tracks)
+
+def remove_tracks(pairs):
+    # Returns the (song_id, album_id) pairs whose track was deleted
+    song_ids = {song_id for song_id, _ in pairs}
+    album_ids = {album_id for _, album_id in pairs}
+    removed = [
+        (track_id, song_id, album_id, track_number)
+        for track_id, song_id, album_id, track_number in Track.objects.filter(song_id__in=song_ids, album_id__in=album_ids)
+        .values_list('id', 'song_id', 'album_id', 'track_number')
+        if (song_id, album_id) in pairs
+    ]
+    if not removed:
+        return set()
+
+    Track.objects.filter(pk__in=[track_id for track_id, _, _, _ in removed]).delete()
+
+    removed_numbers = defaultdict(list)
+    for _, _, album_id, track_number in removed:
+        removed_numbers[album_id].append(track_number)
+
+    # Every remaining track moves down by the number of removed tracks before it,
+    # the first matching threshold (highest removed number) gives that count
+    whens = [
+        When(album_id=album_id, track_number__gt=track_number, then=Value(position))
+        for album_id, numbers in removed_numbers.items()
+        for position, track_number in reversed(list(enumerate(sorted(numbers), 1)))
+    ]
+    Track.objects.filter(album_id__in=removed_numbers).update(
+        track_number=F('track_number') - Case(*whens, default=Value(0))
+    )
+    return {(song_id, album_id) for _, song_id, album_id, _ in removed}
+
+def remove_links(instance, reverse, pk_set):
+    # The links are read once their albums are locked, so that links removed by
+    # a concurrent transaction are gone and their aggregates adjusted only once
+    if reverse:
+        album_ids = {instance.pk}
+    elif pk_set is not None:
+        album_ids = pk_set
+    else:
+        album_ids = set(existing_links(instance, reverse, None).values_list('album_id', flat=True))
+    with transaction.atomic():
+        lock_albums(album_ids)
+        pairs = set(existing_links(instance, reverse, pk_set).values_list('song_id', 'album_id'))
+        adjust_for_links(instance, reverse, remove_tracks(pairs), -1)
 
 @receiver(m2m_changed, sender=Album.song_set.through)
-def update_album_duration(sender, instance, action, **kwargs):
+def update_album_duration(sender, instance, action, reverse, pk_set, **kwargs):
     if action == 'post_add':
-        song_id = instance.id
-        album_id = list(kwargs['pk_set'])[0]
-
-        song = Song.objects.get(pk=song_id)
-        album = Album.objects.get(pk=album_id)
-        
-        all_album_tracks = Track.objects.filter(album=album)
-        all_album_tracks_count = all_album_tracks.count()
-
-        newTrack = Track(album=album, song=song, track_number=all_album_tracks_count + 1)
-        newTrack.save()
-
-    elif action == 'post_remove':
-        song_id = instance.id
-        album_id = list(kwargs['pk_set'])[0]
-
-        song = Song.objects.get(pk=song_id)
-        album = Album.objects.get(pk=album_id)
-
-        track = Track.objects.get(album = album, song=song)
-        trackNumber = track.track_number
-        track.delete()
-
-        all_album_tracks = Track.objects.filter(album=album)
-        for track in all_album_tracks:
-            if track.track_number > trackNumber:
-                track.track_number -= 1
-                track.save()
\ No newline at end of file
+        pairs = {(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set}
+        with transaction.atomic():
+            lock_albums({album_id for _, album_id in pairs})
+            add_tracks(pairs)
+            adjust_for_links(instance, reverse, pairs, 1)
+
+    elif action in ('pre_remove', 'pre_clear'):
+        # Only links that actually exist are removed, and they are gone by post_*
+        remove_links(instance, reverse, pk_set)
+
+@receiver(pre_save, sender=Song)
+def remember_song_duration(sender, instance, update_fields=None, **kwargs):
+    instance._previous_duration = None
+    if instance.pk is not None and (update_fields is None or 'duration' in update_fields):
+        instance._previous_duration = Song.objects.filter(pk=instance.pk).values_list('duration', flat=True).first()
+
+@receiver(post_save, sender=Song)
+def update_album_total_duration(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_duration', None)
+    if created or previous is None or previous == instance.duration:
+        return
+    album_ids = instance.albums.values_list('pk', flat=True)
+    adjust_album_aggregates(album_ids, instance.duration - previous, 0)
+
+@receiver(pre_delete, sender=Song)
+def remove_song_from_albums(sender, instance, **kwargs):
+    # Cascading deletes of the m2m rows do not send m2m_changed
+    remove_links(instance, False, None)
+
+@receiver(m2m_changed, sender=Song.alternatives.through)
+@receiver(m2m_changed, sender=Album.alternatives.through)
+def update_version_groups(sender, instance, action, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._cleared_alternatives = set(instance.alternatives.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        regroup(model, {instance.pk, *instance._cleared_alternatives})
+    elif action in ('post_add', 'post_remove') and pk_set:
+        regroup(model, {instance.pk, *pk_set})
+
+@receiver(pre_delete, sender=Song)
+@receiver(pre_delete, sender=Album)
+def remember_alternatives(sender, instance, **kwargs):
+    # Cascading deletes of the links do not send m2m_changed either
+    instance._deleted_alternatives = set(instance.alternatives.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Album)
+def split_version_group(sender, instance, **kwargs):
+    alternatives = getattr(instance, '_deleted_alternatives', None)
+    if alternatives:
+        regroup(sender, alternatives)
+
+# Track rows only change alongside Song.albums, whose m2m_changed already
+# invalidates them, and a delete receiver would stop their fast deletes
+@receiver([post_save, post_delete], sender=Song)
+@receiver([post_save, post_delete], sender=Album)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=Updates)
+@receiver([post_save, post_delete], sender=IngestionJob)
+def invalidate_cached_responses(sender, **kwargs):
+    invalidate_model(sender._meta.model_name)
+
+@receiver(m2m_changed)
+def invalidate_cached_relations(sender, instance, action, model, **kwargs):
+    if sender._meta.app_label == 'music_api' and action.startswith('post_'):
+        invalidate_model(instance._meta.model_name)
+        invalidate_model(model._meta.model_name)
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_song_comments(sender, instance, **kwargs):
+    invalidate(comments_tag(instance.song_id))
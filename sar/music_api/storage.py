@@ -0,0 +1,125 @@
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Files bigger than this are sent as resumable uploads in chunks of this size
+# instead of a single request holding the whole file
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class StorageBackend:
+    """
+    Stores uploaded files and returns their public URLs.
+
+    A single instance is shared by every request in the process (see
+    ``get_backend``), so implementations must be safe to use from several
+    threads at once.
+    """
+
+    def upload(self, path, file):
+        raise NotImplementedError
+
+
+class GCSBackend(StorageBackend):
+
+    def __init__(self, bucket, credentials):
+        from google.cloud import storage
+
+        client = storage.Client.from_service_account_json(credentials)
+        self.bucket = client.get_bucket(bucket)
+
+    def upload(self, path, file):
+        blob = self.bucket.blob(path)
+        size = getattr(file, 'size', None)
+        if size is None or size > UPLOAD_CHUNK_SIZE:
+            blob.chunk_size = UPLOAD_CHUNK_SIZE
+        blob.upload_from_file(file, size=size, content_type=getattr(file, 'content_type', None))
+        return blob.public_url
+
+
+class LocalBackend(StorageBackend):
+    """
+    Writes uploads below ``root``, for development and tests.
+    """
+
+    def __init__(self, root, base_url):
+        self.root = Path(root)
+        self.base_url = base_url
+
+    def upload(self, path, file):
+        destination = self.root / path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        with open(destination, 'wb') as output:
+            shutil.copyfileobj(file, output, UPLOAD_CHUNK_SIZE)
+        return self.base_url.rstrip('/') + '/' + path
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process wide backend, creating it on first use.
+
+    Creating the GCS backend parses credentials, exchanges them for a token
+    and fetches bucket metadata, which is only worth paying once.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                started = time.perf_counter()
+                config = settings.MEDIA_STORAGE
+                backend = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+                backend.setup_seconds = time.perf_counter() - started
+                logger.info('Set up %s storage backend in %.2fs', type(backend).__name__, backend.setup_seconds)
+                _backend = backend
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+@receiver(setting_changed)
+def reset_backend_on_setting_change(setting, **kwargs):
+    if setting == 'MEDIA_STORAGE':
+        reset_backend()
+
+
+def upload_one(backend, path, file):
+    started = time.perf_counter()
+    file.seek(0)
+    url = backend.upload(path, file)
+    return url, time.perf_counter() - started
+
+
+def upload_files(backend, files):
+    """
+    Uploads ``files``, a mapping of name to (path, file), concurrently and
+    returns a mapping of name to public URL.
+    """
+    if not files:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=len(files)) as executor:
+        futures = {name: executor.submit(upload_one, backend, path, file) for name, (path, file) in files.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    for name, (url, seconds) in results.items():
+        logger.info('Uploaded %s to %s in %.2fs', name, url, seconds)
+
+    return {name: url for name, (url, _) in results.items()}
@@ -1,3 +1,1605 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import wave
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from graphql import get_introspection_query
+
+from sar.documents import documents, query_hash
+from sar.instrumentation import metrics
+from sar.loaders import Loaders
+from sar.schema import schema
+from sar.static import CompressedManifestStaticFilesStorage
+from sar.views import AsyncSarGraphQLView
+from .benchmark import read_queries
+from .cache import get_stats, get_tag_versions
+from .catalog import modify_songs, set_album_tracklist
+from .comments import comment_buffer
+from .ingestion import QUEUE_KEY, create_job, process_job, requeue_stale_jobs
+from .models import Album, Comment, IngestionJob, Song, Track, Updates
+from .ratelimit import TokenBucket, get_client_ip
+from .storage import LocalBackend, get_backend, upload_files
+from .utils import get_audio_file_duration
+from .waveform import analyze_wav
+
+
+def make_catalog(albums, songs_per_album):
+    albums = Album.objects.bulk_create([Album(title=f'Album {i}', artwork='https://example.com/a.png') for i in range(albums)])
+    songs = Song.objects.bulk_create([
+        Song(title=f'Song {i}', artwork='https://example.com/s.png', duration=60 + i)
+        for i in range(len(albums) * songs_per_album)
+    ])
+
+    links = []
+    tracks = []
+    for i, song in enumerate(songs):
+        album = albums[i // songs_per_album]
+        links.append(Song.albums.through(song_id=song.id, album_id=album.id))
+        tracks.append(Track(song=song, album=album, track_number=i % songs_per_album + 1))
+
+    Song.albums.through.objects.bulk_create(links)
+    Track.objects.bulk_create(tracks)
+    call_command('rebuild_album_aggregates', stdout=StringIO())
+    return albums, songs
+
+
+class AllAlbumsQueryTest(TestCase):
+    query = '''
+        query {
+            allAlbums {
+                edges {
+                    node {
+                        id
+                        duration
+                        numberOfSongs
+                        songs { title trackNumber }
+                    }
+                }
+            }
+        }
+    '''
+
+    def execute(self):
+        request = RequestFactory().get('/graphql/')
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(self.query, context_value=request)
+        self.assertIsNone(result.errors)
+        return result.data, len(queries)
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        make_catalog(albums=5, songs_per_album=10)
+        _, small_count = self.execute()
+
+        make_catalog(albums=45, songs_per_album=10)
+        data, large_count = self.execute()
+
+        self.assertEqual(len(data['allAlbums']['edges']), 50)
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(large_count, 2)
+
+    def test_resolves_album_fields(self):
+        albums, songs = make_catalog(albums=2, songs_per_album=3)
+        data, _ = self.execute()
+
+        album = next(edge['node'] for edge in data['allAlbums']['edges'] if edge['node']['id'] == str(albums[0].id))
+        self.assertEqual(album['numberOfSongs'], 3)
+        self.assertEqual(album['duration'], sum(song.duration for song in songs[:3]))
+        self.assertEqual([song['trackNumber'] for song in album['songs']], [1, 2, 3])
+
+
+class AlbumAggregatesTest(TestCase):
+
+    def setUp(self):
+        self.album = Album.objects.create(title='Album', artwork='https://example.com/a.png')
+        self.first = Song.objects.create(title='First', artwork='https://example.com/s.png', duration=100)
+        self.second = Song.objects.create(title='Second', artwork='https://example.com/s.png', duration=50)
+        self.first.albums.add(self.album)
+        self.second.albums.add(self.album)
+
+    def assertAggregates(self, total_duration, track_count):
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.total_duration, total_duration)
+        self.assertEqual(self.album.track_count, track_count)
+
+    def test_add_and_remove(self):
+        self.assertAggregates(150, 2)
+        self.first.albums.remove(self.album)
+        self.assertAggregates(50, 1)
+        self.first.albums.remove(self.album)
+        self.assertAggregates(50, 1)
+
+    def test_clear(self):
+        self.second.albums.clear()
+        self.assertAggregates(100, 1)
+
+    def test_duration_edit(self):
+        self.second.duration = 80
+        self.second.save()
+        self.assertAggregates(180, 2)
+
+    def test_song_delete(self):
+        self.first.delete()
+        self.assertAggregates(50, 1)
+
+    def test_rebuild_command(self):
+        Album.objects.update(total_duration=0, track_count=0)
+        versions = get_tag_versions(['album'])
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_album_aggregates', stdout=StringIO())
+        self.assertAggregates(150, 2)
+        self.assertNotEqual(get_tag_versions(['album']), versions)
+
+
+class TrackNumberingTest(TestCase):
+
+    def setUp(self):
+        self.album = Album.objects.create(title='Album', artwork='https://example.com/a.png')
+
+    def make_songs(self, count):
+        return Song.objects.bulk_create([
+            Song(title=f'Song {i}', artwork='https://example.com/s.png', duration=10) for i in range(count)
+        ])
+
+    def track_numbers(self):
+        return list(Track.objects.filter(album=self.album).order_by('song_id').values_list('track_number', flat=True))
+
+    def test_add_many_songs_in_constant_queries(self):
+        songs = self.make_songs(200)
+        with CaptureQueriesContext(connection) as queries:
+            self.album.song_set.add(*songs)
+
+        self.assertLessEqual(len(queries), 10)
+        self.assertEqual(self.track_numbers(), list(range(1, 201)))
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.track_count, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.album.song_set.remove(*songs[::2])
+
+        self.assertLessEqual(len(queries), 10)
+        self.assertEqual(self.track_numbers(), list(range(1, 101)))
+
+    def test_remove_one_song_at_a_time(self):
+        songs = self.make_songs(100)
+        self.album.song_set.add(*songs)
+
+        with CaptureQueriesContext(connection) as queries:
+            for song in songs[:50]:
+                song.albums.remove(self.album)
+
+        # A fixed number of queries per call, whatever the album's size
+        self.assertEqual(len(queries), 50 * 9)
+        self.assertEqual(self.track_numbers(), list(range(1, 51)))
+
+    def test_remove_shifts_following_tracks(self):
+        songs = self.make_songs(6)
+        self.album.song_set.add(*songs)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.album.song_set.remove(songs[1], songs[3])
+
+        self.assertLessEqual(len(queries), 10)
+        self.assertEqual(self.track_numbers(), [1, 2, 3, 4])
+
+    def test_forward_add_to_many_albums(self):
+        song = self.make_songs(2)[0]
+        other = Album.objects.create(title='Other', artwork='https://example.com/a.png')
+        self.make_songs(1)[0].albums.add(other)
+
+        song.albums.add(self.album, other)
+
+        self.assertEqual(Track.objects.get(album=self.album, song=song).track_number, 1)
+        self.assertEqual(Track.objects.get(album=other, song=song).track_number, 2)
+
+    def test_song_delete_closes_gap(self):
+        songs = self.make_songs(3)
+        self.album.song_set.add(*songs)
+        songs[0].delete()
+        self.assertEqual(self.track_numbers(), [1, 2])
+
+
+class ConcurrentTrackRemovalTest(TransactionTestCase):
+
+    def test_concurrent_removals_adjust_the_album_once(self):
+        album = Album.objects.create(title='Album', artwork='https://example.com/a.png')
+        songs = Song.objects.bulk_create([Song(title=f'Song {i}', artwork='https://example.com/s.png', duration=10) for i in range(2)])
+        album.song_set.add(*songs)
+
+        def remove_again():
+            try:
+                Song.objects.get(pk=songs[0].pk).albums.remove(album)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            songs[0].albums.remove(album)
+            thread = threading.Thread(target=remove_again)
+            thread.start()
+            # The other removal waits for the album lock taken here
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+
+        album.refresh_from_db()
+        self.assertEqual((album.track_count, album.total_duration), (1, 10))
+        self.assertEqual(list(Track.objects.values_list('song_id', 'track_number')), [(songs[1].pk, 1)])
+
+
+class GraphQLResponseCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Song.objects.create(title='First', artwork='https://example.com/s.png')
+
+    def post(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/graphql/', {'query': query}, content_type='application/json')
+        return response.json(), len(queries)
+
+    def test_anonymous_queries_are_cached(self):
+        first, first_count = self.post('{ allSongs { edges { node { title } } } }')
+        second, second_count = self.post('query {\n  allSongs {\n    edges { node { title } }\n  }\n}')
+
+        self.assertEqual(first, second)
+        self.assertGreater(first_count, 0)
+        self.assertEqual(second_count, 0)
+        self.assertEqual(get_stats()['hits'], 1)
+        self.assertEqual(get_stats()['misses'], 1)
+
+    def test_writes_invalidate_dependent_responses(self):
+        self.post('{ allSongs { edges { node { title } } } }')
+        self.post('{ updates { edges { node { title } } } }')
+        with self.captureOnCommitCallbacks(execute=True):
+            Song.objects.create(title='Second', artwork='https://example.com/s.png')
+
+        data, count = self.post('{ allSongs { edges { node { title } } } }')
+        self.assertGreater(count, 0)
+        self.assertEqual([edge['node']['title'] for edge in data['data']['allSongs']['edges']], ['Second', 'First'])
+
+        _, count = self.post('{ updates { edges { node { title } } } }')
+        self.assertEqual(count, 0)
+
+    def test_versions_change_once_writes_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Song.objects.create(title='Second', artwork='https://example.com/s.png')
+        self.assertEqual(get_tag_versions(['song']), {'song': 0})
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_tag_versions(['song']), {'song': 1})
+
+    def test_mutations_are_not_cached(self):
+        song = Song.objects.get()
+        mutation = f'mutation {{ makeComment(text: "Hi", nickname: "a", song: {song.id}) {{ comment {{ id }} }} }}'
+        self.post(mutation)
+        self.post(mutation)
+        self.assertEqual(song.comment_set.count(), 2)
+
+
+class KeysetPaginationTest(TestCase):
+    query = '''
+        query ($after: String) {
+            allSongs(first: 2, after: $after) {
+                edges { node { title } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+
+    def test_pages_cover_catalog_in_order(self):
+        release_dates = [date(2020, 1, 1), None, date(2022, 1, 1), date(2020, 1, 1), None]
+        for i, release_date in enumerate(release_dates):
+            Song.objects.create(title=f'Song {i}', artwork='https://example.com/s.png', release_date=release_date)
+
+        titles = []
+        after = None
+        while True:
+            result = schema.execute(self.query, variables={'after': after}, context_value=RequestFactory().get('/graphql/'))
+            self.assertIsNone(result.errors)
+            page = result.data['allSongs']
+            titles += [edge['node']['title'] for edge in page['edges']]
+            if not page['pageInfo']['hasNextPage']:
+                break
+            after = page['pageInfo']['endCursor']
+
+        self.assertEqual(titles, ['Song 4', 'Song 1', 'Song 2', 'Song 3', 'Song 0'])
+
+    def test_page_size_is_capped(self):
+        Song.objects.bulk_create([Song(title=str(i), artwork='https://example.com/s.png') for i in range(120)])
+        result = schema.execute('{ allSongs(first: 1000) { edges { cursor } } }', context_value=RequestFactory().get('/graphql/'))
+        self.assertEqual(len(result.data['allSongs']['edges']), 100)
+
+
+class UploadPipelineTest(SimpleTestCase):
+
+    def test_local_backend_writes_files(self):
+        with tempfile.TemporaryDirectory() as root:
+            backend = LocalBackend(root, 'http://media.test/')
+            urls = upload_files(backend, {
+                'mp3': ('mp3/song.mp3', SimpleUploadedFile('song.mp3', b'mp3 data')),
+                'wav': ('wav/song.wav', SimpleUploadedFile('song.wav', b'wav data')),
+            })
+
+            self.assertEqual(urls, {'mp3': 'http://media.test/mp3/song.mp3', 'wav': 'http://media.test/wav/song.wav'})
+            self.assertEqual((Path(root) / 'wav/song.wav').read_bytes(), b'wav data')
+
+    def test_uploads_run_concurrently(self):
+        barrier = threading.Barrier(4, timeout=5)
+
+        class BarrierBackend:
+            def upload(self, path, file):
+                # Only returns once all four uploads are in flight at the same time
+                barrier.wait()
+                return path
+
+        files = {name: (name, SimpleUploadedFile(name, b'data')) for name in ('artwork', 'mp3', 'wav', 'flac')}
+        self.assertEqual(upload_files(BarrierBackend(), files), {name: name for name in files})
+
+    @override_settings(MEDIA_STORAGE={
+        'BACKEND': 'music_api.storage.LocalBackend',
+        'OPTIONS': {'root': tempfile.gettempdir(), 'base_url': 'http://media.test/'},
+    })
+    def test_backend_is_shared_across_threads(self):
+        backends = []
+        threads = [threading.Thread(target=lambda: backends.append(get_backend())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(get_backend(), LocalBackend)
+        self.assertTrue(all(backend is get_backend() for backend in backends))
+
+
+class CountingFile:
+    """
+    File wrapper that counts how many bytes are read through it.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+
+def mp3_frame_header():
+    # MPEG 1 layer III, 128 kbps, 44.1 kHz, stereo
+    return bytes([0xFF, 0xFB, 0x90, 0x00])
+
+
+class AudioDurationTest(SimpleTestCase):
+
+    def test_wav(self):
+        buffer = BytesIO()
+        with wave.open(buffer, 'wb') as output:
+            output.setnchannels(2)
+            output.setsampwidth(2)
+            output.setframerate(8000)
+            output.writeframes(b'\0' * 8000 * 4 * 3)
+        buffer.seek(0)
+
+        self.assertEqual(get_audio_file_duration(wav=buffer), 3)
+        self.assertEqual(buffer.tell(), 0)
+
+    def test_large_wav_reads_only_headers(self):
+        data_size = 500 * 1024 * 1024
+        header = b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+        header += b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 2, 44100, 44100 * 4, 4, 16)
+        header += b'data' + struct.pack('<I', data_size)
+
+        with tempfile.TemporaryFile() as file:
+            file.write(header)
+            file.truncate(len(header) + data_size)
+            counting = CountingFile(file)
+
+            self.assertAlmostEqual(get_audio_file_duration(wav=counting), data_size / (44100 * 4))
+            self.assertLess(counting.bytes_read, 1024)
+
+    def test_flac(self):
+        streaminfo = bytes(10) + ((48000 << 44) | (1 << 41) | (23 << 36) | 48000 * 90).to_bytes(8, 'big') + bytes(16)
+        flac = BytesIO(b'fLaC' + bytes([0x80, 0, 0, 34]) + streaminfo + bytes(1000))
+        self.assertEqual(get_audio_file_duration(flac=flac), 90)
+
+    def test_mp3_with_xing_header(self):
+        frame = mp3_frame_header() + bytes(32) + b'Xing' + struct.pack('>II', 1, 1000) + bytes(400)
+        id3 = b'ID3' + bytes([4, 0, 0, 0, 0, 0, 20]) + bytes(20)
+        mp3 = BytesIO(id3 + frame)
+        self.assertAlmostEqual(get_audio_file_duration(mp3=mp3), 1000 * 1152 / 44100)
+
+    def test_constant_bitrate_mp3(self):
+        mp3 = BytesIO(mp3_frame_header() + bytes(16000 - 4))
+        self.assertAlmostEqual(get_audio_file_duration(mp3=mp3), 1)
+
+    def test_files_are_probed_as_their_format(self):
+        mp3 = BytesIO(mp3_frame_header() + bytes(32000 - 4))
+        self.assertAlmostEqual(get_audio_file_duration(flac=None, mp3=mp3), 2)
+        self.assertEqual(get_audio_file_duration(), 0)
+
+        # Frame sync bytes in a broken WAV are not taken for MP3 frames
+        with self.assertRaisesMessage(ValueError, 'Not a WAV file'):
+            get_audio_file_duration(wav=BytesIO(mp3_frame_header() + bytes(32000 - 4)), mp3=mp3)
+        with self.assertRaisesMessage(ValueError, 'Not a FLAC file'):
+            get_audio_file_duration(flac=BytesIO(b'not audio'))
+
+
+class FailingBackend:
+
+    def __init__(self, **kwargs):
+        pass
+
+    def upload(self, path, file):
+        raise ConnectionError('Storage is down')
+
+
+class IngestionTest(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        settings = override_settings(
+            MEDIA_STORAGE={
+                'BACKEND': 'music_api.storage.LocalBackend',
+                'OPTIONS': {'root': self.root.name + '/media', 'base_url': 'http://media.test/'},
+            },
+            INGESTION={'STAGING_ROOT': self.root.name + '/staging', 'MAX_ATTEMPTS': 2, 'RETRY_BACKOFF': 10, 'STALE_AFTER': 60},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.album = Album.objects.create(title='Album', artwork='https://example.com/a.png')
+        enqueue = mock.patch('music_api.ingestion.enqueue')
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def make_job(self, key='key'):
+        return create_job({
+            'title': 'Song',
+            'release_date': date(2024, 5, 1),
+            'original': True,
+            'albums': [self.album],
+            'artwork': SimpleUploadedFile('cover.png', b'png'),
+            'mp3': SimpleUploadedFile('song.mp3', mp3_frame_header() + bytes(16000 - 4)),
+            'wav': SimpleUploadedFile('song.wav', sine_wav().read()),
+        }, idempotency_key=key)
+
+    def test_job_creates_song_once(self):
+        job = self.make_job()
+        self.assertEqual(job.status, IngestionJob.PENDING)
+
+        job = process_job(job.pk)
+        self.assertEqual(job.status, IngestionJob.SUCCEEDED)
+        self.assertEqual(job.song.title, 'Song')
+        self.assertEqual(job.song.mp3, 'http://media.test/mp3/song.mp3')
+        self.assertEqual(job.song.duration, 3)
+        self.assertEqual(len(job.song.waveform), 4000)
+        self.assertIsNotNone(job.song.loudness)
+
+        result = schema.execute(f'{{ song(id: {job.song.id}) {{ waveform loudness }} }}', context_value=RequestFactory().get('/graphql/'))
+        self.assertEqual(base64.b64decode(result.data['song']['waveform']), bytes(job.song.waveform))
+        self.assertEqual(list(job.song.albums.all()), [self.album])
+
+        process_job(job.pk)
+        self.assertEqual(Song.objects.count(), 1)
+
+    def test_storage_failures_are_retried_with_backoff(self):
+        job = self.make_job()
+        with override_settings(MEDIA_STORAGE={'BACKEND': 'music_api.tests.FailingBackend'}), self.assertLogs('music_api.ingestion', 'ERROR'):
+            job = process_job(job.pk)
+            self.assertEqual(job.status, IngestionJob.PENDING)
+            self.enqueue.assert_called_once_with(job.pk, delay=10)
+
+            job = process_job(job.pk)
+            self.assertEqual(job.status, IngestionJob.FAILED)
+            self.assertEqual(job.attempts, 2)
+            self.assertEqual(job.error, 'Storage is down')
+
+        self.assertEqual(Song.objects.count(), 0)
+        self.assertEqual(os.listdir(self.root.name + '/staging'), [])
+
+    def test_staged_files_are_removed_when_key_is_taken(self):
+        self.make_job()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.make_job()
+        self.assertEqual(len(os.listdir(self.root.name + '/staging')), 1)
+
+    def test_job_finished_by_another_worker_is_left_alone(self):
+        job = self.make_job()
+        song = Song.objects.create(title='Song', artwork='https://example.com/s.png')
+
+        def upload_files(backend, files):
+            # The job was requeued as stale and another worker finished it meanwhile
+            IngestionJob.objects.filter(pk=job.pk).update(song=song, status=IngestionJob.SUCCEEDED)
+            return {name: 'http://media.test/' + path for name, (path, _) in files.items()}
+
+        with mock.patch('music_api.ingestion.upload_files', upload_files):
+            result = process_job(job.pk)
+        self.assertEqual(result.status, IngestionJob.SUCCEEDED)
+        self.assertEqual(result.song, song)
+        self.assertEqual(Song.objects.count(), 1)
+
+    def test_other_failures_are_retried(self):
+        job = self.make_job()
+        with mock.patch('music_api.ingestion.create_song', side_effect=ValueError('Bad payload')), self.assertLogs('music_api.ingestion', 'ERROR'):
+            job = process_job(job.pk)
+        self.assertEqual(job.status, IngestionJob.PENDING)
+        self.assertEqual(job.error, 'Bad payload')
+        self.enqueue.assert_called_once_with(job.pk, delay=10)
+
+    def test_jobs_of_stopped_workers_are_requeued(self):
+        running, fresh, done = [self.make_job(key) for key in ('running', 'fresh', 'done')]
+        IngestionJob.objects.filter(pk=running.pk).update(status=IngestionJob.RUNNING, updated=timezone.now() - timedelta(hours=1))
+        IngestionJob.objects.filter(pk=done.pk).update(status=IngestionJob.SUCCEEDED, updated=timezone.now() - timedelta(hours=1))
+
+        redis = mock.Mock()
+        redis.lrange.return_value = [str(job.pk).encode() for job in (running, fresh, done)]
+        redis.lrem.return_value = 1
+        versions = get_tag_versions(['ingestionjob'])
+        with mock.patch('music_api.ingestion.get_redis_connection', return_value=redis), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(requeue_stale_jobs(), [running.pk])
+        self.assertNotEqual(get_tag_versions(['ingestionjob']), versions)
+
+        redis.lpush.assert_called_once_with(QUEUE_KEY, running.pk)
+        self.assertEqual(redis.lrem.call_count, 2)
+        running.refresh_from_db()
+        self.assertEqual(running.status, IngestionJob.PENDING)
+
+
+def sine_wav(seconds=3, rate=8000, amplitude=0.5, sample_width=2):
+    scale = 2 ** (8 * sample_width - 1) - 1
+    frames = bytearray()
+    for i in range(seconds * rate):
+        sample = int(amplitude * scale * math.sin(2 * math.pi * 440 * i / rate)).to_bytes(sample_width, 'little', signed=True)
+        frames += sample * 2
+
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as output:
+        output.setnchannels(2)
+        output.setsampwidth(sample_width)
+        output.setframerate(rate)
+        output.writeframes(bytes(frames))
+    buffer.seek(0)
+    return buffer
+
+
+class WaveformTest(SimpleTestCase):
+
+    def test_peaks_and_loudness(self):
+        waveform, loudness = analyze_wav(sine_wav(), points=100)
+        pairs = struct.unpack(f'{len(waveform)}b', waveform)
+
+        self.assertEqual(len(waveform), 200)
+        self.assertTrue(all(-65 <= low <= -62 and 62 <= high <= 65 for low, high in zip(pairs[::2], pairs[1::2])))
+        # A stereo sine at half scale has a mean square of 0.125 per channel
+        self.assertAlmostEqual(loudness, 10 * math.log10(0.125), places=1)
+
+    def test_chunking_does_not_change_result(self):
+        expected = analyze_wav(sine_wav(sample_width=3), points=64)
+        with mock.patch('music_api.waveform.CHUNK_FRAMES', 1000):
+            self.assertEqual(analyze_wav(sine_wav(sample_width=3), points=64), expected)
+
+    def test_silence_has_no_loudness(self):
+        _, loudness = analyze_wav(sine_wav(amplitude=0))
+        self.assertIsNone(loudness)
+
+
+class SearchTest(TestCase):
+    query = '''
+        query ($query: String!, $after: String) {
+            search(query: $query, first: 2, after: $after) {
+                edges { node { rank snippet song { title } album { title } } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+
+    def search(self, text, after=None):
+        result = schema.execute(self.query, variables={'query': text, 'after': after}, context_value=RequestFactory().get('/graphql/'))
+        self.assertIsNone(result.errors)
+        return result.data['search']
+
+    def test_ranked_results_across_songs_and_albums(self):
+        Song.objects.create(title='Quiet Streets', artwork='https://example.com/s.png', lyrics='We drove down to the ocean at night')
+        Song.objects.create(title='Ocean Eyes', artwork='https://example.com/s.png', lyrics='Nothing to see here')
+        Album.objects.create(title='Tides', artwork='https://example.com/a.png', note='Songs written by the ocean')
+        Song.objects.create(title='Desert', artwork='https://example.com/s.png', lyrics='Sand and sun')
+
+        first = self.search('oceans')
+        self.assertTrue(first['pageInfo']['hasNextPage'])
+        self.assertEqual(first['edges'][0]['node']['song']['title'], 'Ocean Eyes')
+        self.assertIn('<mark>Ocean</mark>', first['edges'][0]['node']['snippet'])
+
+        second = self.search('oceans', after=first['pageInfo']['endCursor'])
+        self.assertFalse(second['pageInfo']['hasNextPage'])
+
+        nodes = [edge['node'] for edge in first['edges'] + second['edges']]
+        titles = {(node['song'] or node['album'])['title'] for node in nodes}
+        self.assertEqual(titles, {'Ocean Eyes', 'Quiet Streets', 'Tides'})
+        ranks = [node['rank'] for node in nodes]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+    def test_cached_results_follow_the_catalog(self):
+        cache.clear()
+        song = Song.objects.create(title='Ocean Eyes', artwork='https://example.com/s.png')
+        query = '{ search(query: "ocean") { edges { node { rank snippet } } } }'
+
+        def post():
+            response = self.client.post('/graphql/', {'query': query}, content_type='application/json')
+            return response.json()['data']['search']['edges']
+
+        self.assertEqual(len(post()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            song.title = 'Desert'
+            song.save()
+        self.assertEqual(post(), [])
+
+
+class ComplexityLimitTest(TestCase):
+
+    def post(self, query):
+        return self.client.post('/graphql/', {'query': query}, content_type='application/json')
+
+    def test_typical_query_is_allowed(self):
+        with self.assertLogs('sar.complexity', 'INFO') as logs:
+            response = self.post('query Albums { allAlbums(first: 20) { edges { node { title songs { title trackNumber } } } } }')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('errors', response.json())
+        # 1 + 20 * (edges 1 + node 1 + title 1 + songs (1 + 20 * 2))
+        self.assertIn('GraphQL operation Albums costs 881 at depth 5', logs.output[0])
+
+    def test_nested_query_is_allowed(self):
+        for query in (
+            '{ updates { edges { node { referencesAlbums { songs { title } } } } } }',
+            '{ updates(first: 20) { edges { node { title referencesAlbums { title songs { title } } } } } }',
+        ):
+            response = self.post(query)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('errors', response.json())
+
+    def test_benchmark_reads_are_allowed(self):
+        for name, (query, variables) in read_queries().items():
+            response = self.client.post('/graphql/', {'query': query, 'variables': variables}, content_type='application/json')
+            self.assertNotIn('errors', response.json(), name)
+
+    def test_introspection_is_allowed(self):
+        response = self.post(get_introspection_query())
+        self.assertEqual(response.status_code, 200)
+
+    def test_fan_out_is_rejected(self):
+        with self.assertLogs('sar.complexity', 'INFO') as logs:
+            response = self.post('query FanOut { allSongs { edges { node { alternatives { alternatives { alternatives { title } } } } } } }')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Query costs', response.json()['errors'][0]['message'])
+        self.assertIn('GraphQL operation FanOut costs', logs.output[0])
+
+    def test_cached_responses_are_logged(self):
+        cache.clear()
+        query = 'query Albums { allAlbums(first: 20) { edges { node { title } } } }'
+        self.post(query)
+        with self.assertLogs('sar.complexity', 'INFO') as logs:
+            self.post(query)
+        self.assertEqual(get_stats()['hits'], 1)
+        self.assertEqual(len(logs.output), 1)
+
+    def test_depth_is_limited(self):
+        response = self.post(
+            '{ allSongs(first: 1) { edges { node { albums { songs { albums { songs { albums { songs { albums { title } } } } } } } } } } }'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Query is nested 11 levels deep, the maximum is 10.', [error['message'] for error in response.json()['errors']])
+
+
+class PersistedQueryTest(TestCase):
+    query = 'query Titles { allSongs(first: 5) { edges { node { title } } } }'
+
+    def setUp(self):
+        cache.clear()
+        documents.clear()
+        Song.objects.create(title='Persisted', artwork='https://example.com/s.png')
+
+    def post(self, data):
+        return self.client.post('/graphql/', data, content_type='application/json')
+
+    def persisted(self, query=None, sha256_hash=None):
+        data = {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': sha256_hash or query_hash(self.query)}}}
+        if query:
+            data['query'] = query
+        return data
+
+    def test_hash_is_registered_then_served(self):
+        response = self.post(self.persisted())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        response = self.post(self.persisted(self.query))
+        self.assertEqual(response.json()['data']['allSongs']['edges'][0]['node']['title'], 'Persisted')
+
+        # Served from the shared store once this process forgets the document
+        documents.clear()
+        response = self.post(self.persisted())
+        self.assertEqual(response.json()['data']['allSongs']['edges'][0]['node']['title'], 'Persisted')
+
+    def test_registered_queries_expire(self):
+        with mock.patch('sar.documents.cache.set') as cache_set:
+            self.post(self.persisted(self.query))
+        cache_set.assert_any_call(f'graphql:persisted:{query_hash(self.query)}', self.query, 60 * 60 * 24)
+
+    def test_invalid_queries_are_not_registered(self):
+        query = '{ allSongs { edges { node { missing } } } }'
+        response = self.post(self.persisted(query, sha256_hash=query_hash(query)))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post(self.persisted(sha256_hash=query_hash(query)))
+        self.assertEqual(response.json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+    def test_mismatched_hash_is_rejected(self):
+        response = self.post(self.persisted(self.query, sha256_hash='0' * 64))
+        self.assertEqual(response.status_code, 400)
+
+    def test_documents_are_parsed_once(self):
+        self.post({'query': self.query})
+        with mock.patch('sar.documents.parse') as parse, mock.patch('sar.documents.validate') as validate:
+            response = self.post({'query': self.query})
+        self.assertEqual(response.json()['data']['allSongs']['edges'][0]['node']['title'], 'Persisted')
+        parse.assert_not_called()
+        validate.assert_not_called()
+
+    def test_allow_list(self):
+        call_command('register_persisted_queries', stdin=StringIO(self.query), stdout=StringIO())
+        with override_settings(GRAPHQL_PERSISTED_QUERIES={'CACHE_SIZE': 10, 'TIMEOUT': 60, 'ALLOW_LIST': True}):
+            self.assertIn('data', self.post(self.persisted()).json())
+            self.assertIn('data', self.post({'query': self.query}).json())
+
+            response = self.post({'query': '{ allAlbums { edges { node { title } } } }'})
+            self.assertEqual(response.status_code, 403)
+
+
+@override_settings(METRICS_OPERATIONS=['Albums'])
+class InstrumentationTest(TestCase):
+    query = 'query Albums { allAlbums { edges { node { title songs { title trackNumber } } } } }'
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        make_catalog(albums=3, songs_per_album=4)
+
+    def post(self, query=None, **headers):
+        return self.client.post('/graphql/', {'query': query or self.query}, content_type='application/json', headers=headers)
+
+    def test_resolvers_are_timed_and_counted(self):
+        with self.assertLogs('sar.instrumentation', 'INFO') as logs:
+            self.post()
+        self.assertEqual(logs.records[0].operation, 'Albums')
+        self.assertEqual(logs.records[0].queries, 2)
+
+        operations, resolvers = metrics.snapshot()
+        self.assertEqual(operations['Albums'][0], 1)
+        self.assertEqual(resolvers['AlbumType.songs'][0], 3)
+        self.assertEqual(resolvers['SongType.trackNumber'][0], 12)
+        # Albums and their tracks are loaded up front by allAlbums
+        self.assertEqual(resolvers['Query.allAlbums'][2], 2)
+
+    def test_labels_do_not_follow_clients(self):
+        self.post('query Mine { first: allAlbums { edges { node { name: title } } } }')
+        self.post('{ second: allAlbums { edges { node { title } } } }')
+        operations, resolvers = metrics.snapshot()
+        self.assertEqual(operations, {'anonymous': mock.ANY})
+        self.assertEqual(operations['anonymous'][0], 2)
+        self.assertEqual(resolvers['Query.allAlbums'][0], 2)
+        self.assertEqual(resolvers['AlbumType.title'][0], 6)
+
+        with override_settings(GRAPHQL_PERSISTED_QUERIES={'CACHE_SIZE': 10, 'TIMEOUT': 60, 'ALLOW_LIST': True}):
+            call_command('register_persisted_queries', stdin=StringIO('query Mine { allAlbums { edges { node { title } } } }'), stdout=StringIO())
+            self.post('query Mine { allAlbums { edges { node { title } } } }')
+        self.assertEqual(metrics.snapshot()[0]['Mine'][0], 1)
+
+    def test_timing_extension_is_for_superusers(self):
+        self.assertNotIn('extensions', self.post(x_graphql_timing='1').json())
+
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        timing = self.post(x_graphql_timing='1').json()['extensions']['timing']
+        self.assertEqual(timing['queries'], 2)
+        self.assertIn('Query.allAlbums', [resolver['field'] for resolver in timing['resolvers']])
+
+    def test_prometheus_endpoint(self):
+        self.post()
+        self.assertEqual(self.client.get('/graphql/metrics/').status_code, 401)
+
+        with override_settings(METRICS_TOKEN='secret'):
+            response = self.client.get('/graphql/metrics/', headers={'authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('graphql_operations_total{operation="Albums"} 1', body)
+        self.assertIn('graphql_resolver_calls_total{field="AlbumType.songs"} 3', body)
+        self.assertIn('graphql_response_cache_misses_total 1', body)
+
+class QueryOptimizerTest(TestCase):
+
+    def execute(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, context_value=RequestFactory().get('/graphql/'))
+        self.assertIsNone(result.errors)
+        return result.data, queries
+
+    def test_nested_relations_are_prefetched(self):
+        albums, songs = make_catalog(albums=3, songs_per_album=3)
+        for song in songs:
+            Comment.objects.create(text='Nice', nickname='fan', song=song)
+        songs[0].alternatives.add(songs[1])
+
+        data, queries = self.execute('''
+            {
+                allSongs {
+                    edges { node { title albums { title } alternatives { title } commentSet { text song { title } } } }
+                }
+            }
+        ''')
+        # Songs, then albums, alternatives and comments joined to their song
+        self.assertEqual(len(queries), 4)
+        node = next(edge['node'] for edge in data['allSongs']['edges'] if edge['node']['title'] == songs[0].title)
+        self.assertEqual(node['albums'], [{'title': albums[0].title}])
+        self.assertEqual(node['alternatives'], [{'title': songs[1].title}])
+        self.assertEqual(node['commentSet'], [{'text': 'Nice', 'song': {'title': songs[0].title}}])
+
+        # Only the selected columns are read
+        self.assertNotIn('lyrics', queries[0]['sql'])
+        self.assertNotIn('waveform', queries[0]['sql'])
+
+    def test_album_songs_follow_track_order(self):
+        album = Album.objects.create(title='Album', artwork='https://example.com/a.png')
+        first, second = (Song.objects.create(title=title, artwork='https://example.com/s.png') for title in ('First', 'Second'))
+        album.song_set.add(first, second)
+        Track.objects.filter(song=first).update(track_number=3)
+
+        data, queries = self.execute(f'{{ album(id: {album.id}) {{ songs {{ title trackNumber releaseDate }} }} }}')
+        self.assertEqual(data['album']['songs'], [
+            {'title': 'Second', 'trackNumber': 2, 'releaseDate': None},
+            {'title': 'First', 'trackNumber': 3, 'releaseDate': None},
+        ])
+        self.assertEqual(len(queries), 2)
+
+
+class BulkMutationTest(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().post('/graphql/')
+        self.request.user = User.objects.create_superuser('admin', password='password')
+        self.albums, self.songs = make_catalog(albums=2, songs_per_album=4)
+
+    def execute(self, query, variables):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, variables=variables, context_value=self.request)
+        self.assertIsNone(result.errors)
+        return result.data, len(queries)
+
+    def set_tracklist(self, album, songs):
+        return self.execute('''
+            mutation Tracklist($album: ID!, $songs: [ID!]!) {
+                setAlbumTracklist(albumId: $album, songIds: $songs) {
+                    album { duration numberOfSongs songs { id trackNumber } }
+                }
+            }
+        ''', {'album': album.id, 'songs': [song.id for song in songs]})
+
+    def test_set_album_tracklist(self):
+        album, other = self.albums
+        songs = [self.songs[2], self.songs[0], self.songs[5]]
+        data, count = self.set_tracklist(album, songs)
+
+        result = data['setAlbumTracklist']['album']
+        self.assertEqual(result['songs'], [{'id': str(song.id), 'trackNumber': number} for number, song in enumerate(songs, 1)])
+        self.assertEqual(result['numberOfSongs'], 3)
+        self.assertEqual(result['duration'], sum(song.duration for song in songs))
+
+        album.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((album.total_duration, album.track_count), (result['duration'], 3))
+        self.assertEqual(other.track_count, 4)
+        self.assertEqual(
+            list(Track.objects.filter(album=album).order_by('track_number').values_list('song_id', flat=True)),
+            [song.id for song in songs],
+        )
+
+        # Reordering a longer album takes as many queries
+        _, reorder_count = self.set_tracklist(other, self.songs[7:3:-1])
+        self.assertLessEqual(reorder_count, count)
+
+    def test_bulk_modify_songs(self):
+        first, second = self.songs[:2]
+        album, other = self.albums
+        data, _ = self.execute('''
+            mutation Modify($songs: [SongInput!]!) {
+                bulkModifySongs(songs: $songs) { songs { title albums { id } alternatives { id } } }
+            }
+        ''', {'songs': [
+            {'id': first.id, 'title': 'Renamed', 'albums': [other.id], 'alternatives': [second.id]},
+            {'id': second.id, 'note': 'Live'},
+        ]})
+
+        self.assertEqual(data['bulkModifySongs']['songs'][0], {
+            'title': 'Renamed', 'albums': [{'id': str(other.id)}], 'alternatives': [{'id': str(second.id)}],
+        })
+        self.assertEqual(Song.objects.get(pk=second.id).note, 'Live')
+        self.assertEqual(list(second.alternatives.all()), [first])
+
+        album.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(album.track_count, 3)
+        self.assertEqual(other.track_count, 5)
+        self.assertEqual(list(Track.objects.filter(album=album).order_by('track_number').values_list('track_number', flat=True)), [1, 2, 3])
+        self.assertEqual(Track.objects.get(album=other, song=first).track_number, 5)
+
+    def test_unknown_ids_change_nothing(self):
+        result = schema.execute(
+            'mutation { bulkModifySongs(songs: [{id: %d, title: "Renamed", albums: [0]}]) { songs { id } } }' % self.songs[0].id,
+            context_value=self.request,
+        )
+        self.assertEqual(result.errors[0].message, 'Albums do not exist: 0')
+        self.assertEqual(Song.objects.get(pk=self.songs[0].id).title, self.songs[0].title)
+
+
+class ConstraintsTest(TestCase):
+
+    def check_constraints(self):
+        # Deferred constraints are otherwise only checked at commit
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    def test_track_numbers_stay_unique_when_reordering(self):
+        albums, songs = make_catalog(albums=1, songs_per_album=5)
+        albums[0].song_set.remove(songs[1], songs[3])
+        set_album_tracklist(albums[0].pk, [songs[4].pk, songs[0].pk, songs[2].pk])
+        self.check_constraints()
+
+    def test_song_is_on_an_album_once(self):
+        albums, songs = make_catalog(albums=1, songs_per_album=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Track.objects.create(song=songs[0], album=albums[0], track_number=2)
+
+    def test_benchmark_reports_hot_queries(self):
+        output = StringIO()
+        call_command('benchmark_queries', albums=3, songs_per_album=4, repeat=2, explain=True, stdout=output)
+        self.assertIn('album_tracks', output.getvalue())
+        self.assertIn('Index', output.getvalue())
+        # The synthetic catalog is rolled back
+        self.assertEqual(Song.objects.count(), 0)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_regressions_fail_against_baseline(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = Path(directory.name) / 'baseline.json'
+        options = {'albums': 3, 'songs_per_album': 3, 'repeat': 2, 'operations': ['all_albums', 'song', 'set_album_tracklist']}
+
+        call_command('benchmark_api', save_baseline=str(baseline), stdout=StringIO(), **options)
+        results = json.loads(baseline.read_text())
+        self.assertEqual(results['all_albums']['queries'], 2)
+        self.assertEqual(Song.objects.count(), 0)
+
+        call_command('benchmark_api', baseline=str(baseline), tolerance=100, stdout=StringIO(), **options)
+
+        results['song']['queries'] -= 1
+        baseline.write_text(json.dumps(results))
+        with self.assertRaisesMessage(CommandError, 'song made'):
+            call_command('benchmark_api', baseline=str(baseline), tolerance=100, stdout=StringIO(), **options)
+
+        del results['all_albums']
+        baseline.write_text(json.dumps(results))
+        with self.assertRaisesMessage(CommandError, 'all_albums is missing from the baseline'):
+            call_command('benchmark_api', baseline=str(baseline), tolerance=100, stdout=StringIO(), **options)
+
+
+class SongCommentsTest(TestCase):
+    query = '''
+        query ($song: Int!, $first: Int, $after: String) {
+            comments(songId: $song, first: $first, after: $after) {
+                totalCount
+                edges { node { text } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.song = Song.objects.create(title='Song', artwork='https://example.com/s.png')
+        Comment.objects.bulk_create([Comment(text=str(i), nickname='a', song=self.song) for i in range(5)])
+
+    def comments(self, **variables):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(
+                self.query, variables={'song': self.song.id, **variables}, context_value=RequestFactory().get('/graphql/'),
+            )
+        self.assertIsNone(result.errors)
+        return result.data['comments'], len(queries)
+
+    def texts(self, page):
+        return [edge['node']['text'] for edge in page['edges']]
+
+    def test_pages_are_newest_first(self):
+        first, _ = self.comments(first=3)
+        second, _ = self.comments(first=3, after=first['pageInfo']['endCursor'])
+
+        self.assertEqual(self.texts(first), ['4', '3', '2'])
+        self.assertEqual(self.texts(second), ['1', '0'])
+        self.assertFalse(second['pageInfo']['hasNextPage'])
+        self.assertEqual(first['totalCount'], 5)
+
+    def test_first_page_and_count_are_cached(self):
+        first, first_count = self.comments(first=3)
+        second, second_count = self.comments(first=3)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first_count, 2)
+        self.assertEqual(second_count, 0)
+
+    def test_comment_mutations_invalidate_the_song(self):
+        self.comments()
+        mutation = f'mutation {{ makeComment(text: "new", nickname: "b", song: {self.song.id}) {{ comment {{ id }} }} }}'
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            result = schema.execute(mutation, context_value=RequestFactory().post('/graphql/'))
+        # Only the insert, the song is not fetched
+        self.assertEqual([query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']], ['INSERT'])
+
+        page, _ = self.comments()
+        self.assertEqual(page['totalCount'], 6)
+        self.assertEqual(self.texts(page)[0], 'new')
+
+        comment_id = result.data['makeComment']['comment']['id']
+        user = User.objects.create_superuser('admin', password='secret')
+        request = RequestFactory().post('/graphql/')
+        request.user = user
+        with self.captureOnCommitCallbacks(execute=True):
+            result = schema.execute(f'mutation {{ deleteComment(id: {comment_id}) {{ comment {{ text }} }} }}', context_value=request)
+        self.assertIsNone(result.errors)
+
+        page, _ = self.comments()
+        self.assertEqual(page['totalCount'], 5)
+        self.assertEqual(self.texts(page)[0], '4')
+
+
+class CommentThrottlingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.song = Song.objects.create(title='Song', artwork='https://example.com/s.png')
+
+    def comment(self, nickname='a', ip='10.0.0.1'):
+        mutation = f'mutation {{ makeComment(text: "Hi", nickname: "{nickname}", song: {self.song.id}) {{ queued comment {{ id }} }} }}'
+        return schema.execute(mutation, context_value=RequestFactory().post('/graphql/', REMOTE_ADDR=ip))
+
+    @override_settings(COMMENT_RATE_LIMIT={'BURST': 2, 'PER_MINUTE': 1, 'PROXIES': 0})
+    def test_comments_are_limited_by_ip_and_nickname(self):
+        self.assertIsNone(self.comment().errors)
+        self.assertIsNone(self.comment(nickname='b').errors)
+        result = self.comment(nickname='c')
+        self.assertIn('Too many comments', result.errors[0].message)
+
+        # Nicknames are limited across addresses
+        self.assertIsNone(self.comment(nickname='A ', ip='10.0.0.2').errors)
+        self.assertIsNotNone(self.comment(nickname='a', ip='10.0.0.3').errors)
+        self.assertEqual(self.song.comment_set.count(), 3)
+
+    @override_settings(COMMENT_RATE_LIMIT={'BURST': 2, 'PER_MINUTE': 1, 'PROXIES': 0})
+    def test_refused_comments_use_no_tokens(self):
+        self.assertIsNone(self.comment().errors)
+        self.assertIsNone(self.comment(ip='10.0.0.2').errors)
+        self.assertIsNotNone(self.comment().errors)
+        # The address still has the token the refused nickname did not use
+        self.assertIsNone(self.comment(nickname='b').errors)
+
+    def test_bucket_refills(self):
+        bucket = TokenBucket('test', 1, 10)
+        self.assertEqual(bucket.take('key'), 0)
+        self.assertAlmostEqual(bucket.take('key'), 0.1, places=1)
+        time.sleep(0.2)
+        self.assertEqual(bucket.take('key'), 0)
+
+    @override_settings(COMMENT_RATE_LIMIT={'BURST': 2, 'PER_MINUTE': 1, 'PROXIES': 1})
+    def test_client_ip_behind_proxy(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.9', HTTP_X_FORWARDED_FOR='1.1.1.1, 2.2.2.2')
+        self.assertEqual(get_client_ip(request), '2.2.2.2')
+        self.assertEqual(get_client_ip(RequestFactory().get('/', REMOTE_ADDR='10.0.0.9')), '10.0.0.9')
+
+    @override_settings(COMMENT_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL': 60, 'MAX_SIZE': 3})
+    def test_buffered_comments_are_saved_together(self):
+        self.addCleanup(comment_buffer.flush)
+        other = Song.objects.create(title='Other', artwork='https://example.com/s.png')
+        result = self.comment()
+        self.assertEqual(result.data['makeComment'], {'queued': True, 'comment': None})
+        Comment.objects.create(text='Old', nickname='x', song=other)
+        other_id = other.id
+        other.delete()
+        comment_buffer.add(Comment(text='Lost', nickname='b', song_id=other_id))
+        self.assertEqual(Comment.objects.count(), 0)
+
+        page = schema.execute(
+            f'{{ comments(songId: {self.song.id}) {{ totalCount }} }}', context_value=RequestFactory().get('/graphql/'),
+        )
+        self.assertEqual(page.data['comments']['totalCount'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            saved = comment_buffer.flush()
+        self.assertEqual([comment.text for comment in saved], ['Hi'])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 1)
+
+        page = schema.execute(
+            f'{{ comments(songId: {self.song.id}) {{ totalCount }} }}', context_value=RequestFactory().get('/graphql/'),
+        )
+        self.assertEqual(page.data['comments']['totalCount'], 1)
+
+    @override_settings(COMMENT_BUFFER={'ENABLED': True, 'FLUSH_INTERVAL': 60, 'MAX_SIZE': 2})
+    def test_full_buffer_is_saved(self):
+        self.addCleanup(comment_buffer.flush)
+        self.comment()
+        self.assertIsNotNone(comment_buffer.timer)
+        self.comment(nickname='b')
+        self.assertIsNone(comment_buffer.timer)
+        self.assertEqual(self.song.comment_set.count(), 2)
+
+
+class AsyncCaptureQueries:
+    # The ORM runs queries on the connection of the test's thread, not the event loop's
+
+    async def __aenter__(self):
+        self.queries = CaptureQueriesContext(connection)
+        await sync_to_async(self.queries.__enter__)()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await sync_to_async(self.queries.__exit__)(*exc_info)
+        self.count = await sync_to_async(len)(self.queries)
+
+
+class AsyncGraphQLTest(TestCase):
+    view = staticmethod(csrf_exempt(AsyncSarGraphQLView.as_view()))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.albums, cls.songs = make_catalog(2, 3)
+
+    def setUp(self):
+        cache.clear()
+
+    async def post(self, query, variables=None):
+        request = AsyncRequestFactory().post(
+            '/graphql/', {'query': query, 'variables': variables or {}}, content_type='application/json',
+        )
+        request.user = AnonymousUser()
+        async with AsyncCaptureQueries() as queries:
+            response = await self.view(request)
+        return response, queries.count
+
+    async def test_queries_match_the_sync_view(self):
+        query = '''
+            query ($id: Int!) {
+                allAlbums { edges { node { title numberOfSongs songs { title trackNumber } } } }
+                allSongs(first: 2) { edges { node { title albums { title } } } pageInfo { hasNextPage } }
+                song(id: $id) { title }
+                comments(songId: $id) { totalCount }
+            }
+        '''
+        variables = {'id': self.songs[0].id}
+        response, queries = await self.post(query, variables)
+        self.assertEqual(response.status_code, 200)
+        result = await sync_to_async(schema.execute)(query, variables=variables, context_value=RequestFactory().get('/'))
+        self.assertEqual(json.loads(response.content), {'data': result.data})
+        self.assertEqual(queries, 7)
+
+        # Served from the response cache
+        _, queries = await self.post(query, variables)
+        self.assertEqual(queries, 0)
+
+    async def test_mutations_run_through_the_sync_view(self):
+        response, _ = await self.post(
+            'mutation ($song: Int) { makeComment(text: "Hi", nickname: "a", song: $song) { comment { text } } }',
+            {'song': self.songs[0].id},
+        )
+        self.assertEqual(json.loads(response.content), {'data': {'makeComment': {'comment': {'text': 'Hi'}}}})
+        self.assertEqual(await Comment.objects.acount(), 1)
+
+    async def test_errors(self):
+        response, _ = await self.post('{ song(id: 0) { title } }')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['errors'][0]['message'], 'Song matching query does not exist.')
+
+        response, _ = await self.post('{ nothing }')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(METRICS_OPERATIONS=['Albums'])
+    async def test_operations_are_instrumented(self):
+        metrics.reset()
+        with self.assertLogs('sar.instrumentation', 'INFO') as logs:
+            _, queries = await self.post('query Albums { allAlbums { edges { node { title songs { title } } } } }')
+        self.assertEqual(logs.records[0].operation, 'Albums')
+        self.assertEqual(logs.records[0].queries, queries)
+        self.assertEqual(queries, 2)
+
+        operations, resolvers = metrics.snapshot()
+        self.assertEqual(operations['Albums'][:1] + operations['Albums'][2:], [1, queries])
+        self.assertEqual(resolvers['Query.allAlbums'][0], 1)
+        self.assertEqual(resolvers['AlbumType.songs'][0], 2)
+        self.assertEqual(resolvers['SongType.title'][0], 6)
+
+    async def test_all_versions_load_nested_fields(self):
+        await sync_to_async(self.songs[0].alternatives.add)(self.songs[3])
+        response, queries = await self.post('{ allSongs { edges { node { title allVersions { title albums { title } } } } } }')
+        data = json.loads(response.content)
+        self.assertNotIn('errors', data)
+        versions = {edge['node']['title']: edge['node']['allVersions'] for edge in data['data']['allSongs']['edges']}
+        self.assertEqual(versions['Song 3'], [{'title': 'Song 0', 'albums': [{'title': 'Album 0'}]}, {'title': 'Song 3', 'albums': [{'title': 'Album 1'}]}])
+        self.assertEqual(versions['Song 1'], [{'title': 'Song 1', 'albums': [{'title': 'Album 0'}]}])
+        # The songs, then the versions and their albums
+        self.assertEqual(queries, 3)
+
+    async def test_data_loader_batches_keys(self):
+        loaders = Loaders(run_async=True)
+        async with AsyncCaptureQueries() as queries:
+            songs = await asyncio.gather(*[loaders.album_songs.load(album.id) for album in self.albums], loaders.album_songs.load(0))
+        self.assertEqual(queries.count, 1)
+        self.assertEqual([[song.title for song in album] for album in songs], [['Song 0', 'Song 1', 'Song 2'], ['Song 3', 'Song 4', 'Song 5'], []])
+
+
+class ConditionalGetTest(TestCase):
+    albums_query = '{ allAlbums { edges { node { title songs { title } } } } }'
+    feed_query = '{ updates { edges { node { title } } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.albums, cls.songs = make_catalog(2, 2)
+        Updates.objects.create(title='News', content='...')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, query, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/graphql/', {'query': query}, headers={'Accept': 'application/json', **headers})
+        return response, len(queries)
+
+    def test_unchanged_responses_are_not_modified(self):
+        response, _ = self.get(self.albums_query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        etag = response['ETag']
+
+        response, queries = self.get(self.albums_query, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(queries, 0)
+
+    def test_writes_change_the_etag(self):
+        etag = self.get(self.albums_query)[0]['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.songs[0].albums.remove(self.albums[0])
+
+        response, queries = self.get(self.albums_query, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(queries, 0)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Polled jobs change with their status
+        self.client.force_login(User.objects.create_superuser('admin', password='password'))
+        job = IngestionJob.objects.create(payload={}, files={})
+        job_query = f'{{ ingestionJob(id: {job.pk}) {{ status attempts }} }}'
+        etag = self.get(job_query)[0]['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            job.status = IngestionJob.RUNNING
+            job.save()
+        response, _ = self.get(job_query, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data']['ingestionJob']['status'], 'RUNNING')
+
+        # Comments are not read by the query
+        self.client.logout()
+        etag = self.get(self.albums_query)[0]['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(song=self.songs[1], text='Hi', nickname='a')
+        self.assertEqual(self.get(self.albums_query, **{'If-None-Match': etag})[0].status_code, 304)
+
+    def test_responses_have_no_last_modified(self):
+        # Removing the newest update would move it back and let stale copies pass
+        self.assertNotIn('Last-Modified', self.get(self.feed_query)[0])
+
+    def test_only_get_queries_have_an_etag(self):
+        response = self.client.post('/graphql/', {'query': self.albums_query}, content_type='application/json')
+        self.assertNotIn('ETag', response)
+
+        response, _ = self.get('{ allAlbums { edges { node { nothing } } } }')
+        self.assertNotIn('ETag', response)
+
+    async def test_async_view(self):
+        view = AsyncSarGraphQLView.as_view()
+        request = AsyncRequestFactory().get('/graphql/', {'query': self.albums_query}, headers={'Accept': 'application/json'})
+        request.user = AnonymousUser()
+        response = await view(request)
+        self.assertEqual(response.status_code, 200)
+
+        request = AsyncRequestFactory().get(
+            '/graphql/', {'query': self.albums_query}, headers={'Accept': 'application/json', 'If-None-Match': response['ETag']},
+        )
+        request.user = AnonymousUser()
+        async with AsyncCaptureQueries() as queries:
+            response = await view(request)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries.count, 0)
+
+
+class VersionGroupTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.songs = Song.objects.bulk_create([Song(title=f'Version {i}', artwork='https://example.com/s.png') for i in range(5)])
+        # A chain of versions, each linked to the next one only
+        for song, following in zip(self.songs, self.songs[1:4]):
+            song.alternatives.add(following)
+
+    def groups(self):
+        return dict(Song.objects.filter(pk__in=[song.pk for song in self.songs]).values_list('pk', 'version_group'))
+
+    def test_chains_share_a_group(self):
+        first, *_, alone = self.songs
+        groups = self.groups()
+        self.assertEqual([groups[song.pk] for song in self.songs], [first.pk] * 4 + [None])
+
+    def test_all_versions_is_one_lookup(self):
+        query = 'query ($id: Int) { song(id: $id) { allVersions { title } } }'
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, variables={'id': self.songs[3].id}, context_value=RequestFactory().get('/'))
+        self.assertIsNone(result.errors)
+        self.assertEqual([song['title'] for song in result.data['song']['allVersions']], [f'Version {i}' for i in range(4)])
+        self.assertEqual(len(queries), 2)
+
+        result = schema.execute(query, variables={'id': self.songs[4].id}, context_value=RequestFactory().get('/'))
+        self.assertEqual(result.data['song']['allVersions'], [{'title': 'Version 4'}])
+
+    def test_all_versions_of_lists_are_one_lookup(self):
+        albums, songs = make_catalog(2, 5)
+        for song, other in zip(songs[:5], songs[5:]):
+            song.alternatives.add(other)
+        context = RequestFactory().get('/')
+
+        query = '{ allAlbums { edges { node { songs { allVersions { title albums { title } } } } } } }'
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, context_value=context)
+        self.assertIsNone(result.errors)
+        first = result.data['allAlbums']['edges'][0]['node']['songs'][0]
+        self.assertEqual(first['allVersions'], [{'title': 'Song 0', 'albums': [{'title': 'Album 0'}]}, {'title': 'Song 5', 'albums': [{'title': 'Album 1'}]}])
+        # The albums, their tracks, the versions and their albums
+        self.assertEqual(len(queries), 4)
+
+        query = '{ allSongs(first: 15) { edges { node { allVersions { title } } } } }'
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, context_value=context)
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data['allSongs']['edges']), 15)
+        self.assertEqual(len(queries), 2)
+
+        # Versions of prefetched relations are queued along with their parents
+        query = '{ allSongs(first: 15) { edges { node { alternatives { allVersions { title } } } } } }'
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, context_value=context)
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(queries), 3)
+
+    def test_removed_links_split_groups(self):
+        first, second, third, fourth, alone = self.songs
+        second.alternatives.remove(third)
+        groups = self.groups()
+        self.assertEqual([groups[song.pk] for song in self.songs], [first.pk, first.pk, third.pk, third.pk, None])
+
+        third.alternatives.clear()
+        groups = self.groups()
+        self.assertEqual([groups[song.pk] for song in self.songs], [first.pk, first.pk, None, None, None])
+
+    def test_bulk_changes_and_deletes(self):
+        first, second, third, fourth, alone = self.songs
+        modify_songs([{'id': alone.pk, 'alternatives': [first.pk]}])
+        self.assertEqual(set(self.groups().values()), {first.pk})
+
+        first.delete()
+        groups = self.groups()
+        self.assertEqual([groups[song.pk] for song in self.songs[1:]], [second.pk, second.pk, second.pk, None])
+
+    def test_albums_and_rebuild(self):
+        albums = Album.objects.bulk_create([Album(title=f'Album {i}', artwork='https://example.com/a.png') for i in range(3)])
+        albums[0].alternatives.set([albums[2]])
+        self.assertEqual(Album.objects.get(pk=albums[2].pk).version_group, albums[0].pk)
+
+        Song.objects.update(version_group=None)
+        Album.objects.update(version_group=None)
+        call_command('rebuild_version_groups', stdout=StringIO())
+        self.assertEqual(set(self.groups().values()), {self.songs[0].pk, None})
+        self.assertEqual(list(Album.objects.order_by('pk').values_list('version_group', flat=True)), [albums[0].pk, None, albums[0].pk])
+
+
+class CatalogTransferTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.albums, cls.songs = make_catalog(2, 3)
+        cls.songs[0].alternatives.add(cls.songs[4])
+        cls.albums[0].alternatives.add(cls.albums[1])
+        Song.objects.filter(pk=cls.songs[1].pk).update(waveform=bytes([0, 255, 7]), release_date=date(2020, 5, 1))
+        Comment.objects.create(song=cls.songs[2], text='Hi', nickname='a')
+        Comment.objects.filter(song=cls.songs[2]).update(date=date(2021, 1, 2))
+        update = Updates.objects.create(title='News', content='...')
+        update.references_songs.add(cls.songs[3])
+
+    def catalog(self, albums):
+        """The catalog reachable from ``albums``, without ids."""
+        result = []
+        for album in Album.objects.filter(pk__in=albums).order_by('title'):
+            tracks = Track.objects.filter(album=album).select_related('song').order_by('track_number')
+            result.append((
+                album.title, album.total_duration, album.track_count, [a.title for a in album.alternatives.all()],
+                [
+                    (
+                        track.track_number, track.song.title, track.song.duration, track.song.release_date,
+                        track.song.waveform and bytes(track.song.waveform),
+                        [song.title for song in track.song.alternatives.all()],
+                        list(track.song.comment_set.values_list('text', 'date')),
+                        list(track.song.updates_set.values_list('title', flat=True)),
+                    )
+                    for track in tracks
+                ],
+            ))
+        return result
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(Path(directory) / 'catalog.jsonl.gz')
+            call_command('catalog_export', path, stdout=StringIO())
+            with CaptureQueriesContext(connection) as queries:
+                call_command('catalog_import', path, '--batch-size', '4', stdout=StringIO())
+
+        # Each album is now there twice, with the same title
+        old = [album.pk for album in self.albums]
+        new = Album.objects.exclude(pk__in=old).values_list('pk', flat=True)
+        self.assertEqual(self.catalog(new), self.catalog(old))
+        self.assertEqual(Updates.objects.count(), 2)
+
+        imported = Song.objects.exclude(pk__in=[song.pk for song in self.songs])
+        grouped = imported.exclude(version_group=None)
+        self.assertEqual(sorted(grouped.values_list('title', flat=True)), ['Song 0', 'Song 4'])
+        self.assertEqual(len({song.version_group for song in grouped}), 1)
+        # Batched inserts, not a query per row
+        self.assertLess(len(queries), 40)
+
+    def test_unknown_references(self):
+        lines = StringIO()
+        call_command('catalog_export', stdout=lines, stderr=StringIO())
+        # Songs before their albums
+        songs, rest = [], []
+        for line in lines.getvalue().splitlines():
+            (songs if '"music_api.song"' in line else rest).append(line)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as file:
+            file.write('\n'.join(songs + rest))
+            file.flush()
+            call_command('catalog_import', file.name, stdout=StringIO())
+            self.assertEqual(Song.objects.count(), 12)
+
+            file.seek(0)
+            file.truncate()
+            file.write('\n'.join(line for line in rest if '"music_api.album"' not in line))
+            file.flush()
+            with self.assertRaisesMessage(CommandError, 'refers to album'):
+                call_command('catalog_import', file.name, stdout=StringIO())
+        self.assertEqual(Song.objects.count(), 12)
+
+
+class LoadTestTest(TransactionTestCase):
+
+    def test_both_paths_serve_the_requests(self):
+        make_catalog(2, 3)
+        out = StringIO()
+        call_command('load_test_graphql', requests=12, concurrency=3, stdout=out)
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()], ['wsgi', 'asgi'])
+
+
+
+class StaticFilesTest(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        (self.root / 'index.html').write_text('<html>' + 'frontend ' * 100 + '</html>')
+        (self.root / 'app.js').write_text('console.log("sar");\n' * 200)
+        (self.root / 'logo.png').write_bytes(base64.b64decode('iVBORw0KGgo='))
+
+        settings = override_settings(
+            STATIC_ROOT=str(self.root),
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'sar.static.CompressedManifestStaticFilesStorage'},
+            },
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        storage = CompressedManifestStaticFilesStorage()
+        names = ('index.html', 'app.js', 'logo.png')
+        list(storage.post_process({name: (storage, name) for name in names}))
+        self.hashed = storage.hashed_files['app.js']
+
+    def test_collectstatic_writes_compressed_variants(self):
+        self.assertTrue((self.root / 'app.js.gz').exists())
+        self.assertTrue((self.root / f'{self.hashed}.gz').exists())
+        self.assertFalse((self.root / 'logo.png.gz').exists())
+        self.assertEqual(gzip.decompress((self.root / 'app.js.gz').read_bytes()), (self.root / 'app.js').read_bytes())
+
+    def test_hashed_files_are_cached_for_good(self):
+        response = self.client.get(f'/static/{self.hashed}', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn('javascript', response['Content-Type'])
+        self.assertEqual(b''.join(response.streaming_content), (self.root / f'{self.hashed}.gz').read_bytes())
+
+        response = self.client.get(f'/static/{self.hashed}', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_unchanged_files_are_not_modified(self):
+        response = self.client.get('/static/app.js')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        response = self.client.get('/static/app.js', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_frontend_routes_get_the_index(self):
+        for url in ('/', '/albums/3'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'frontend', b''.join(response.streaming_content))
+
+        self.assertEqual(self.client.get('/app.js')['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get('/missing.js').status_code, 404)
+        self.assertEqual(self.client.get('/static/missing').status_code, 404)
+        self.assertEqual(self.client.get('/static/../../etc/passwd').status_code, 404)
+        self.assertEqual(self.client.get('/api/missing/').status_code, 404)
+
+    def test_backend_prefixes_are_not_frontend_routes(self):
+        for prefix in ('graphql', 'admin'):
+            response = self.client.get(f'/{prefix}')
+            self.assertEqual(response.status_code, 301)
+            self.assertEqual(response['Location'], f'/{prefix}/')
+        self.assertEqual(self.client.get('/api').status_code, 404)
+        self.assertEqual(self.client.get('/static').status_code, 404)
+        # Only whole prefixes are excluded
+        self.assertEqual(self.client.get('/graphqlish').status_code, 200)
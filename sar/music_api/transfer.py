@@ -0,0 +1,139 @@
+import base64
+import json
+from datetime import date, datetime
+from itertools import groupby
+
+from django.db import models, transaction
+
+from .cache import invalidate_model
+from .models import Album, Comment, Song, Track, Updates
+from .versions import rebuild_version_groups
+
+# In the order they are imported, every row after the rows it refers to.
+# Links of many-to-many fields are rows of their through models
+MODELS = (
+    Album,
+    Song,
+    Album.alternatives.through,
+    Song.albums.through,
+    Song.alternatives.through,
+    Track,
+    Comment,
+    Updates,
+    Updates.references_songs.through,
+    Updates.references_albums.through,
+)
+# Recomputed after an import, as they hold ids
+DERIVED_FIELDS = ('version_group',)
+
+
+def exported_fields(model):
+    return [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key and not field.generated and field.name not in DERIVED_FIELDS
+    ]
+
+
+def encode(field, value):
+    if value is None:
+        return None
+    if isinstance(field, models.BinaryField):
+        return base64.b64encode(value).decode()
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def export_catalog(stream, batch_size=2000):
+    """
+    Writes the catalog to ``stream`` as JSON Lines, a row a line, reading
+    ``batch_size`` rows at a time. Returns the number of rows by model.
+    """
+    counts = {}
+    for model in MODELS:
+        fields = exported_fields(model)
+        rows = model.objects.order_by('pk').values_list('pk', *[field.attname for field in fields])
+        count = 0
+        for pk, *values in rows.iterator(chunk_size=batch_size):
+            stream.write(json.dumps({
+                'model': model._meta.label_lower,
+                'id': pk,
+                'fields': {field.attname: encode(field, value) for field, value in zip(fields, values)},
+            }) + '\n')
+            count += 1
+        counts[model._meta.label_lower] = count
+    return counts
+
+
+def decode(field, value, ids):
+    if value is None:
+        return None
+    if not field.is_relation:
+        return field.to_python(value)
+
+    # Rows get new ids, references follow them
+    try:
+        return ids[field.related_model][value]
+    except KeyError:
+        raise ValueError(f'{field.model._meta.label_lower} refers to {field.related_model._meta.model_name} {value}, '
+                         f'which is not in the file before it')
+
+
+def import_rows(model, records, ids):
+    fields = {field.attname: field for field in exported_fields(model)}
+    objects = [
+        model(**{name: decode(fields[name], value, ids) for name, value in record['fields'].items() if name in fields})
+        for record in records
+    ]
+
+    # bulk_create sets auto_now fields to the current time, the exported dates
+    # are written back to the new rows
+    dates = [
+        (field, [getattr(obj, field.attname) for obj in objects])
+        for field in fields.values() if getattr(field, 'auto_now', False)
+    ]
+    model.objects.bulk_create(objects)
+    if dates:
+        for field, values in dates:
+            for obj, value in zip(objects, values):
+                setattr(obj, field.attname, value)
+        model.objects.bulk_update(objects, [field.name for field, _ in dates])
+
+    if model in ids:
+        ids[model].update((record['id'], obj.pk) for record, obj in zip(records, objects))
+
+
+@transaction.atomic
+def import_catalog(stream, batch_size=2000):
+    """
+    Adds the rows exported by ``export_catalog`` from ``stream`` with new ids,
+    inserting ``batch_size`` rows of a model at a time. Only the new ids of
+    referenced rows are kept in memory. Returns the number of rows by model.
+    """
+    labels = {model._meta.label_lower: model for model in MODELS}
+    ids = {Album: {}, Song: {}, Updates: {}}
+    counts = dict.fromkeys(labels, 0)
+
+    records = (json.loads(line) for line in stream if line.strip())
+    batch = []
+    for label, group in groupby(records, key=lambda record: record['model']):
+        if label not in labels:
+            raise ValueError(f'Unknown model {label}')
+        model = labels[label]
+        for record in group:
+            batch.append(record)
+            if len(batch) == batch_size:
+                import_rows(model, batch, ids)
+                counts[label] += len(batch)
+                batch = []
+        if batch:
+            import_rows(model, batch, ids)
+            counts[label] += len(batch)
+            batch = []
+
+    # Bulk queries do not send the signals that keep these up to date
+    rebuild_version_groups(Song, batch_size)
+    rebuild_version_groups(Album, batch_size)
+    for model in (Album, Song, Track, Comment, Updates):
+        invalidate_model(model._meta.model_name)
+    return counts
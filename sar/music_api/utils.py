@@ -1,15 +1,148 @@
-import wave
-import contextlib
-from django.core.files.storage import default_storage
+import struct
 
-def get_wav_file_duration(uploaded_file):
-    file_path = default_storage.save(uploaded_file.name, uploaded_file)
+# Largest amount of a file read while looking for headers
+PROBE_SIZE = 64 * 1024
 
-    with contextlib.closing(wave.open(file_path, 'r')) as f:
-        frames = f.getnframes()
-        rate = f.getframerate()
-        duration = frames / float(rate)
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = [44100, 48000, 32000]
 
-    default_storage.delete(file_path)
 
-    return duration
\ No newline at end of file
+def read_at(file, offset, size):
+    file.seek(offset)
+    return file.read(size)
+
+
+def read_wav_header(file):
+    """
+    Returns the format of a WAV file and where its samples are, reading only
+    the chunk headers.
+    """
+    header = read_at(file, 0, 12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise ValueError('Not a WAV file')
+
+    # Walk the chunk headers, seeking over chunk bodies without reading them
+    offset = 12
+    wav_format = None
+    while True:
+        chunk = read_at(file, offset, 8)
+        if len(chunk) < 8:
+            raise ValueError('WAV file has no data chunk')
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+
+        if chunk_id == b'fmt ':
+            fmt = file.read(16)
+            if len(fmt) < 16:
+                raise ValueError('Truncated WAV fmt chunk')
+            format_tag, channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', fmt)
+            if not byte_rate or not block_align:
+                raise ValueError('Invalid WAV fmt chunk')
+            wav_format = {
+                'format_tag': format_tag,
+                'channels': channels,
+                'sample_rate': sample_rate,
+                'byte_rate': byte_rate,
+                'block_align': block_align,
+                'bits': bits,
+            }
+        elif chunk_id == b'data':
+            if wav_format is None:
+                raise ValueError('WAV data chunk before fmt chunk')
+            return dict(wav_format, data_offset=offset + 8, data_size=chunk_size)
+
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+
+def get_wav_duration(file):
+    header = read_wav_header(file)
+    return header['data_size'] / header['byte_rate']
+
+
+def get_flac_duration(file):
+    header = read_at(file, 0, 4 + 4 + 34)
+    if len(header) < 42 or header[:4] != b'fLaC' or header[4] & 0x7F != 0:
+        raise ValueError('Not a FLAC file')
+
+    # STREAMINFO is always the first metadata block: 20 bits of sample rate,
+    # 3 of channels, 5 of bits per sample and 36 of total samples
+    packed = int.from_bytes(header[18:26], 'big')
+    sample_rate = packed >> 44
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        raise ValueError('FLAC file does not declare its length')
+    return total_samples / sample_rate
+
+
+def id3v2_size(header):
+    if header[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def get_mp3_duration(file):
+    start = id3v2_size(read_at(file, 0, 10))
+    data = read_at(file, start, PROBE_SIZE)
+
+    for position in range(len(data) - 4):
+        if data[position] != 0xFF or data[position + 1] & 0xE0 != 0xE0:
+            continue
+
+        header = int.from_bytes(data[position:position + 4], 'big')
+        version_bits = (header >> 19) & 3
+        layer_bits = (header >> 17) & 3
+        bitrate_index = (header >> 12) & 15
+        sample_rate_index = (header >> 10) & 3
+        # Only MPEG audio layer III frames with a valid bitrate and sample rate
+        if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+            continue
+
+        mpeg1 = version_bits == 3
+        sample_rate = MP3_SAMPLE_RATES[sample_rate_index] // {3: 1, 2: 2, 0: 4}[version_bits]
+        samples_per_frame = 1152 if mpeg1 else 576
+        mono = (header >> 6) & 3 == 3
+
+        # A Xing/Info header follows the side information, a VBRI one sits 32 bytes in
+        side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+        xing = data[position + 4 + side_info:position + 4 + side_info + 12]
+        if xing[:4] in (b'Xing', b'Info') and len(xing) == 12 and xing[7] & 1:
+            return int.from_bytes(xing[8:12], 'big') * samples_per_frame / sample_rate
+
+        vbri = data[position + 36:position + 36 + 18]
+        if vbri[:4] == b'VBRI' and len(vbri) == 18:
+            return int.from_bytes(vbri[14:18], 'big') * samples_per_frame / sample_rate
+
+        # Without a VBR header the stream is treated as constant bitrate
+        bitrate = MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+        file.seek(0, 2)
+        audio_size = file.tell() - start - position
+        return audio_size * 8 / bitrate
+
+    raise ValueError('No MP3 frame found')
+
+
+def get_audio_file_duration(wav=None, flac=None, mp3=None):
+    """
+    Returns the duration in seconds of the first of the ``wav``, ``flac`` and
+    ``mp3`` files given, or 0 without any. The file is only read as its own
+    format, and ValueError is raised when it is not valid in that format.
+
+    Only the headers are read and the file is rewound afterwards, so it can
+    still be uploaded in full.
+    """
+    for name, file, probe in (('WAV', wav, get_wav_duration), ('FLAC', flac, get_flac_duration), ('MP3', mp3, get_mp3_duration)):
+        if not file:
+            continue
+        try:
+            return probe(file)
+        except struct.error:
+            raise ValueError(f'Invalid {name} file')
+        finally:
+            file.seek(0)
+    return 0
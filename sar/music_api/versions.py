@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+
+def linked_ids(model, ids):
+    # The symmetrical alternatives relation stores both directions of a link
+    name = model._meta.model_name
+    through = model.alternatives.through
+    return set(through.objects.filter(**{f'from_{name}_id__in': ids}).values_list(f'to_{name}_id', flat=True))
+
+
+def connected_ids(model, pk):
+    """
+    Returns the ids of the rows linked to ``pk`` by alternatives, directly
+    or through other rows, with a query per link of the longest chain.
+    """
+    found = {pk}
+    frontier = {pk}
+    while frontier:
+        frontier = linked_ids(model, frontier) - found
+        found |= frontier
+    return found
+
+
+def regroup(model, pks):
+    """
+    Stores the version group of the rows connected to ``pks`` after links
+    between them changed: the smallest id of the connected rows, or None
+    for rows without alternatives. Every group split by the change holds
+    one of ``pks``.
+    """
+    remaining = set(pks)
+    while remaining:
+        members = connected_ids(model, remaining.pop())
+        remaining -= members
+        group = min(members) if len(members) > 1 else None
+        model.objects.filter(pk__in=members).update(version_group=group)
+
+
+@transaction.atomic
+def rebuild_version_groups(model, batch_size=1000):
+    """
+    Stores the version group of every row of ``model`` from all its links.
+    Returns the number of rows with alternatives.
+    """
+    name = model._meta.model_name
+    links = model.alternatives.through.objects.values_list(f'from_{name}_id', f'to_{name}_id')
+    linked = model.alternatives.through.objects.filter(**{f'from_{name}_id': OuterRef('pk')})
+
+    # Union-find whose roots are the smallest id of their set
+    parents = {}
+
+    def find(pk):
+        parents.setdefault(pk, pk)
+        while parents[pk] != pk:
+            parents[pk] = parents[parents[pk]]
+            pk = parents[pk]
+        return pk
+
+    for from_id, to_id in links.iterator(chunk_size=batch_size):
+        first, second = sorted((find(from_id), find(to_id)))
+        parents[second] = first
+
+    # Only rows whose group changed are written
+    current = dict(model.objects.exclude(version_group=None).values_list('pk', 'version_group').iterator(chunk_size=batch_size))
+    model.objects.exclude(version_group=None).exclude(Exists(linked)).update(version_group=None)
+    model.objects.bulk_update(
+        [model(pk=pk, version_group=find(pk)) for pk in parents if current.get(pk) != find(pk)],
+        ['version_group'], batch_size=batch_size,
+    )
+    return len(parents)
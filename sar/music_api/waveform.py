@@ -0,0 +1,135 @@
+import math
+
+import numpy as np
+
+from .utils import read_wav_header
+
+# Number of min/max pairs in a waveform, enough for a full width player
+WAVEFORM_POINTS = 2000
+# Frames decoded at a time, bounding memory regardless of the file's length
+CHUNK_FRAMES = 64 * 1024
+# The level is measured over blocks of this many seconds
+LOUDNESS_BLOCK = 0.4
+# Blocks quieter than this, in dBFS, are left out as silence
+SILENCE_GATE = -70
+
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+def decode_samples(data, header):
+    """
+    Returns the frames in ``data`` as floats between -1 and 1, shaped
+    (frames, channels).
+    """
+    bits = header['bits']
+    if header['format_tag'] == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(data, dtype='<f4' if bits == 32 else '<f8').astype(np.float32)
+    elif bits == 8:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif bits == 16:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 2 ** 15
+    elif bits == 24:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        samples = np.where(samples >= 2 ** 23, samples - 2 ** 24, samples).astype(np.float32) / 2 ** 23
+    elif bits == 32:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2 ** 31
+    else:
+        raise ValueError(f'Unsupported WAV sample size: {bits} bits')
+    return samples.reshape(-1, header['channels'])
+
+
+def iter_frames(file, header):
+    frame_size = header['block_align']
+    remaining = header['data_size'] - header['data_size'] % frame_size
+    file.seek(header['data_offset'])
+    while remaining > 0:
+        data = file.read(min(remaining, CHUNK_FRAMES * frame_size))
+        data = data[:len(data) - len(data) % frame_size]
+        if not data:
+            break
+        remaining -= len(data)
+        yield decode_samples(data, header)
+
+
+class Blocks:
+    """
+    Cuts a stream of frames into blocks of ``size`` frames, carrying the
+    incomplete tail of each chunk over to the next one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.carry = None
+
+    def feed(self, frames):
+        if self.carry is not None:
+            frames = np.concatenate([self.carry, frames])
+        complete = len(frames) - len(frames) % self.size
+        self.carry = frames[complete:]
+        return frames[:complete].reshape(-1, self.size, *frames.shape[1:])
+
+    def finish(self):
+        carry, self.carry = self.carry, None
+        if carry is None or not len(carry):
+            return None
+        return carry[np.newaxis]
+
+
+def rms_level(block_powers):
+    """
+    RMS level in dBFS of blocks given as their mean square over all channels.
+    Silent blocks are left out, then blocks 10 dB below the level of the
+    rest, so that quiet passages do not lower it.
+
+    This is not loudness in LUFS: ITU-R BS.1770 also applies a K-weighting
+    filter and measures overlapping blocks.
+    """
+    powers = np.asarray(block_powers)
+    powers = powers[powers > 0]
+    if not len(powers):
+        return None
+
+    powers = powers[10 * np.log10(powers) > SILENCE_GATE]
+    if not len(powers):
+        return None
+
+    relative_gate = 10 * np.log10(powers.mean()) - 10
+    powers = powers[10 * np.log10(powers) > relative_gate]
+    return float(10 * np.log10(powers.mean()))
+
+
+def analyze_wav(file, points=WAVEFORM_POINTS):
+    """
+    Returns the waveform of a WAV file as interleaved int8 min/max pairs, and
+    its gated RMS level in dBFS.
+
+    The file is decoded in chunks, so memory use does not depend on its
+    length.
+    """
+    header = read_wav_header(file)
+    total_frames = header['data_size'] // header['block_align']
+    peaks = Blocks(max(1, math.ceil(total_frames / points)))
+    loudness = Blocks(max(1, int(header['sample_rate'] * LOUDNESS_BLOCK)))
+
+    minimums, maximums, powers = [], [], []
+
+    def add_peaks(buckets):
+        minimums.append(buckets.min(axis=(1, 2)))
+        maximums.append(buckets.max(axis=(1, 2)))
+
+    for frames in iter_frames(file, header):
+        add_peaks(peaks.feed(frames))
+        powers.append((loudness.feed(frames) ** 2).mean(axis=(1, 2)))
+
+    tail = peaks.finish()
+    if tail is not None:
+        add_peaks(tail)
+    file.seek(0)
+
+    if not minimums:
+        return b'', None
+
+    pairs = np.stack([np.concatenate(minimums), np.concatenate(maximums)], axis=1)
+    waveform = np.clip(np.round(pairs * 127), -127, 127).astype(np.int8).tobytes()
+    return waveform, rms_level(np.concatenate(powers))
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sar.settings')
+# Queries run on the event loop rather than pinning a thread each
+os.environ.setdefault('GRAPHQL_ASYNC', 'True')
 
 application = get_asgi_application()
@@ -0,0 +1,144 @@
+import logging
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, GraphQLList, GraphQLNonNull, GraphQLObjectType,
+    InlineFragmentNode, IntValueNode, OperationDefinitionNode, ValidationRule, get_named_type,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def is_list(field_type):
+    if isinstance(field_type, GraphQLNonNull):
+        field_type = field_type.of_type
+    return isinstance(field_type, GraphQLList)
+
+
+def is_connection(graphql_type):
+    return isinstance(graphql_type, GraphQLObjectType) and {'edges', 'pageInfo'} <= set(graphql_type.fields)
+
+
+class ComplexityMeter:
+    """
+    Measures the nesting depth and cost of operations.
+
+    Every field costs its weight from ``FIELD_COSTS`` (1 by default) plus the
+    cost of its selections, multiplied by how many items a list field is
+    expected to return. Connections count as their literal ``first`` argument
+    or the largest page, other lists as their ``LIST_SIZES`` entry or
+    ``DEFAULT_LIST_SIZE``.
+    """
+
+    def __init__(self, schema, fragments):
+        self.schema = schema
+        self.fragments = fragments
+        self.limits = settings.GRAPHQL_LIMITS
+
+    def measure_operation(self, operation):
+        root_type = self.schema.get_root_type(operation.operation)
+        if root_type is None:
+            return 0, 0
+        return self.measure(operation.selection_set, root_type, set())
+
+    def measure(self, selection_set, parent_type, fragments):
+        """
+        Returns the cost and depth of ``selection_set`` selected on ``parent_type``.
+        """
+        cost = 0
+        depth = 0
+        if selection_set is None:
+            return cost, depth
+
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field_cost, field_depth = self.measure_field(selection, parent_type, fragments)
+                cost += field_cost
+                depth = max(depth, field_depth)
+                continue
+
+            if isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                # Cycles are reported by NoFragmentCyclesRule
+                if fragment is None or name in fragments:
+                    continue
+                fragment_type, selections, fragments = fragment.type_condition, fragment.selection_set, fragments | {name}
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type, selections = selection.type_condition, selection.selection_set
+            else:
+                continue
+
+            condition_type = self.schema.get_type(fragment_type.name.value) if fragment_type else parent_type
+            fragment_cost, fragment_depth = self.measure(selections, condition_type or parent_type, fragments)
+            cost += fragment_cost
+            depth = max(depth, fragment_depth)
+
+        return cost, depth
+
+    def measure_field(self, node, parent_type, fragments):
+        name = node.name.value
+        fields = getattr(parent_type, 'fields', {})
+        # Introspection is cheap and deeply nested by design
+        if name.startswith('__') or name not in fields:
+            return 0, 0
+
+        field = fields[name]
+        field_type = get_named_type(field.type)
+        key = f'{parent_type.name}.{name}'
+
+        multiplier = 1
+        if is_connection(field_type):
+            multiplier = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+            first = next((argument.value for argument in node.arguments or () if argument.name.value == 'first'), None)
+            if isinstance(first, IntValueNode):
+                multiplier = min(int(first.value), multiplier)
+        elif is_list(field.type) and not is_connection(parent_type):
+            multiplier = self.limits['LIST_SIZES'].get(key, self.limits['DEFAULT_LIST_SIZE'])
+
+        child_cost, child_depth = self.measure(node.selection_set, field_type, fragments)
+        return self.limits['FIELD_COSTS'].get(key, 1) + multiplier * child_cost, child_depth + 1
+
+
+def measure_document(schema, document):
+    """
+    Returns the cost and depth of every operation in ``document`` by name.
+    """
+    fragments = {
+        definition.name.value: definition
+        for definition in document.definitions if isinstance(definition, FragmentDefinitionNode)
+    }
+    meter = ComplexityMeter(schema, fragments)
+    return {
+        definition.name.value if definition.name else None: meter.measure_operation(definition)
+        for definition in document.definitions if isinstance(definition, OperationDefinitionNode)
+    }
+
+
+def log_complexity(operation_name, cost, depth):
+    logger.info('GraphQL operation %s costs %d at depth %d', operation_name or '<anonymous>', cost, depth)
+
+
+class ComplexityLimitRule(ValidationRule):
+    """
+    Rejects operations nested deeper than ``MAX_DEPTH`` or costing more than
+    ``MAX_COST``, configured in ``settings.GRAPHQL_LIMITS``.
+    """
+
+    def enter_document(self, node, *args):
+        limits = settings.GRAPHQL_LIMITS
+        operations = {
+            definition.name.value if definition.name else None: definition
+            for definition in node.definitions if isinstance(definition, OperationDefinitionNode)
+        }
+
+        for name, (cost, depth) in measure_document(self.context.schema, node).items():
+            if depth > limits['MAX_DEPTH']:
+                self.report_error(GraphQLError(
+                    f'Query is nested {depth} levels deep, the maximum is {limits["MAX_DEPTH"]}.', operations[name],
+                ))
+            if cost > limits['MAX_COST']:
+                self.report_error(GraphQLError(
+                    f'Query costs {cost}, the maximum is {limits["MAX_COST"]}.', operations[name],
+                ))
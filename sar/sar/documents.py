@@ -0,0 +1,114 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError, parse, validate
+
+from .complexity import measure_document
+
+PERSISTED_QUERY_KEY = 'graphql:persisted:{}'
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class CompiledDocument:
+    """
+    A query parsed and validated once, with the cost and depth of each of
+    its operations.
+    """
+
+    def __init__(self, query, document, errors, costs):
+        self.query = query
+        self.document = document
+        self.errors = errors
+        self.costs = costs
+
+
+class DocumentCache:
+    """
+    Keeps the ``size`` most recently used compiled documents by query hash.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+            return document
+
+    def set(self, key, document):
+        with self.lock:
+            self.documents[key] = document
+            self.documents.move_to_end(key)
+            while len(self.documents) > self.size:
+                self.documents.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+
+
+documents = DocumentCache(settings.GRAPHQL_PERSISTED_QUERIES['CACHE_SIZE'])
+
+
+@receiver(setting_changed)
+def reset_documents_on_setting_change(setting, **kwargs):
+    if setting in ('GRAPHQL_PERSISTED_QUERIES', 'GRAPHQL_LIMITS'):
+        documents.size = settings.GRAPHQL_PERSISTED_QUERIES['CACHE_SIZE']
+        documents.clear()
+
+
+def compile_document(schema, query, validation_rules):
+    """
+    Returns the compiled ``query``, only parsing and validating it when it
+    is not cached in this process.
+    """
+    key = query_hash(query)
+    compiled = documents.get(key)
+    if compiled is not None:
+        return compiled
+
+    try:
+        document = parse(query)
+    except GraphQLError as e:
+        compiled = CompiledDocument(query, None, [e], {})
+    else:
+        errors = validate(schema, document, validation_rules, graphene_settings.MAX_VALIDATION_ERRORS)
+        # Measured with errors too, so that rejected operations log their cost
+        compiled = CompiledDocument(query, document, errors, measure_document(schema, document))
+
+    documents.set(key, compiled)
+    return compiled
+
+
+def get_persisted_query(sha256_hash):
+    compiled = documents.get(sha256_hash)
+    if compiled is not None and compiled.document is not None and not compiled.errors:
+        return compiled.query
+    return cache.get(PERSISTED_QUERY_KEY.format(sha256_hash))
+
+
+def persist_query(query, timeout=DEFAULT_TIMEOUT):
+    """
+    Stores ``query`` under its hash for ``timeout`` seconds, the
+    ``GRAPHQL_PERSISTED_QUERIES['TIMEOUT']`` by default or forever with None.
+    Callers validate the query first.
+    """
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = settings.GRAPHQL_PERSISTED_QUERIES['TIMEOUT']
+    sha256_hash = query_hash(query)
+    cache.set(PERSISTED_QUERY_KEY.format(sha256_hash), query, timeout)
+    return sha256_hash
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from inspect import isawaitable
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def resolver_field(info):
+    """
+    Returns the schema coordinate of the field being resolved, such as
+    ``AlbumType.songs``. Unlike the response path it does not depend on the
+    aliases of a query, so the set of labels is bounded by the schema.
+    """
+    return f'{info.parent_type.name}.{info.field_name}'
+
+
+def metric_operation_name(operation_name):
+    """
+    Returns the label of an operation in the metrics: its name when the
+    allow list is enforced or the name is in ``METRICS_OPERATIONS``, since
+    clients choose operation names freely, and 'anonymous' otherwise.
+    """
+    if operation_name and (
+        settings.GRAPHQL_PERSISTED_QUERIES['ALLOW_LIST'] or operation_name in settings.METRICS_OPERATIONS
+    ):
+        return operation_name
+    return 'anonymous'
+
+
+class OperationProfile:
+    """
+    Counts the SQL queries run while an operation executes, installed with
+    ``connection.execute_wrapper``, and the time and queries of its resolvers.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = 0
+        self.queries = 0
+        # Calls, seconds and queries by field
+        self.resolvers = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def add(self, field, duration, queries):
+        stats = self.resolvers.setdefault(field, [0, 0, 0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] += queries
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def slowest(self, limit=None):
+        return sorted(self.resolvers.items(), key=lambda item: -item[1][1])[:limit]
+
+    def as_extension(self):
+        return {
+            'duration': round(self.duration * 1000, 3),
+            'queries': self.queries,
+            'resolvers': [
+                {'field': field, 'calls': calls, 'duration': round(duration * 1000, 3), 'queries': queries}
+                for field, (calls, duration, queries) in self.slowest()
+            ],
+        }
+
+
+class ResolverMetricsMiddleware:
+    """
+    Times every resolver of operations run by SarGraphQLView, which puts an
+    OperationProfile on the request.
+
+    Only the resolver itself is measured, its fields are resolved after it
+    returns and are counted under their own coordinates. Resolvers returning
+    awaitables are measured until they are awaited, along with any resolver
+    running at the same time.
+    """
+
+    def resolve(self, next, root, info, **args):
+        profile = getattr(info.context, 'graphql_profile', None)
+        if profile is None:
+            return next(root, info, **args)
+
+        queries = profile.queries
+        started = time.perf_counter()
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            profile.add(resolver_field(info), time.perf_counter() - started, profile.queries - queries)
+            raise
+        if isawaitable(result):
+            return self.resolve_async(result, profile, info, started, queries)
+        profile.add(resolver_field(info), time.perf_counter() - started, profile.queries - queries)
+        return result
+
+    async def resolve_async(self, result, profile, info, started, queries):
+        try:
+            return await result
+        finally:
+            profile.add(resolver_field(info), time.perf_counter() - started, profile.queries - queries)
+
+
+class Metrics:
+    """
+    Totals of the profiled operations and resolvers of this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.resolvers = {}
+
+    def record(self, operation_name, profile):
+        with self.lock:
+            stats = self.operations.setdefault(operation_name, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += profile.duration
+            stats[2] += profile.queries
+            for field, (calls, duration, queries) in profile.resolvers.items():
+                stats = self.resolvers.setdefault(field, [0, 0, 0])
+                stats[0] += calls
+                stats[1] += duration
+                stats[2] += queries
+
+    def snapshot(self):
+        with self.lock:
+            return (
+                {name: list(stats) for name, stats in self.operations.items()},
+                {field: list(stats) for field, stats in self.resolvers.items()},
+            )
+
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+            self.resolvers.clear()
+
+
+metrics = Metrics()
+
+
+def record_operation(operation_name, profile):
+    metrics.record(metric_operation_name(operation_name), profile)
+    operation_name = operation_name or '<anonymous>'
+    logger.info(
+        'GraphQL operation %s took %.1f ms with %d queries', operation_name, profile.duration * 1000, profile.queries,
+        extra={
+            'operation': operation_name,
+            'duration_ms': round(profile.duration * 1000, 3),
+            'queries': profile.queries,
+            'resolvers': profile.as_extension()['resolvers'][:10],
+        },
+    )
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_prometheus(cache_stats):
+    """
+    Returns the metrics of this process in the Prometheus text format, along
+    with the response cache statistics shared by all processes.
+    """
+    operations, resolvers = metrics.snapshot()
+    families = [
+        ('graphql_operations_total', 'counter', 'GraphQL operations executed', 'operation', operations, 0),
+        ('graphql_operation_seconds_total', 'counter', 'Time spent executing GraphQL operations', 'operation', operations, 1),
+        ('graphql_operation_queries_total', 'counter', 'SQL queries run by GraphQL operations', 'operation', operations, 2),
+        ('graphql_resolver_calls_total', 'counter', 'Calls of GraphQL resolvers', 'field', resolvers, 0),
+        ('graphql_resolver_seconds_total', 'counter', 'Time spent in GraphQL resolvers', 'field', resolvers, 1),
+        ('graphql_resolver_queries_total', 'counter', 'SQL queries run by GraphQL resolvers', 'field', resolvers, 2),
+    ]
+
+    lines = []
+    for name, kind, help_text, label, samples, index in families:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        for key, stats in sorted(samples.items()):
+            lines.append(f'{name}{{{label}="{escape_label(key)}"}} {stats[index]}')
+
+    for event in ('hits', 'misses'):
+        name = f'graphql_response_cache_{event}_total'
+        lines += [
+            f'# HELP {name} GraphQL responses {"served from" if event == "hits" else "missing from"} the cache',
+            f'# TYPE {name} counter',
+            f'{name} {cache_stats[event]}',
+        ]
+    return '\n'.join(lines) + '\n'
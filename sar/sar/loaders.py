@@ -0,0 +1,225 @@
+import asyncio
+import functools
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+
+from music_api.models import Album, Song, Track
+
+from .optimizer import optimize
+
+
+class BatchLoader:
+    """
+    Request scoped loader that collapses lookups into one query per batch.
+
+    Resolvers run synchronously, so keys cannot be collected by deferring
+    execution the way an async DataLoader does. Instead, parent resolvers
+    ``queue`` every key they are about to hand out, and the first ``load``
+    that misses the cache fetches all queued keys at once.
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._queue = set()
+
+    def queue(self, keys):
+        self._queue.update(key for key in keys if key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+        self._queue.discard(key)
+
+    def load(self, key):
+        if key not in self._cache:
+            keys = self._queue | {key}
+            self._queue = set()
+            results = self.batch_load_fn(keys)
+            for batch_key in keys:
+                self._cache[batch_key] = results.get(batch_key, self.default)
+        return self._cache[key]
+
+
+class DataLoader:
+    """
+    Request scoped loader for operations executed asynchronously.
+
+    Every key loaded while resolvers run is collected, and once they wait
+    the whole batch is fetched with one call of ``batch_load_fn``, a
+    coroutine function returning the results by key.
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._batch = None
+
+    def queue(self, keys):
+        # Batches form on their own while resolvers wait
+        pass
+
+    def prime(self, key, value):
+        if key not in self._cache:
+            self._cache[key] = asyncio.get_running_loop().create_future()
+            self._cache[key].set_result(value)
+
+    def load(self, key):
+        if key not in self._cache:
+            loop = asyncio.get_running_loop()
+            if self._batch is None:
+                self._batch = {}
+                # Runs once the resolvers of this round wait for their results
+                loop.create_task(self.dispatch())
+            self._cache[key] = self._batch[key] = loop.create_future()
+        return self._cache[key]
+
+    async def dispatch(self):
+        batch, self._batch = self._batch, None
+        try:
+            results = await self.batch_load_fn(set(batch))
+        except Exception as error:
+            for future in batch.values():
+                future.set_exception(error)
+            return
+        for key, future in batch.items():
+            future.set_result(results.get(key, self.default))
+
+
+class Loaders:
+
+    def __init__(self, run_async=False):
+        self.run_async = run_async
+        if run_async:
+            self.album_songs = DataLoader(self.aload_album_songs, default=())
+        else:
+            self.album_songs = BatchLoader(self.load_album_songs, default=())
+        # Version loaders by model and selection, and the version keys queued for each model
+        self.version_loaders = defaultdict(dict)
+        self.version_keys = defaultdict(set)
+
+    def queue_albums(self, albums):
+        albums = list(albums)
+        self.album_songs.queue(album.id for album in albums)
+        self.queue_versions(albums)
+        # Songs prefetched through the tracks are handed out by AlbumType.songs
+        self.queue_versions(track.song for album in albums for track in getattr(album, 'tracks', ()))
+        return albums
+
+    def queue_versions(self, instances):
+        """
+        Queues the version keys of songs and albums about to be handed out,
+        and of those prefetched for their fields, so that their allVersions
+        are loaded together.
+        """
+        groups = defaultdict(set)
+        collect_version_keys(instances, groups)
+        for model, keys in groups.items():
+            self.version_keys[model] |= keys
+            for loader in self.version_loaders[model].values():
+                loader.queue(keys)
+
+    def versions(self, model, info):
+        """
+        Returns the loader of the versions of ``model`` by ``version_key``,
+        loading what the selection of the current field reads. The fields of
+        every item in a list share their selection and so their loader.
+        """
+        key = tuple(id(node) for node in info.field_nodes)
+        loader = self.version_loaders[model].get(key)
+        if loader is None:
+            if self.run_async:
+                loader = DataLoader(functools.partial(self.aload_versions, model, info), default=())
+            else:
+                loader = BatchLoader(functools.partial(self.load_versions, model, info), default=())
+                loader.queue(self.version_keys[model])
+            self.version_loaders[model][key] = loader
+        return loader
+
+    def album_tracks(self, album_ids):
+        return Track.objects.filter(album_id__in=album_ids).select_related('song').order_by('album_id', 'track_number')
+
+    def load_album_songs(self, album_ids):
+        songs = songs_by_album(self.album_tracks(album_ids))
+        self.queue_versions(song for album in songs.values() for song in album)
+        return songs
+
+    async def aload_album_songs(self, album_ids):
+        return songs_by_album([track async for track in self.album_tracks(album_ids)])
+
+    def group_versions(self, model, info, keys):
+        versions = model.objects.filter(Q(version_group__in=keys) | Q(pk__in=keys, version_group=None)).order_by('release_date', 'id')
+        return optimize(versions, info, fields=('version_group',))
+
+    def load_versions(self, model, info, keys):
+        return versions_by_group(self.group_versions(model, info, keys))
+
+    async def aload_versions(self, model, info, keys):
+        return versions_by_group([version async for version in self.group_versions(model, info, keys)])
+
+
+def songs_by_album(tracks):
+    """
+    Returns the songs of ``tracks`` by album, each carrying the ``album_id``
+    and ``track_number`` of its track.
+    """
+    songs = defaultdict(list)
+    for track in tracks:
+        # Each album gets its own Song instance, as track_number depends on the album
+        song = track.song
+        song.album_id = track.album_id
+        song.track_number = track.track_number
+        songs[track.album_id].append(song)
+    return songs
+
+
+def collect_version_keys(instances, groups):
+    for instance in instances:
+        # The group is only loaded when allVersions is selected
+        if isinstance(instance, (Song, Album)) and 'version_group' not in instance.get_deferred_fields():
+            groups[type(instance)].add(version_key(instance))
+        for related in getattr(instance, '_prefetched_objects_cache', {}).values():
+            collect_version_keys(related, groups)
+
+
+def version_key(instance):
+    # Rows without alternatives are a group of their own under their id, which
+    # is no group's since groups are named after their smallest id
+    return instance.pk if instance.version_group is None else instance.version_group
+
+
+def versions_by_group(versions):
+    groups = defaultdict(list)
+    for version in versions:
+        groups[version_key(version)].append(version)
+    return groups
+
+
+def get_loaders(info):
+    context = info.context
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders(is_async(info))
+        context.loaders = loaders
+    return loaders
+
+
+def is_async(info):
+    # Set by AsyncSarGraphQLView, whose resolvers may return awaitables
+    return getattr(info.context, 'graphql_async', False)
+
+
+def blocking(resolver):
+    """
+    Marks a resolver that uses the synchronous ORM or cache, which runs in a
+    thread when the operation is executed asynchronously.
+    """
+    @functools.wraps(resolver)
+    def wrapper(root, info, **args):
+        if is_async(info):
+            return sync_to_async(resolver)(root, info, **args)
+        return resolver(root, info, **args)
+    return wrapper
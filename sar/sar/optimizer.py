@@ -0,0 +1,159 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, prefetch_related_objects
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.registry import get_global_registry
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+def collect_fields(info, nodes):
+    """
+    Returns the fields selected by ``nodes`` by name, with fragments spread
+    and aliases of one field merged.
+    """
+    fields = {}
+
+    def collect(selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                fields.setdefault(selection.name.value, []).append(selection)
+            elif isinstance(selection, FragmentSpreadNode):
+                collect(info.fragments[selection.name.value].selection_set)
+            elif isinstance(selection, InlineFragmentNode):
+                collect(selection.selection_set)
+
+    for node in nodes:
+        if node.selection_set is not None:
+            collect(node.selection_set)
+    return fields
+
+
+def get_selection(info, path):
+    nodes = info.field_nodes
+    for name in path:
+        nodes = collect_fields(info, nodes).get(name, [])
+    return nodes
+
+
+def get_model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+    # Reverse relations are exposed under their accessor, like comment_set
+    for relation in model._meta.related_objects:
+        if relation.get_accessor_name() == name:
+            return relation
+    return None
+
+
+class QueryPlan:
+    """
+    The related objects and columns a selection of ``model`` reads.
+
+    Relations are joined with select_related when they point to one object
+    and prefetched otherwise. Fields that are not model fields name what
+    their resolvers read in the ``optimizer_hints`` of their type: a tuple of
+    model fields, or a function of (info, nodes) returning a Prefetch. A
+    field without a hint makes the plan load every column.
+    """
+
+    def __init__(self, model, info, nodes, fields=()):
+        self.model = model
+        self.only = {model._meta.pk.name, *fields}
+        self.select_related = []
+        self.prefetch_related = []
+        self.project = True
+
+        graphene_type = get_global_registry().get_type_for_model(model)
+        hints = getattr(graphene_type, 'optimizer_hints', {})
+        for name, field_nodes in collect_fields(info, nodes).items():
+            if name.startswith('__'):
+                continue
+            name = to_snake_case(name)
+            if name in hints:
+                self.add_hint(hints[name], info, field_nodes)
+            else:
+                self.add_field(name, info, field_nodes)
+
+    def add_hint(self, hint, info, nodes):
+        if callable(hint):
+            self.prefetch_related.append(hint(info, nodes))
+        else:
+            self.only.update(hint)
+
+    def add_field(self, name, info, nodes):
+        field = get_model_field(self.model, name)
+        if field is None:
+            self.project = False
+        elif field.many_to_many or field.one_to_many:
+            # The related rows are matched to their parents by the foreign key
+            fields = (field.field.name,) if field.one_to_many else ()
+            queryset = QueryPlan(field.related_model, info, nodes, fields).apply(field.related_model._default_manager.all())
+            self.prefetch_related.append(Prefetch(field.get_accessor_name() if field.auto_created else name, queryset=queryset))
+        elif field.is_relation and field.concrete:
+            related = QueryPlan(field.related_model, info, nodes)
+            select_related, prefetch_related, only = related.lookups(name)
+            self.select_related += [name, *select_related]
+            self.prefetch_related += prefetch_related
+            self.only.update([name, *only])
+        elif field.concrete:
+            self.only.add(name)
+
+    def lookups(self, prefix=None):
+        """
+        Returns the select_related lookups, Prefetch objects and columns of
+        this plan as seen from a model relating to it through ``prefix``.
+        """
+        def lookup(name):
+            return f'{prefix}__{name}' if prefix else name
+
+        only = self.only
+        if not self.project:
+            only = [field.name for field in self.model._meta.concrete_fields if not field.generated]
+        return (
+            [lookup(name) for name in self.select_related],
+            [
+                Prefetch(lookup(prefetch.prefetch_through), queryset=prefetch.queryset, to_attr=prefetch.to_attr)
+                for prefetch in self.prefetch_related
+            ],
+            [lookup(name) for name in only],
+        )
+
+    def apply(self, queryset, prefix=None, fields=()):
+        """
+        Applies the plan to ``queryset``, of this plan's model or of one
+        relating to it through ``prefix`` whose ``fields`` are loaded too.
+        """
+        select_related, prefetch_related, only = self.lookups(prefix)
+        if prefix:
+            select_related.insert(0, prefix)
+            only += [prefix, *fields]
+
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        if self.project or prefix:
+            queryset = queryset.only(*only)
+        return queryset
+
+
+def optimize(queryset, info, path=(), fields=()):
+    """
+    Returns ``queryset`` loading what the selection of the current field, or
+    of the field at ``path`` below it, reads in as few queries as possible.
+    ``fields`` are always loaded.
+    """
+    return QueryPlan(queryset.model, info, get_selection(info, path), fields).apply(queryset)
+
+
+def prefetch(instances, info, path=()):
+    """
+    Prefetches what the selection at ``path`` reads for already loaded
+    ``instances`` of one model, including the objects a join would have
+    selected.
+    """
+    if instances:
+        plan = QueryPlan(type(instances[0]), info, get_selection(info, path))
+        prefetch_related_objects(instances, *plan.select_related, *plan.prefetch_related)
+    return instances
@@ -0,0 +1,139 @@
+import base64
+import json
+
+from django.db.models import F, Q
+from graphene.relay import PageInfo
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+from graphql_relay import cursor_to_offset, offset_to_cursor
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, queryset, key):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return [
+            None if value is None else queryset.model._meta.get_field(field).to_python(value)
+            for field, value in zip(key, values, strict=True)
+        ]
+    except Exception:
+        raise GraphQLError('Invalid cursor')
+
+
+def after_filter(key, values):
+    """
+    Matches rows that come after ``values`` when ordering descending by ``key``,
+    a (column, unique column) pair whose first column may be null and sorts first.
+    """
+    column, tiebreaker = key
+    value, tiebreaker_value = values
+    if value is None:
+        return (
+            Q(**{f'{column}__isnull': True, f'{tiebreaker}__lt': tiebreaker_value})
+            | Q(**{f'{column}__isnull': False})
+        )
+    return Q(**{f'{column}__lt': value}) | Q(**{column: value, f'{tiebreaker}__lt': tiebreaker_value})
+
+
+def page_size(first):
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    if first is None:
+        return max_limit
+    if first < 0:
+        raise GraphQLError('Argument "first" must be a non-negative integer')
+    return min(first, max_limit)
+
+
+def fetch_page(queryset, key, first=None, after=None):
+    """
+    Returns the rows of one page of ``queryset`` newest first, and whether
+    more rows follow.
+
+    Pages are selected by seeking past the cursor's key rather than with
+    OFFSET, so every page costs the same no matter how deep it is.
+    """
+    first = page_size(first)
+    rows = list(page_queryset(queryset, key, first, after))
+    return rows[:first], len(rows) > first
+
+
+async def afetch_page(queryset, key, first=None, after=None):
+    first = page_size(first)
+    rows = [row async for row in page_queryset(queryset, key, first, after)]
+    return rows[:first], len(rows) > first
+
+
+def page_queryset(queryset, key, first, after):
+    # One row more than the page tells whether another page follows
+    column, tiebreaker = key
+    # Matches the (column DESC, tiebreaker DESC) indexes, Postgres puts nulls first there
+    queryset = queryset.order_by(F(column).desc(nulls_first=True), F(tiebreaker).desc())
+    if after is not None:
+        queryset = queryset.filter(after_filter(key, decode_cursor(after, queryset, key)))
+    return queryset[:first + 1]
+
+
+def make_connection(connection_type, rows, key, has_next_page, after=None):
+    edges = [
+        connection_type.Edge(node=row, cursor=encode_cursor([
+            None if getattr(row, field) is None else str(getattr(row, field)) for field in key
+        ]))
+        for row in rows
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=after is not None,
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
+
+
+def paginate(queryset, connection_type, key, first=None, after=None):
+    """
+    Returns one page of ``queryset`` as ``connection_type``, newest first.
+    """
+    rows, has_next_page = fetch_page(queryset, key, first, after)
+    return make_connection(connection_type, rows, key, has_next_page, after)
+
+
+async def apaginate(queryset, connection_type, key, first=None, after=None):
+    rows, has_next_page = await afetch_page(queryset, key, first, after)
+    return make_connection(connection_type, rows, key, has_next_page, after)
+
+
+def paginate_ranked(fetch, connection_type, first=None, after=None):
+    """
+    Returns one page of results ordered by a computed rank as
+    ``connection_type``. ``fetch(limit, offset)`` returns the nodes.
+
+    A rank cannot be seeked past the way a column can, so cursors hold offsets.
+    """
+    first = page_size(first)
+    offset = 0
+    if after is not None:
+        offset = cursor_to_offset(after)
+        if offset is None:
+            raise GraphQLError('Invalid cursor')
+        offset += 1
+
+    nodes = fetch(first + 1, offset)
+    has_next_page = len(nodes) > first
+    edges = [
+        connection_type.Edge(node=node, cursor=offset_to_cursor(offset + index))
+        for index, node in enumerate(nodes[:first])
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=offset > 0,
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        ),
+    )
@@ -1,6 +1,32 @@
+import base64
+
 import graphene
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import BinaryField, Prefetch
+from graphene_django.converter import convert_django_field
 from graphene_django.types import DjangoObjectType
-from music_api.models import Album, Comment, Song, Track, Updates
+from music_api.cache import COMMENTS_TIMEOUT, comments_key, get_or_compute
+from music_api.catalog import check_ids, modify_songs, set_album_tracklist
+from music_api.comments import comment_buffer
+from music_api.models import Album, Comment, IngestionJob, Song, Track, Updates
+from music_api.ratelimit import check_comment_rate
+from music_api.search import search_catalog
+
+from .loaders import blocking, get_loaders, is_async, songs_by_album, version_key
+from .optimizer import QueryPlan, optimize, prefetch
+from .pagination import apaginate, fetch_page, make_connection, page_size, paginate, paginate_ranked
+
+@convert_django_field.register(BinaryField)
+def convert_binary_field(field, registry=None):
+    # Types declare their own base64 resolvers for binary fields
+    return graphene.String(description=field.help_text, required=not field.null)
+
+def prefetch_tracks(info, nodes):
+    # Album songs are read through their tracks, in track order
+    songs = QueryPlan(Song, info, nodes)
+    tracks = songs.apply(Track.objects.order_by('track_number'), 'song', ('album', 'track_number'))
+    return Prefetch('track_set', queryset=tracks, to_attr='tracks')
 
 class TrackType(DjangoObjectType):
     class Meta:
@@ -9,16 +35,33 @@ class TrackType(DjangoObjectType):
 class SongType(DjangoObjectType):
     released_ago = graphene.String()
     track_number = graphene.Int()
+    waveform = graphene.String(description='Base64 encoded int8 min/max pairs')
+    all_versions = graphene.List(lambda: SongType, description='The song and every song linked to it by alternatives, directly or not')
+
+    optimizer_hints = {
+        'released_ago': ('release_date',),
+        'track_number': (),
+        'all_versions': ('version_group',),
+    }
 
     class Meta:
         model = Song
-        exclude = ('track_set',)
+        exclude = ('track_set', 'search_vector', 'version_group')
 
     def resolve_released_ago(self, info):
         return self.released_ago
     
+    def resolve_waveform(self, info):
+        if not self.waveform:
+            return None
+        return base64.b64encode(self.waveform).decode()
+
     def resolve_track_number(self, info):
-        return Track.objects.get(song_id=self.id, album_id=self.album_id).track_number
+        # Only set on songs listed by an album
+        return getattr(self, 'track_number', None)
+
+    def resolve_all_versions(self, info):
+        return get_loaders(info).versions(Song, info).load(version_key(self))
 
     
 class AlbumType(DjangoObjectType):
@@ -27,28 +70,45 @@ class AlbumType(DjangoObjectType):
     released = graphene.Boolean()
     songs = graphene.List(SongType)
     number_of_songs = graphene.Int()
+    all_versions = graphene.List(lambda: AlbumType, description='The album and every album linked to it by alternatives, directly or not')
+
+    optimizer_hints = {
+        'released_ago': ('release_date',),
+        'duration': ('total_duration',),
+        'released': ('release_date',),
+        'songs': prefetch_tracks,
+        'number_of_songs': ('track_count',),
+        'all_versions': ('version_group',),
+    }
 
     class Meta:
         model = Album
-        exclude = ('song_set',)
+        exclude = ('song_set', 'search_vector', 'version_group')
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return get_loaders(info).queue_albums(queryset)
 
     def resolve_released_ago(self, info):
         return self.released_ago
     
     def resolve_duration(self, info):
-        return self.duration
+        return self.total_duration
     
     def resolve_released(self, info):
         return self.released
     
     def resolve_songs(self, info):
-        songs = Song.objects.filter(albums=self.id)
-        for song in songs:
-            song.album_id = self.id
-        return songs
+        tracks = getattr(self, 'tracks', None)
+        if tracks is None:
+            return get_loaders(info).album_songs.load(self.id)
+        return songs_by_album(tracks)[self.id]
     
     def resolve_number_of_songs(self, info):
-        return Song.objects.filter(albums=self.id).count()
+        return self.track_count
+
+    def resolve_all_versions(self, info):
+        return get_loaders(info).versions(Album, info).load(version_key(self))
     
 class CommentType(DjangoObjectType):
     class Meta:
@@ -58,6 +118,50 @@ class UpdatesType(DjangoObjectType):
     class Meta:
         model = Updates
 
+class IngestionJobType(DjangoObjectType):
+    class Meta:
+        model = IngestionJob
+        exclude = ('payload', 'files')
+
+class SearchResultType(graphene.ObjectType):
+    song = graphene.Field(SongType)
+    album = graphene.Field(AlbumType)
+    rank = graphene.Float()
+    snippet = graphene.String(description='Matched text with the terms wrapped in <mark> tags')
+
+    # Ranks and snippets are computed from the songs and albums
+    cache_tags = ('song', 'album')
+
+class SearchConnection(graphene.relay.Connection):
+    class Meta:
+        node = SearchResultType
+
+class SongConnection(graphene.relay.Connection):
+    class Meta:
+        node = SongType
+
+class AlbumConnection(graphene.relay.Connection):
+    class Meta:
+        node = AlbumType
+
+class CommentConnection(graphene.relay.Connection):
+    total_count = graphene.Int(description='Number of comments on the song')
+
+    class Meta:
+        node = CommentType
+
+    @blocking
+    def resolve_total_count(self, info):
+        return get_or_compute(
+            self.cache_key.format('count'),
+            lambda: Comment.objects.filter(song_id=self.song_id).count(),
+            COMMENTS_TIMEOUT,
+        )
+
+class UpdatesConnection(graphene.relay.Connection):
+    class Meta:
+        node = UpdatesType
+
 class ModifySong(graphene.Mutation):
     class Arguments:
         id = graphene.ID(required=True)
@@ -75,34 +179,10 @@ class ModifySong(graphene.Mutation):
         if not info.context.user.is_authenticated or not info.context.user.is_superuser:
             raise Exception('You must be a superuser to modify a song')
 
-        song = Song.objects.get(pk=id)
-
-        if title is not None:
-            song.title = title
-
-        if note is not None:
-            song.note = note
-
-        if lyrics is not None:
-            song.lyrics = lyrics
-
-        if features is not None:
-            song.features = features
-
-        if youtube is not None:
-            song.youtube = youtube
-
-        if albums is not None:
-            song.albums.clear()
-            for album in albums:
-                song.albums.add(Album.objects.get(pk=album))
-
-        if alternatives is not None:
-            song.alternatives.clear()
-            for alternative in alternatives:
-                song.alternatives.add(Song.objects.get(pk=alternative))
-
-        song.save()
+        song, = modify_songs([{
+            'id': id, 'title': title, 'note': note, 'lyrics': lyrics, 'features': features, 'youtube': youtube,
+            'albums': albums, 'alternatives': alternatives,
+        }])
         return ModifySong(song=song)
     
 class ModifyAlbum(graphene.Mutation):
@@ -139,13 +219,47 @@ class ModifyAlbum(graphene.Mutation):
             album.youtube = youtube
 
         if alternatives is not None:
-            album.alternatives.clear()
-            for alternative in alternatives:
-                album.alternatives.add(Album.objects.get(pk=alternative))
+            check_ids(Album, alternatives, Album.objects.filter(pk__in=alternatives).values_list('pk', flat=True))
+            album.alternatives.set(alternatives)
 
         album.save()
         return ModifyAlbum(album=album)
 
+class SongInput(graphene.InputObjectType):
+    id = graphene.ID(required=True)
+    title = graphene.String()
+    note = graphene.String()
+    lyrics = graphene.String()
+    albums = graphene.List(graphene.NonNull(graphene.Int))
+    alternatives = graphene.List(graphene.NonNull(graphene.Int))
+    features = graphene.String()
+    youtube = graphene.String()
+
+class BulkModifySongs(graphene.Mutation):
+    class Arguments:
+        songs = graphene.List(graphene.NonNull(SongInput), required=True)
+
+    songs = graphene.List(SongType)
+
+    def mutate(self, info, songs):
+        if not info.context.user.is_authenticated or not info.context.user.is_superuser:
+            raise Exception('You must be a superuser to modify songs')
+
+        return BulkModifySongs(songs=prefetch(modify_songs(songs), info, ('songs',)))
+
+class SetAlbumTracklist(graphene.Mutation):
+    class Arguments:
+        album_id = graphene.ID(required=True)
+        song_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    album = graphene.Field(AlbumType)
+
+    def mutate(self, info, album_id, song_ids):
+        if not info.context.user.is_authenticated or not info.context.user.is_superuser:
+            raise Exception('You must be a superuser to modify an album')
+
+        return SetAlbumTracklist(album=set_album_tracklist(album_id, song_ids))
+
 class MakeAlbum(graphene.Mutation):
     class Arguments:
         title = graphene.String()
@@ -202,11 +316,22 @@ class MakeComment(graphene.Mutation):
         song = graphene.Int()
     
     comment = graphene.Field(CommentType)
+    queued = graphene.Boolean(description='Whether the comment is saved shortly with others, and has no id yet')
 
     def mutate(self, info, text, nickname, song):
-        comment = Comment(text=text, nickname=nickname, song=Song.objects.get(pk=song))
-        comment.save()
-        return MakeComment(comment=comment)
+        check_comment_rate(info.context, nickname)
+        comment = Comment(text=text, nickname=nickname, song_id=song)
+        if settings.COMMENT_BUFFER['ENABLED']:
+            comment_buffer.add(comment)
+            return MakeComment(queued=True)
+
+        # The song's foreign key is checked when the transaction commits
+        try:
+            with transaction.atomic():
+                comment.save()
+        except IntegrityError:
+            raise Exception(f'Song {song} does not exist')
+        return MakeComment(comment=comment, queued=False)
 
 class DeleteSong(graphene.Mutation):
     class Arguments:
@@ -265,45 +390,102 @@ class DeleteUpdate(graphene.Mutation):
         return DeleteUpdate(update=update)
 
 class Query(graphene.ObjectType):
-    all_my_models = graphene.List(SongType)
-    all_songs = graphene.List(SongType)
-    all_albums = graphene.List(AlbumType)
+    all_songs = graphene.Field(SongConnection, first=graphene.Int(), after=graphene.String())
+    all_albums = graphene.Field(AlbumConnection, first=graphene.Int(), after=graphene.String())
     song = graphene.Field(SongType, id=graphene.Int())
     album = graphene.Field(AlbumType, id=graphene.Int())
-    updates = graphene.List(UpdatesType, start=graphene.Int(0), count=graphene.Int())
-
-    def resolve_all_albums(self, info, **kwargs):
-        return Album.objects.all()
-
-    def resolve_all_songs(self, info, **kwargs):
-        return Song.objects.all()
-
-    def resolve_all_my_models(self, info, **kwargs):
-        return Song.objects.all()
+    updates = graphene.Field(UpdatesConnection, first=graphene.Int(), after=graphene.String())
+    comments = graphene.Field(CommentConnection, song_id=graphene.Int(required=True), first=graphene.Int(), after=graphene.String())
+    ingestion_job = graphene.Field(IngestionJobType, id=graphene.Int(required=True))
+    search = graphene.Field(SearchConnection, query=graphene.String(required=True), first=graphene.Int(), after=graphene.String())
+
+    def resolve_all_albums(self, info, first=None, after=None):
+        albums = optimize(Album.objects.all(), info, ('edges', 'node'), ('release_date',))
+        if is_async(info):
+            # Async loaders batch album songs without queueing the albums
+            return apaginate(albums, AlbumConnection, ('release_date', 'id'), first, after)
+        connection = paginate(albums, AlbumConnection, ('release_date', 'id'), first, after)
+        AlbumType.get_queryset([edge.node for edge in connection.edges], info)
+        return connection
+
+    def resolve_all_songs(self, info, first=None, after=None):
+        songs = optimize(Song.objects.all(), info, ('edges', 'node'), ('release_date',))
+        if is_async(info):
+            return apaginate(songs, SongConnection, ('release_date', 'id'), first, after)
+        connection = paginate(songs, SongConnection, ('release_date', 'id'), first, after)
+        get_loaders(info).queue_versions(edge.node for edge in connection.edges)
+        return connection
     
     def resolve_song(self, info, **kwargs):
         id = kwargs.get('id')
         if id is not None:
-            return Song.objects.get(pk=id)
+            songs = optimize(Song.objects.all(), info)
+            return songs.aget(pk=id) if is_async(info) else songs.get(pk=id)
         return None
     
     def resolve_album(self, info, **kwargs):
         id = kwargs.get('id')
         if id is not None:
-            return Album.objects.get(pk=id)
+            albums = optimize(Album.objects.all(), info)
+            if is_async(info):
+                return albums.aget(pk=id)
+            return AlbumType.get_queryset([albums.get(pk=id)], info)[0]
         return None
     
-    def resolve_updates(self, info, **kwargs):
-        count = kwargs.get('count')
-        start = kwargs.get('start')
-        # sort by date
-        if count is not None:
-            return Updates.objects.order_by('-date')[start:count]
-        return Updates.objects.order_by('-date')[start:]
+    def resolve_updates(self, info, first=None, after=None):
+        updates = optimize(Updates.objects.all(), info, ('edges', 'node'), ('date',))
+        return (apaginate if is_async(info) else paginate)(updates, UpdatesConnection, ('date', 'id'), first, after)
+
+    @blocking
+    def resolve_comments(self, info, song_id, first=None, after=None):
+        key = ('date', 'id')
+        comments = Comment.objects.filter(song_id=song_id)
+        cache_key = comments_key(song_id)
+        if after is None:
+            # Most readers only see the first page, which is cached until the song gets a comment
+            rows, has_next_page = get_or_compute(
+                cache_key.format(f'page:{page_size(first)}'), lambda: fetch_page(comments, key, first), COMMENTS_TIMEOUT,
+            )
+        else:
+            rows, has_next_page = fetch_page(comments, key, first, after)
+
+        connection = make_connection(CommentConnection, prefetch(rows, info, ('edges', 'node')), key, has_next_page, after)
+        connection.song_id = song_id
+        connection.cache_key = cache_key
+        return connection
+
+    @blocking
+    def resolve_search(self, info, query, first=None, after=None):
+        def fetch(limit, offset):
+            results = search_catalog(query, limit, offset)
+            songs = prefetch([row for row in results if isinstance(row, Song)], info, ('edges', 'node', 'song'))
+            get_loaders(info).queue_versions(songs)
+            albums = prefetch([row for row in results if isinstance(row, Album)], info, ('edges', 'node', 'album'))
+            AlbumType.get_queryset(albums, info)
+            return [
+                SearchResultType(
+                    song=row if isinstance(row, Song) else None,
+                    album=row if isinstance(row, Album) else None,
+                    rank=row.rank,
+                    snippet=row.snippet,
+                )
+                for row in results
+            ]
+
+        return paginate_ranked(fetch, SearchConnection, first, after)
+
+    def resolve_ingestion_job(self, info, id):
+        if not info.context.user.is_authenticated or not info.context.user.is_superuser:
+            raise Exception('You must be a superuser to view ingestion jobs')
+
+        jobs = optimize(IngestionJob.objects.all(), info)
+        return jobs.aget(pk=id) if is_async(info) else jobs.get(pk=id)
 
 class Mutation(graphene.ObjectType):
     modify_song = ModifySong.Field()
     modify_album = ModifyAlbum.Field()
+    bulk_modify_songs = BulkModifySongs.Field()
+    set_album_tracklist = SetAlbumTracklist.Field()
     make_update = MakeUpdate.Field()
     make_comment = MakeComment.Field()
     delete_song = DeleteSong.Field()
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 from os import path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'music_api',
     'graphene_django',
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'sar.static.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,7 +68,10 @@ GRAPHENE = {
     'DEBUG': config('DEBUG'),
     'MIDDLEWARE': [
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'sar.instrumentation.ResolverMetricsMiddleware',
     ],
+    # Largest page the catalog connections (allSongs, allAlbums, updates) return
+    'RELAY_CONNECTION_MAX_LIMIT': 100,
 }
 
 TEMPLATES = [
@@ -112,6 +117,89 @@ CACHES = {
     }
 }
 
+# Where uploaded artwork and audio files are stored, see music_api.storage
+MEDIA_STORAGE = {
+    'BACKEND': 'music_api.storage.GCSBackend',
+    'OPTIONS': {
+        'bucket': 'sar-music-bucket',
+        'credentials': config('GOOGLE_APPLICATION_CREDENTIALS', default=None),
+    },
+}
+
+# Song uploads are staged here and ingested by the run_ingestion_worker command.
+# Failed uploads are retried MAX_ATTEMPTS times, waiting RETRY_BACKOFF seconds
+# doubled after every attempt. Jobs of workers that stopped are queued again
+# once they did not change for STALE_AFTER seconds, longer than any upload
+INGESTION = {
+    'STAGING_ROOT': path.join(BASE_DIR, 'staging'),
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 10,
+    'STALE_AFTER': 60 * 15,
+}
+
+# Anonymous GraphQL query responses are cached for this many seconds,
+# writes to the catalog invalidate them earlier (see music_api.cache)
+GRAPHQL_CACHE_TIMEOUT = 60 * 15
+
+# Operations on /graphql/ deeper or costlier than this are rejected before
+# they run, see sar.complexity for how the cost is counted. List sizes are the
+# typical number of related rows in the catalog, so the reads in
+# music_api.benchmark stay well under MAX_COST
+GRAPHQL_LIMITS = {
+    'MAX_DEPTH': 10,
+    'MAX_COST': 20000,
+    'DEFAULT_LIST_SIZE': 10,
+    'LIST_SIZES': {
+        'AlbumType.songs': 20,
+        'AlbumType.trackSet': 20,
+        'SongType.albums': 5,
+        'SongType.allVersions': 5,
+        'AlbumType.allVersions': 5,
+        'UpdatesType.referencesAlbums': 5,
+        'SongType.commentSet': 50,
+    },
+    'FIELD_COSTS': {
+        'Query.search': 10,
+    },
+}
+
+# Clients may send the SHA-256 hash of a query instead of its text, see
+# sar.documents. Each process keeps CACHE_SIZE parsed and validated documents,
+# queries registered by clients are kept for TIMEOUT seconds, and with
+# ALLOW_LIST only queries added by register_persisted_queries are run
+GRAPHQL_PERSISTED_QUERIES = {
+    'CACHE_SIZE': 500,
+    'TIMEOUT': 60 * 60 * 24,
+    'ALLOW_LIST': config('GRAPHQL_ALLOW_LIST', default=False, cast=bool),
+}
+
+# Comments, the only writes open to anonymous clients, are limited for each
+# client IP and nickname to bursts of BURST refilled at PER_MINUTE a minute.
+# Behind PROXIES reverse proxies the client IP is read from X-Forwarded-For
+COMMENT_RATE_LIMIT = {
+    'BURST': 10,
+    'PER_MINUTE': 6,
+    'PROXIES': config('PROXIES', default=0, cast=int),
+}
+
+# With ENABLED, new comments are saved together by one insert, at most
+# FLUSH_INTERVAL seconds later, see music_api.comments
+COMMENT_BUFFER = {
+    'ENABLED': config('COMMENT_BUFFER', default=False, cast=bool),
+    'FLUSH_INTERVAL': 2,
+    'MAX_SIZE': 200,
+}
+
+# Serve /graphql/ with AsyncSarGraphQLView, set by sar.asgi
+GRAPHQL_ASYNC = config('GRAPHQL_ASYNC', default=False, cast=bool)
+
+# Bearer token Prometheus sends to scrape /graphql/metrics/
+METRICS_TOKEN = config('METRICS_TOKEN', default=None)
+
+# Operation names reported in the metrics, others are counted as anonymous.
+# With the persisted query allow list every operation keeps its name
+METRICS_OPERATIONS = config('METRICS_OPERATIONS', default='', cast=Csv())
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -149,6 +237,23 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = path.join(BASE_DIR, 'static')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Hashed copies and precompressed variants of the collected files, see sar.static
+    'staticfiles': {
+        'BACKEND': 'sar.static.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Hashed copies are cached by clients for MAX_AGE seconds, other files are
+# revalidated with their ETag. INDEX is the page of the frontend's own routes
+STATIC_SERVING = {
+    'MAX_AGE': 60 * 60 * 24 * 365,
+    'INDEX': 'index.html',
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
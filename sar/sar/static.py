@@ -0,0 +1,180 @@
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+COMPRESSED_EXTENSIONS = ('.css', '.html', '.ico', '.js', '.json', '.map', '.mjs', '.svg', '.txt', '.wasm', '.xml')
+# Content encodings of the variants written by collectstatic, preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Names ManifestStaticFilesStorage gives to copies of a file, like app.3f2a9c81d0e4.js
+HASHED_NAME = re.compile(r'^(.*)\.[0-9a-f]{12}(\.[^./]+)$')
+
+
+def get_compressors():
+    compressors = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        return compressors
+    return [('.br', brotli.compress), *compressors]
+
+
+def compress(path, compressors):
+    """
+    Writes the compressed variants of the file at ``path`` that are worth
+    sending instead of it, and removes those left from older versions.
+    """
+    data = Path(path).read_bytes()
+    for suffix, compressor in compressors:
+        compressed = compressor(data)
+        if len(compressed) < len(data) * 0.95:
+            Path(path + suffix).write_bytes(compressed)
+        else:
+            Path(path + suffix).unlink(missing_ok=True)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Adds gzip variants, and brotli ones when the brotli package is installed,
+    next to the collected text files and their hashed copies, so that they
+    are compressed once by collectstatic rather than for every response.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+
+        compressors = get_compressors()
+        for name in sorted(set(paths) | set(self.hashed_files.values())):
+            if name.endswith(COMPRESSED_EXTENSIONS) and self.exists(name):
+                compress(self.path(name), compressors)
+
+
+def is_hashed(name):
+    # Only the copies listed in the manifest, an asset may look hashed by chance
+    match = HASHED_NAME.match(name)
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', {})
+    return match is not None and hashed_files.get(match[1] + match[2]) == name
+
+
+def find_file(name):
+    try:
+        path = safe_join(settings.STATIC_ROOT, name)
+    except SuspiciousFileOperation:
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def accepted_encodings(request):
+    encodings = set()
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding, _, params = part.partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            encodings.add(encoding.strip())
+    return encodings
+
+
+def file_response(request, path, cache_control):
+    """
+    Returns the smallest variant of the file at ``path`` the client accepts,
+    or a 304 response when the client's copy is current.
+    """
+    accepted = accepted_encodings(request)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    filename = posixpath.basename(path)
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(path + suffix):
+            encoding = name
+            path += suffix
+            break
+
+    stat = os.stat(path)
+    etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}{"-" + encoding if encoding else ""}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        # Sent with the server's wsgi.file_wrapper, sendfile where available
+        response = FileResponse(open(path, 'rb'), content_type=content_type, filename=filename)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(stat.st_mtime)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def static_response(request, name):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    path = find_file(name)
+    if path is None:
+        return None
+
+    if is_hashed(name):
+        cache_control = f'public, max-age={settings.STATIC_SERVING["MAX_AGE"]}, immutable'
+    else:
+        # Names that keep their content between builds are revalidated with their ETag
+        cache_control = 'no-cache'
+    return file_response(request, path, cache_control)
+
+
+class StaticFilesMiddleware:
+    """
+    Serves the files collected in STATIC_ROOT under STATIC_URL before the
+    rest of the middleware and URL routing run.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.serve(request)
+        return self.get_response(request) if response is None else response
+
+    async def __acall__(self, request):
+        response = self.serve(request)
+        return await self.get_response(request) if response is None else response
+
+    def serve(self, request):
+        prefix = '/' + settings.STATIC_URL.lstrip('/')
+        if request.path_info.startswith(prefix):
+            return static_response(request, request.path_info[len(prefix):])
+        return None
+
+
+def serve_frontend(request, path):
+    """
+    Serves the frontend build collected at the root of STATIC_ROOT, with its
+    index page for the routes the frontend handles itself.
+    """
+    response = static_response(request, path)
+    if response is not None:
+        return response
+    if '.' in posixpath.basename(path):
+        raise Http404('No such file')
+
+    response = static_response(request, settings.STATIC_SERVING['INDEX'])
+    if response is None:
+        raise Http404('The frontend is not built')
+    return response
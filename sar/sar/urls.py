@@ -14,16 +14,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
 from django.urls import path, re_path, include
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
-from django.conf.urls.static import serve
 from django.conf import settings
 
+from .static import serve_frontend
+from .views import AsyncSarGraphQLView, SarGraphQLView, graphql_cache_stats, graphql_metrics
+
+GraphQLView = AsyncSarGraphQLView if settings.GRAPHQL_ASYNC else SarGraphQLView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql/cache-stats/', graphql_cache_stats),
+    path('graphql/metrics/', graphql_metrics),
     path('api/', include('music_api.urls')),
-    re_path(r'^(?P<path>.*)$', serve, {'document_root': settings.STATIC_ROOT})
+    # Collected files under STATIC_URL are served by sar.static.StaticFilesMiddleware. Prefixes
+    # without their slash are left to APPEND_SLASH, so /graphql redirects to /graphql/
+    re_path(rf'^(?!(?:api|graphql|admin|{re.escape(settings.STATIC_URL.strip("/"))})(?:/|$))(?P<path>.*)$', serve_frontend),
 ]
@@ -0,0 +1,501 @@
+import hashlib
+import json
+from collections import namedtuple
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    ExecutionResult, OperationType, TypeInfo, TypeInfoVisitor, Visitor, execute, get_named_type, get_operation_ast,
+    print_ast, specified_rules, validate_schema, visit,
+)
+from graphql_jwt.middleware import JSONWebTokenMiddleware
+from graphql_jwt.settings import jwt_settings
+
+from music_api.cache import get_stats, get_tag_versions, record
+
+from .complexity import ComplexityLimitRule, log_complexity
+from .documents import compile_document, get_persisted_query, persist_query, query_hash
+from .instrumentation import OperationProfile, record_operation, render_prometheus
+
+QueryRead = namedtuple('QueryRead', ['compiled', 'operation', 'variables', 'operation_name', 'versions'])
+
+
+class SelectedTypesCollector(Visitor):
+
+    def __init__(self, type_info):
+        super().__init__()
+        self.type_info = type_info
+        self.types = set()
+
+    def enter_field(self, node, *args):
+        field_type = self.type_info.get_type()
+        if field_type is not None:
+            self.types.add(get_named_type(field_type))
+
+
+def get_cache_tags(schema, document):
+    """
+    Returns the model names behind every object type the document selects,
+    and the ``cache_tags`` of types that are not backed by a model.
+    """
+    type_info = TypeInfo(schema)
+    collector = SelectedTypesCollector(type_info)
+    visit(document, TypeInfoVisitor(type_info, collector))
+
+    tags = set()
+    for graphql_type in collector.types:
+        graphene_type = getattr(graphql_type, 'graphene_type', None)
+        # Connections count their nodes even when no node is selected
+        node = getattr(getattr(graphene_type, '_meta', None), 'node', None)
+        if node is not None:
+            graphene_type = node
+        tags.update(getattr(graphene_type, 'cache_tags', ()))
+        model = getattr(getattr(graphene_type, '_meta', None), 'model', None)
+        if model is not None:
+            tags.add(model._meta.model_name)
+    return tags
+
+
+def log_operation_cost(compiled, operation_ast):
+    if operation_ast is not None:
+        name = operation_ast.name.value if operation_ast.name else None
+        log_complexity(name, *compiled.costs[name])
+
+
+class SarGraphQLView(GraphQLView):
+    cache_timeout = settings.GRAPHQL_CACHE_TIMEOUT
+    validation_rules = (*specified_rules, ComplexityLimitRule)
+
+    def __init__(self, cache_timeout=None, **kwargs):
+        super().__init__(**kwargs)
+        # 0 turns the response cache off
+        if cache_timeout is not None:
+            self.cache_timeout = cache_timeout
+
+    def dispatch(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.add_etag(request, response, etag)
+
+    def get_etag(self, request):
+        """
+        Returns the ETag of the response to a GET query without running it,
+        which changes with the versions of the models the query reads.
+        Returns None for other requests.
+        """
+        if request.method != 'GET' or self.batch or request.META.get('HTTP_X_GRAPHQL_TIMING'):
+            return None
+        if self.graphiql and self.can_display_graphiql(request, {}):
+            return None
+        try:
+            read = self.get_read(request, {})
+        except HttpError:
+            return None
+        if read is None or not read.versions:
+            return None
+
+        anonymous = self.is_anonymous(request)
+        key = json.dumps([
+            print_ast(read.compiled.document),
+            read.variables or {},
+            read.operation_name,
+            sorted(read.versions.items()),
+            bool(self.pretty or request.GET.get('pretty')),
+            None if anonymous else [request.user.pk, request.META.get('HTTP_AUTHORIZATION'), request.COOKIES.get(jwt_settings.JWT_COOKIE_NAME)],
+        ], sort_keys=True)
+        return '"{}"'.format(hashlib.sha256(key.encode()).hexdigest()[:32])
+
+    def add_etag(self, request, response, etag):
+        if response.status_code in (200, 304):
+            response.headers['ETag'] = etag
+            # Clients keep the response but check it is current before using it
+            response.headers['Cache-Control'] = 'no-cache' if self.is_anonymous(request) else 'private, no-cache'
+        return response
+
+    def get_response(self, request, data, show_graphiql=False):
+        if request.META.get('HTTP_X_GRAPHQL_TIMING') and self.can_profile(request):
+            return self.get_timed_response(request, data, show_graphiql)
+
+        cache_key = self.get_cache_key(request, data, show_graphiql)
+        if cache_key is None:
+            return super().get_response(request, data, show_graphiql)
+
+        cached = cache.get(cache_key)
+        if cached is not None:
+            record('hits')
+            read = self.get_read(request, data)
+            log_operation_cost(read.compiled, read.operation)
+            return cached
+
+        record('misses')
+        request.graphql_cacheable = True
+        result, status_code = super().get_response(request, data, show_graphiql)
+        if status_code == 200 and result is not None and request.graphql_cacheable:
+            cache.set(cache_key, (result, status_code), self.cache_timeout)
+        return result, status_code
+
+    def get_timed_response(self, request, data, show_graphiql=False):
+        """
+        Returns an uncached response with the timing of the operation and its
+        resolvers in the ``timing`` extension.
+        """
+        result, status_code = super().get_response(request, data, show_graphiql)
+        profile = getattr(request, 'graphql_profile', None)
+        if result is not None and profile is not None:
+            response = json.loads(result)
+            response['extensions'] = {'timing': profile.as_extension()}
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        return result, status_code
+
+    def can_profile(self, request):
+        user = request.user
+        if not user.is_authenticated and request.META.get('HTTP_AUTHORIZATION'):
+            user = authenticate(request=request) or user
+        return user.is_superuser
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        result = self.execute_compiled_request(request, query, variables, operation_name, show_graphiql)
+        if result is not None and result.errors:
+            request.graphql_cacheable = False
+        return result
+
+    def execute_compiled_request(self, request, query, variables, operation_name, show_graphiql=False):
+        """
+        Runs ``query`` like GraphQLView.execute_graphql_request, but takes the
+        parsed and validated document from sar.documents.
+        """
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest('Must provide query string.'))
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        compiled = compile_document(schema, query, self.validation_rules)
+        if compiled.document is None:
+            return ExecutionResult(errors=compiled.errors)
+
+        operation_ast = get_operation_ast(compiled.document, operation_name)
+        log_operation_cost(compiled, operation_ast)
+        if request.method.lower() == 'get' and operation_ast is not None and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'], f'Can only perform a {operation_ast.operation.value} operation from a POST request.',
+            ))
+
+        if compiled.errors:
+            return ExecutionResult(data=None, errors=compiled.errors)
+
+        name = None
+        if operation_ast is not None:
+            name = operation_ast.name.value if operation_ast.name else None
+
+        profile = request.graphql_profile = OperationProfile()
+        try:
+            with connection.execute_wrapper(profile):
+                return self.execute_document(request, schema, compiled.document, operation_ast, variables, operation_name)
+        finally:
+            profile.finish()
+            record_operation(name, profile)
+
+    def execute_document(self, request, schema, document, operation_ast, variables, operation_name):
+        try:
+            execute_options = {
+                'root_value': self.get_root_value(request),
+                'context_value': self.get_context(request),
+                'variable_values': variables,
+                'operation_name': operation_name,
+                'middleware': self.get_middleware(request),
+            }
+            if self.execution_context_class:
+                execute_options['execution_context_class'] = self.execution_context_class
+
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+
+        extensions = request.GET.get('extensions') or data.get('extensions') or {}
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest('Extensions are invalid JSON.'))
+
+        return self.resolve_query(query, extensions.get('persistedQuery')), variables, operation_name, id
+
+    def resolve_query(self, query, persisted):
+        """
+        Returns the text of the query to run, following the automatic persisted
+        queries protocol: a client sends only the hash of a query, and the
+        query along with its hash once the server answers PersistedQueryNotFound.
+        """
+        allow_list = settings.GRAPHQL_PERSISTED_QUERIES['ALLOW_LIST']
+        if persisted is None:
+            if query and allow_list and get_persisted_query(query_hash(query)) is None:
+                raise HttpError(HttpResponseForbidden(), 'Query is not on the allow list.')
+            return query
+
+        sha256_hash = persisted.get('sha256Hash')
+        if not query:
+            query = get_persisted_query(sha256_hash)
+            if query is None:
+                # Answered with 200 so that clients retry with the query text
+                raise HttpError(HttpResponse(), 'PersistedQueryNotFound')
+            return query
+
+        if query_hash(query) != sha256_hash:
+            raise HttpError(HttpResponseBadRequest('Provided sha256Hash does not match query.'))
+        if get_persisted_query(sha256_hash) is None:
+            if allow_list:
+                raise HttpError(HttpResponseForbidden(), 'Query is not on the allow list.')
+            # Invalid queries run to report their errors but are not stored
+            compiled = compile_document(self.schema.graphql_schema, query, self.validation_rules)
+            if compiled.document is not None and not compiled.errors:
+                persist_query(query)
+        return query
+
+    def is_anonymous(self, request):
+        return (
+            not request.user.is_authenticated
+            and not request.META.get('HTTP_AUTHORIZATION')
+            and jwt_settings.JWT_COOKIE_NAME not in request.COOKIES
+        )
+
+    def get_read(self, request, data):
+        """
+        Returns the query of the request with the versions of the models it
+        reads, or None for requests that are not a valid query. The result
+        is kept on the request, which is checked and cached in several steps.
+        """
+        if not hasattr(request, 'graphql_read'):
+            request.graphql_read = self.read_query(request, data)
+        return request.graphql_read
+
+    def read_query(self, request, data):
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        if not query:
+            return None
+
+        schema = self.schema.graphql_schema
+        compiled = compile_document(schema, query, self.validation_rules)
+        if compiled.document is None or compiled.errors:
+            return None
+
+        operation_ast = get_operation_ast(compiled.document, operation_name)
+        if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            return None
+
+        versions = get_tag_versions(get_cache_tags(schema, compiled.document))
+        return QueryRead(compiled, operation_ast, variables, operation_name, versions)
+
+    def get_cache_key(self, request, data, show_graphiql=False):
+        """
+        Returns None for requests whose response must not be shared.
+        """
+        if not self.cache_timeout or not self.is_anonymous(request):
+            return None
+
+        read = self.get_read(request, data)
+        if read is None:
+            return None
+
+        key = json.dumps([
+            print_ast(read.compiled.document),
+            read.variables or {},
+            read.operation_name,
+            sorted(read.versions.items()),
+            bool(show_graphiql or self.pretty or request.GET.get('pretty')),
+        ], sort_keys=True)
+        return 'graphql:response:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+class AsyncSarGraphQLView(SarGraphQLView):
+    """
+    Serves /graphql/ under ASGI. Queries execute on the event loop: root
+    resolvers load their rows with the async ORM and related rows come from
+    async DataLoaders, so one worker interleaves many requests.
+
+    Mutations, batches, GraphiQL and timed responses go through the
+    synchronous view in a thread.
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await self.get_user(request)
+        etag = await sync_to_async(self.get_etag)(request)
+        if etag is None:
+            return await self.dispatch_query(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag)
+        if response is None:
+            response = await self.dispatch_query(request, *args, **kwargs)
+        return self.add_etag(request, response, etag)
+
+    async def dispatch_query(self, request, *args, **kwargs):
+        # The synchronous view without the ETag, already checked
+        dispatch = sync_to_async(super(SarGraphQLView, self).dispatch)
+        try:
+            if request.method.lower() not in ('get', 'post'):
+                return await dispatch(request, *args, **kwargs)
+
+            data = self.parse_body(request)
+            prepared = await sync_to_async(self.prepare_query)(request, data)
+            if prepared is None:
+                return await dispatch(request, *args, **kwargs)
+
+            compiled, operation_name, variables, cache_key, cached = prepared
+            if cached is not None:
+                result, status_code = cached
+            else:
+                request.graphql_cacheable = True
+                result, status_code = await self.get_async_response(request, compiled, variables, operation_name)
+                if cache_key is not None and status_code == 200 and request.graphql_cacheable:
+                    await cache.aset(cache_key, (result, status_code), self.cache_timeout)
+
+            return HttpResponse(status=status_code, content=result, content_type='application/json')
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+
+    async def get_user(self, request):
+        # Authenticated before execution, the JWT middleware would query in the event loop
+        user = await request.auser() if hasattr(request, 'auser') else request.user
+        if not user.is_authenticated and request.META.get('HTTP_AUTHORIZATION'):
+            user = await sync_to_async(authenticate)(request=request) or user
+        return user
+
+    def get_middleware(self, request):
+        return [middleware for middleware in super().get_middleware(request) if not isinstance(middleware, JSONWebTokenMiddleware)]
+
+    def prepare_query(self, request, data):
+        """
+        Returns the compiled document, parameters, response cache key and
+        cached response of a query to execute asynchronously, or None for
+        requests the synchronous view serves.
+        """
+        if self.batch or request.META.get('HTTP_X_GRAPHQL_TIMING') or (self.graphiql and self.can_display_graphiql(request, data)):
+            return None
+
+        read = self.get_read(request, data)
+        if read is None:
+            return None
+        log_operation_cost(read.compiled, read.operation)
+
+        cache_key = self.get_cache_key(request, data)
+        cached = None
+        if cache_key is not None:
+            cached = cache.get(cache_key)
+            record('misses' if cached is None else 'hits')
+        return read.compiled, read.operation_name, read.variables, cache_key, cached
+
+    async def get_async_response(self, request, compiled, variables, operation_name):
+        operation_ast = get_operation_ast(compiled.document, operation_name)
+        name = operation_ast.name.value if operation_ast.name else None
+
+        request.graphql_async = True
+        profile = request.graphql_profile = OperationProfile()
+        await sync_to_async(add_execute_wrapper)(profile)
+        try:
+            result = execute(
+                self.schema.graphql_schema, compiled.document,
+                root_value=self.get_root_value(request),
+                context_value=self.get_context(request),
+                variable_values=variables,
+                operation_name=operation_name,
+                middleware=self.get_middleware(request),
+                execution_context_class=self.execution_context_class,
+            )
+            if isawaitable(result):
+                result = await result
+        except Exception as e:
+            result = ExecutionResult(errors=[e])
+        finally:
+            await sync_to_async(remove_execute_wrapper)(profile)
+            profile.finish()
+            record_operation(name, profile)
+
+        response = {}
+        status_code = 200
+        if result.errors:
+            request.graphql_cacheable = False
+            response['errors'] = [self.format_error(e) for e in result.errors]
+        if result.errors and any(not getattr(e, 'path', None) for e in result.errors):
+            status_code = 400
+        else:
+            response['data'] = result.data
+        return self.json_encode(request, response), status_code
+
+
+# The ORM of async operations runs in the thread of sync_to_async, whose
+# connection is only reachable from that thread
+
+def add_execute_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def remove_execute_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+def graphql_cache_stats(request):
+    if not request.user.is_superuser:
+        return JsonResponse({
+            "success": False,
+            "message": "You are not authorized to perform this action."
+        }, status=401)
+
+    return JsonResponse(get_stats())
+
+
+def graphql_metrics(request):
+    """
+    Exposes the GraphQL metrics of this process to Prometheus, which
+    authenticates with the METRICS_TOKEN bearer token.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not request.user.is_superuser and not (token and constant_time_compare(authorization, f'Bearer {token}')):
+        return JsonResponse({
+            "success": False,
+            "message": "You are not authorized to perform this action."
+        }, status=401)
+
+    return HttpResponse(render_prometheus(get_stats()), content_type='text/plain; version=0.0.4')